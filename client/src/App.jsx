@@ -11,6 +11,32 @@ import { PanoramaIcon, WarningIcon } from "@phosphor-icons/react";
 
 const ACCEPTED = ["image/jpeg", "image/png", "image/jpg", "image/webp"];
 
+// Lets the server reuse cached pipeline stages while parameters are tweaked
+const newSessionId = () =>
+  globalThis.crypto?.randomUUID?.() ?? Math.random().toString(36).slice(2);
+
+// The UI shows a downscaled preview; the full-size result is fetched only for download
+const PREVIEW_SIZE = 1280;
+// Seconds the server holds each job status request open while the full-size job runs
+const JOB_WAIT_SECONDS = 25;
+
+// Target of the preview response's Link header with this rel ("full" result, "full-status" job)
+const linkUrl = (res, rel) => {
+  const match = new RegExp(`<([^>]+)>;\\s*rel="${rel}"`).exec(res.headers.get("Link") || "");
+  return match ? `/api${match[1]}` : null;
+};
+
+// Long-polls a job until it leaves "pending"; true when it finished successfully
+const waitForJob = async (statusUrl, isCurrent) => {
+  while (isCurrent()) {
+    const res = await fetch(`${statusUrl}?wait=${JOB_WAIT_SECONDS}`);
+    if (!res.ok) return false;
+    const { status } = await res.json();
+    if (status !== "pending") return status === "done";
+  }
+  return false;
+};
+
 const safeReadError = async (res) => {
   try {
     const data = await res.json();
@@ -35,6 +61,9 @@ const App = () => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
   const [resultUrl, setResultUrl] = useState(null);
+  const [downloadUrl, setDownloadUrl] = useState(null);
+  // Full-size download: "pending" while its job runs, "ready", or "preview" when only the preview is available
+  const [fullResult, setFullResult] = useState(null);
 
   // Options
   const [sigma, setSigma] = useState(2.0);
@@ -47,6 +76,9 @@ const App = () => {
   const [ransacThresh, setRansacThresh] = useState(1.0);
 
   const anchorRef = useRef(null);
+  const sessionIdRef = useRef(newSessionId());
+  // Bumped by every stitch and reset, so a full-size job still being polled for an older result is ignored
+  const requestRef = useRef(0);
 
   const handleUpload = (setter, setPreview) => (e) => {
     const file = e.target.files?.[0];
@@ -62,6 +94,7 @@ const App = () => {
       URL.revokeObjectURL(resultUrl);
       setResultUrl(null);
     }
+    requestRef.current += 1;
   };
 
   const resetAll = () => {
@@ -73,8 +106,38 @@ const App = () => {
     setPreview1(null);
     setPreview2(null);
     setResultUrl(null);
+    setDownloadUrl(null);
+    setFullResult(null);
     setError("");
     setLoading(false);
+    requestRef.current += 1;
+  };
+
+  // Download stays disabled until the full-size job is done; without one, the preview is offered
+  const awaitFullResult = (res, previewUrl) => {
+    const requestId = ++requestRef.current;
+    const isCurrent = () => requestRef.current === requestId;
+    const fullUrl = linkUrl(res, "full");
+    const statusUrl = linkUrl(res, "full-status");
+    const usePreview = () => {
+      if (!isCurrent()) return;
+      setDownloadUrl(previewUrl);
+      setFullResult("preview");
+    };
+    if (!fullUrl || !statusUrl) {
+      usePreview();
+      return;
+    }
+    setDownloadUrl(null);
+    setFullResult("pending");
+    waitForJob(statusUrl, isCurrent)
+      .then((done) => {
+        if (!done) return usePreview();
+        if (!isCurrent()) return;
+        setDownloadUrl(fullUrl);
+        setFullResult("ready");
+      })
+      .catch(usePreview);
   };
 
   const stitch = async () => {
@@ -97,9 +160,11 @@ const App = () => {
       formData.append("numMatches", String(numMatches));
       formData.append("ransacIters", String(ransacIters));
       formData.append("ransacThresh", String(ransacThresh));
+      formData.append("preview", String(PREVIEW_SIZE));
 
       const res = await fetch("/api/stitch", {
         method: "POST",
+        headers: { "X-Session-Id": sessionIdRef.current },
         body: formData
       });
 
@@ -113,6 +178,7 @@ const App = () => {
       if (resultUrl) URL.revokeObjectURL(resultUrl);
       const url = URL.createObjectURL(blob);
       setResultUrl(url);
+      awaitFullResult(res, url);
 
       setTimeout(() => anchorRef.current?.focus(), 0);
     } catch (err) {
@@ -194,7 +260,13 @@ const App = () => {
         {resultUrl && (
           <Row className="justify-content-center mb-5">
             <Col xs={12} sm={11} lg={10} className="d-flex justify-content-center">
-              <ResultCard resultUrl={resultUrl} anchorRef={anchorRef} />
+              <ResultCard
+                resultUrl={resultUrl}
+                downloadUrl={downloadUrl}
+                fullResult={fullResult}
+                previewSize={PREVIEW_SIZE}
+                anchorRef={anchorRef}
+              />
             </Col>
           </Row>
         )}
@@ -1,9 +1,13 @@
-import { Card, Button } from "react-bootstrap";
+import { Card, Button, Spinner } from "react-bootstrap";
 import { Download } from "react-bootstrap-icons";
 
-const ResultCard = ({ resultUrl, anchorRef }) => {
+// fullResult is "pending" while the full-size job runs (download disabled), "ready", or "preview"
+// when only the downscaled preview can be downloaded
+const ResultCard = ({ resultUrl, downloadUrl, fullResult, previewSize, anchorRef }) => {
   if (!resultUrl) return null;
 
+  const pending = fullResult === "pending";
+
   return (
     <Card
       className="shadow-lg rounded-4 p-2 px-sm-2 px-md-3 py-sm-3 dirty-white-bg borderless"
@@ -20,20 +24,35 @@ const ResultCard = ({ resultUrl, anchorRef }) => {
           className="img-fluid rounded mb-4"
         />
 
-        <div className="d-flex justify-content-end">
-          <a
-            ref={anchorRef}
-            href={resultUrl}
-            download="stitched.jpg"
-            className="text-decoration-none mb-0"
-          >
+        <div className="d-flex justify-content-end align-items-center gap-3">
+          {fullResult === "preview" && (
+            <span className="text-muted small text-end">
+              The full-size result is unavailable right now; the download is the {previewSize} px preview.
+            </span>
+          )}
+          {pending ? (
             <Button
               className="d-flex justify-content-center align-items-center gap-2"
               size="lg"
+              disabled
             >
-              <Download /> Download
+              <Spinner animation="border" size="sm" /> Preparing full size
             </Button>
-          </a>
+          ) : (
+            <a
+              ref={anchorRef}
+              href={downloadUrl ?? resultUrl}
+              download="stitched.jpg"
+              className="text-decoration-none mb-0"
+            >
+              <Button
+                className="d-flex justify-content-center align-items-center gap-2"
+                size="lg"
+              >
+                <Download /> Download
+              </Button>
+            </a>
+          )}
         </div>
       </Card.Body>
     </Card>
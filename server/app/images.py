@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import time
+
+# Images registered with POST /images, stored on disk by id (the SHA-256 of their bytes) for later
+# stitches. Unlike the result cache the registry never evicts one image to make room for another:
+# an image is kept until ttlSeconds after it was last registered (registering it again renews it),
+# and a registration that would take the store past maxBytes is refused with RegistryFullError
+# once expired images are cleared. A directory belongs to one server process, as the result cache's does.
+
+DEFAULT_IMAGE_TTL_SECONDS = 7 * 24 * 3600
+
+
+class RegistryFullError(RuntimeError):
+  pass
+
+
+class ImageRegistry:
+  def __init__(self, directory, maxBytes, ttlSeconds=DEFAULT_IMAGE_TTL_SECONDS):
+    self.directory = directory
+    self.maxBytes = maxBytes
+    self.ttlSeconds = ttlSeconds
+    self._lock = threading.Lock()
+    # id -> metadata ({"mediaType", "bytes", "expiresAt", and "width" / "height" when known})
+    self._entries = {}
+    self._usedBytes = 0
+    os.makedirs(directory, exist_ok=True)
+    self._loadIndex()
+
+  def _paths(self, imageId):
+    return os.path.join(self.directory, imageId + ".bin"), os.path.join(self.directory, imageId + ".json")
+
+  # Entries are complete once their metadata file exists, as it is written last; leftovers of
+  # interrupted writes and images that expired while the server was down are removed
+  def _loadIndex(self):
+    names = set(os.listdir(self.directory))
+    for name in names:
+      imageId, ext = os.path.splitext(name)
+      if ext == ".tmp" or (ext == ".bin" and imageId + ".json" not in names):
+        self._removeFile(os.path.join(self.directory, name))
+      elif ext == ".json":
+        try:
+          with open(os.path.join(self.directory, name)) as f:
+            meta = json.load(f)
+          meta["bytes"] = os.path.getsize(self._paths(imageId)[0])
+        except (OSError, ValueError):
+          self._removeFiles(imageId)
+          continue
+        self._entries[imageId] = meta
+        self._usedBytes += meta["bytes"]
+    self._expire(time.time())
+
+  def _removeFile(self, path):
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+
+  def _removeFiles(self, imageId):
+    for path in self._paths(imageId):
+      self._removeFile(path)
+
+  def _remove(self, imageId):
+    self._usedBytes -= self._entries.pop(imageId)["bytes"]
+    self._removeFiles(imageId)
+
+  def _expire(self, now):
+    for imageId in [imageId for imageId, meta in self._entries.items() if meta["expiresAt"] <= now]:
+      self._remove(imageId)
+
+  def _writeMeta(self, imageId, meta):
+    metaPath = self._paths(imageId)[1]
+    with open(metaPath + ".tmp", "w") as f:
+      json.dump({key: value for key, value in meta.items() if key != "bytes"}, f)
+    os.replace(metaPath + ".tmp", metaPath)
+
+  # Stores the image, or renews it if already registered, and returns (metadata, created).
+  # size is {"width", "height"} when known, else {}.
+  def register(self, imageId, data, mediaType, size):
+    with self._lock:
+      now = time.time()
+      self._expire(now)
+      meta = self._entries.get(imageId)
+      if meta is not None:
+        meta["expiresAt"] = now + self.ttlSeconds
+        self._writeMeta(imageId, meta)
+        return dict(meta), False
+      if self._usedBytes + len(data) > self.maxBytes:
+        raise RegistryFullError(f"image registry is full ({self.maxBytes} bytes)")
+      meta = {"mediaType": mediaType, "bytes": len(data), **size, "expiresAt": now + self.ttlSeconds}
+      contentPath = self._paths(imageId)[0]
+      with open(contentPath + ".tmp", "wb") as f:
+        f.write(data)
+      os.replace(contentPath + ".tmp", contentPath)
+      self._writeMeta(imageId, meta)
+      self._entries[imageId] = meta
+      self._usedBytes += len(data)
+      return dict(meta), True
+
+  # The image's metadata, or None if it was never registered or has expired
+  def info(self, imageId):
+    with self._lock:
+      self._expire(time.time())
+      meta = self._entries.get(imageId)
+      return None if meta is None else dict(meta)
+
+  # (bytes, metadata) of a registered image, or None
+  def get(self, imageId):
+    with self._lock:
+      self._expire(time.time())
+      meta = self._entries.get(imageId)
+      if meta is None:
+        return None
+      try:
+        with open(self._paths(imageId)[0], "rb") as f:
+          data = f.read()
+      except FileNotFoundError:
+        self._remove(imageId)
+        return None
+      return data, dict(meta)
+
+  @property
+  def usedBytes(self):
+    return self._usedBytes
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Stitch jobs are addressed by a hash of their inputs and parameters, so the job id doubles as the
+# cache key and the result ETag. Identical submissions share one job; finished results live in a
+# two-tier (memory, then disk) LRU cache.
+
+JOB_PENDING = "pending"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+# Finished job records kept for status queries; results outlive them in the cache
+MAX_JOB_RECORDS = 1024
+
+
+# datas are encoded bytes, or uploads carrying the SHA-256 of theirs (workers.SharedUpload)
+def cacheKey(mode, datas, params):
+  digest = hashlib.sha256(mode.encode())
+  for data in datas:
+    digest.update(getattr(data, "sha256", None) or hashlib.sha256(data).digest())
+  digest.update(json.dumps(params, sort_keys=True).encode())
+  return digest.hexdigest()
+
+# Response headers derived from pipeline stats; stored with the result since stats are not kept
+def statsHeaders(mode, stats):
+  if mode == "multi":
+    return {
+      "X-Reference-Frame": str(stats["referenceFrame"]),
+      "X-Stitched-Frames": ",".join(map(str, stats["stitchedFrames"])),
+      "X-Dropped-Frames": ",".join(map(str, stats["droppedFrames"])),
+    }
+  return {
+    "X-Ransac-Iterations": str(stats["ransacIterations"]),
+    "X-Ransac-Inliers": str(stats["ransacInliers"]),
+  }
+
+
+# LRU over (content, media, headers) results, bounded by bytes in memory and on disk.
+# Entries evicted from memory stay on disk and are promoted back on the next hit.
+class ResultCache:
+  def __init__(self, memoryBytes, diskDir=None, diskBytes=0):
+    self.memoryBytes = memoryBytes
+    self.diskDir = diskDir if diskDir and diskBytes > 0 else None
+    self.diskBytes = diskBytes
+    self._lock = threading.Lock()
+    self._memory = OrderedDict()
+    self._memoryUsed = 0
+    self._disk = OrderedDict()
+    self._diskUsed = 0
+    if self.diskDir is not None:
+      os.makedirs(self.diskDir, exist_ok=True)
+      self._loadDiskIndex()
+
+  # Rebuild the disk LRU order from file mtimes, which reads refresh
+  def _loadDiskIndex(self):
+    entries = []
+    for name in os.listdir(self.diskDir):
+      if name.endswith(".bin"):
+        path = os.path.join(self.diskDir, name)
+        entries.append((os.path.getmtime(path), name[:-4], os.path.getsize(path)))
+    for _, key, size in sorted(entries):
+      self._disk[key] = size
+      self._diskUsed += size
+
+  def _paths(self, key):
+    return os.path.join(self.diskDir, key + ".bin"), os.path.join(self.diskDir, key + ".json")
+
+  def _putMemory(self, key, result):
+    size = len(result[0])
+    if size > self.memoryBytes:
+      return
+    if key in self._memory:
+      self._memoryUsed -= len(self._memory.pop(key)[0])
+    self._memory[key] = result
+    self._memoryUsed += size
+    while self._memoryUsed > self.memoryBytes:
+      _, evicted = self._memory.popitem(last=False)
+      self._memoryUsed -= len(evicted[0])
+
+  def _removeDisk(self, key):
+    self._diskUsed -= self._disk.pop(key)
+    for path in self._paths(key):
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+
+  def _putDisk(self, key, result):
+    content, media, headers = result
+    if self.diskDir is None or len(content) > self.diskBytes or key in self._disk:
+      return
+    contentPath, metaPath = self._paths(key)
+    # Write under temporary names so a crash never leaves a truncated entry behind
+    with open(contentPath + ".tmp", "wb") as f:
+      f.write(content)
+    with open(metaPath + ".tmp", "w") as f:
+      json.dump({"media": media, "headers": headers}, f)
+    os.replace(metaPath + ".tmp", metaPath)
+    os.replace(contentPath + ".tmp", contentPath)
+    self._disk[key] = len(content)
+    self._diskUsed += len(content)
+    while self._diskUsed > self.diskBytes:
+      self._removeDisk(next(iter(self._disk)))
+
+  def _getDisk(self, key):
+    contentPath, metaPath = self._paths(key)
+    try:
+      with open(metaPath) as f:
+        meta = json.load(f)
+      with open(contentPath, "rb") as f:
+        content = f.read()
+    except (FileNotFoundError, ValueError):
+      self._removeDisk(key)
+      return None
+    os.utime(contentPath)
+    self._disk.move_to_end(key)
+    return content, meta["media"], meta["headers"]
+
+  def contains(self, key):
+    with self._lock:
+      return key in self._memory or key in self._disk
+
+  def get(self, key):
+    with self._lock:
+      if key in self._memory:
+        self._memory.move_to_end(key)
+        return self._memory[key]
+      if key not in self._disk:
+        return None
+      result = self._getDisk(key)
+      if result is not None:
+        self._putMemory(key, result)
+      return result
+
+  def put(self, key, result):
+    with self._lock:
+      self._putMemory(key, result)
+      self._putDisk(key, result)
+
+
+class Job:
+  def __init__(self, key, mode):
+    self.id = key
+    self.mode = mode
+    self.status = JOB_PENDING
+    self.error = None
+    self.createdAt = time.time()
+    self.finishedAt = None
+    self.task = None
+    # Worker profile of the computation, None for jobs answered from the result cache
+    self.profile = None
+    # A result the cache would not take (larger than its budgets), held until it is fetched
+    self.heldResult = None
+    self.waiters = 0
+    self.done = asyncio.Event()
+
+  def finish(self, error=None):
+    self.status = JOB_FAILED if error is not None else JOB_DONE
+    self.error = error
+    self.finishedAt = time.time()
+    self.done.set()
+
+
+# Submits stitch jobs to the worker pool, merging identical in-flight submissions and serving
+# repeats from the cache. Failed jobs are not cached, and neither are results evicted since, so
+# resubmitting either computes it again.
+class JobManager:
+  def __init__(self, pool, cache, metrics=None):
+    self.pool = pool
+    self.cache = cache
+    self.metrics = metrics
+    self._jobs = OrderedDict()
+
+  def _countJob(self, mode, outcome):
+    if self.metrics is not None:
+      self.metrics.countJob(mode, outcome)
+
+  # Returns the job for these inputs, creating it only if nothing cached or running matches, and
+  # whether this submission started its computation (False when merged or served from the cache).
+  # Raises the pool's PoolBusyError when a new job cannot be admitted. The session only picks the
+  # worker whose stage cache to use, so it is not part of the key. refresh recomputes a cached
+  # result (used for profiling), traceMemory adds peak memory to the job's profile.
+  def submit(self, mode, datas, params, session=None, *, refresh=False, traceMemory=False):
+    key = cacheKey(mode, datas, params)
+    job = self._jobs.get(key)
+    if job is not None and job.status == JOB_PENDING:
+      self._countJob(mode, "merged")
+      return job, False
+    if job is not None and job.status == JOB_DONE and not refresh and self._hasResult(job):
+      self._countJob(mode, "cached")
+      return job, False
+
+    job = Job(key, mode)
+    started = refresh or not self.cache.contains(key)
+    if not started:
+      self._countJob(mode, "cached")
+      job.finish()
+    else:
+      try:
+        work = self.pool.run(mode, datas, params, session, traceMemory)
+      except Exception:
+        self._countJob(mode, "rejected")
+        raise
+      job.task = asyncio.create_task(self._run(job, work))
+    self._remember(job)
+    return job, started
+
+  def _hasResult(self, job):
+    return job.heldResult is not None or self.cache.contains(job.id)
+
+  def _remember(self, job):
+    self._jobs[job.id] = job
+    self._jobs.move_to_end(job.id)
+    while len(self._jobs) > MAX_JOB_RECORDS:
+      oldest = next(iter(self._jobs.values()))
+      if oldest.status == JOB_PENDING:
+        break
+      self._jobs.popitem(last=False)
+
+  async def _run(self, job, work):
+    try:
+      content, media, stats = await work
+      job.profile = stats.pop("profile", None)
+      result = (content, media, statsHeaders(job.mode, stats))
+      await asyncio.to_thread(self.cache.put, job.id, result)
+      if not self.cache.contains(job.id):
+        job.heldResult = result
+    except Exception as e:
+      self._countJob(job.mode, "failed")
+      job.finish(e)
+    else:
+      self._countJob(job.mode, "computed")
+      if self.metrics is not None and job.profile is not None:
+        self.metrics.observeProfile(job.mode, job.profile)
+      job.finish()
+
+  # Known job, or a finished one whose record has aged out but whose result is still cached
+  def get(self, key):
+    job = self._jobs.get(key)
+    if job is None and self.cache.contains(key):
+      job = Job(key, None)
+      job.finish()
+    return job
+
+  # None when the result has left the cache; submitting the job again recomputes it
+  async def result(self, job):
+    job.waiters += 1
+    try:
+      await job.done.wait()
+    finally:
+      job.waiters -= 1
+    if job.error is not None:
+      raise job.error
+    if job.heldResult is not None:
+      result = job.heldResult
+      # Every caller already waiting gets it; the last one releases it
+      if job.waiters == 0:
+        job.heldResult = None
+      return result
+    return await asyncio.to_thread(self.cache.get, job.id)
+
+  async def shutdown(self):
+    tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,64 +1,645 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import Response
-import cv2
-import numpy as np
-from app.stitcher import stitchImages
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from fastapi import Depends, FastAPI, UploadFile, File, Form, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from app.stitcher.features import CORNER_SELECTIONS, FEATURE_PRECISIONS
+from app.stitcher.matching import MATCH_METHODS, MATCH_INDEXES
+from app.stitcher.geometry import RANSAC_SAMPLINGS
+from app.stitcher.blending import BLEND_MODES, CanvasTooLargeError, DEFAULT_MAX_CANVAS_PIXELS
+from app.stitcher.featurestore import DEFAULT_FEATURE_STORE_BYTES, FeatureStore
+from app.stitcher.stagecache import DEFAULT_STAGE_CACHE_BYTES
+from app.stitcher.streaming import DEFAULT_SEARCH_RADIUS
+from app.workers import (
+  StitchPool, PoolBusyError, DeadlineExceededError, ImageDecodeError, ImageTooLargeError, SharedUpload,
+  UploadTooLargeError, checkImageHeader, OUTPUT_FORMATS, DEFAULT_OUTPUT,
+)
+from app.jobs import JobManager, ResultCache, JOB_DONE, JOB_FAILED, cacheKey
+from app.images import DEFAULT_IMAGE_TTL_SECONDS, ImageRegistry, RegistryFullError
+from app.metrics import StitchMetrics
 
-app = FastAPI(title="image-stitcher", version="0.2.2")
+# Server-side limit, not a client parameter: canvases above it are rejected before blending
+MAX_CANVAS_PIXELS = int(os.environ.get("STITCH_MAX_CANVAS_PIXELS", DEFAULT_MAX_CANVAS_PIXELS))
+MAX_MULTI_IMAGES = 30
+# Corners kept per image unless the client sets maxCorners (0 keeps all, as before the cap existed), and
+# how a capped set is chosen (see features.selectCorners)
+DEFAULT_MAX_CORNERS = 0
+DEFAULT_CORNER_SELECTION = "strongest"
+# Feature precision unless the client sets featurePrecision. "float32" matches float64 on the benchmark
+# pairs at lower cost (benchmarks.bench_precision) and "uint8" additionally quantizes descriptors, a
+# quarter of float32's size in the stage cache; both are opt-in, so default results stay as they were.
+DEFAULT_FEATURE_PRECISION = "float64"
+# Per-upload limits: encoded size, checked before an upload is copied out of the parsed form, and
+# pixel count, checked from the image header before any decode
+MAX_UPLOAD_BYTES = int(os.environ.get("STITCH_MAX_UPLOAD_BYTES", 64 * 2**20))
+MAX_IMAGE_PIXELS = int(os.environ.get("STITCH_MAX_IMAGE_PIXELS", 120_000_000))
+# Stitch worker processes (default: CPU count), jobs allowed to wait beyond them, and per-job deadline
+STITCH_WORKERS = int(os.environ.get("STITCH_WORKERS", 0)) or None
+STITCH_QUEUE_SIZE = int(os.environ["STITCH_QUEUE_SIZE"]) if "STITCH_QUEUE_SIZE" in os.environ else None
+STITCH_DEADLINE_SECONDS = float(os.environ.get("STITCH_DEADLINE_SECONDS", 60.0))
+# Result cache: in-memory LRU in front of a size-bounded disk tier (an empty dir disables it)
+STITCH_CACHE_MEMORY_BYTES = int(os.environ.get("STITCH_CACHE_MEMORY_BYTES", 256 * 2**20))
+STITCH_CACHE_DIR = os.environ.get("STITCH_CACHE_DIR", os.path.join(tempfile.gettempdir(), "image-stitcher-cache"))
+STITCH_CACHE_DISK_BYTES = int(os.environ.get("STITCH_CACHE_DISK_BYTES", 2 * 2**30))
+# Per-session stage caches kept by each worker, so parameter tweaks only rerun downstream stages
+STITCH_STAGE_CACHE_BYTES = int(os.environ.get("STITCH_STAGE_CACHE_BYTES", DEFAULT_STAGE_CACHE_BYTES))
+STITCH_STAGE_CACHE_SESSIONS = int(os.environ.get("STITCH_STAGE_CACHE_SESSIONS", 4))
+MAX_SESSION_ID_LENGTH = 128
+# Per-image features (keypoints and descriptors) persisted across requests and shared by all workers
+STITCH_FEATURE_STORE_DIR = os.environ.get(
+  "STITCH_FEATURE_STORE_DIR", os.path.join(tempfile.gettempdir(), "image-stitcher-features")
+)
+STITCH_FEATURE_STORE_BYTES = int(os.environ.get("STITCH_FEATURE_STORE_BYTES", DEFAULT_FEATURE_STORE_BYTES))
+# Images registered with POST /images, stored once and stitched by id afterwards (an empty dir disables it).
+# Each is kept for the TTL after its last registration; registrations beyond the byte limit are refused.
+STITCH_IMAGE_STORE_DIR = os.environ.get("STITCH_IMAGE_STORE_DIR", os.path.join(tempfile.gettempdir(), "image-stitcher-images"))
+STITCH_IMAGE_STORE_BYTES = int(os.environ.get("STITCH_IMAGE_STORE_BYTES", 4 * 2**30))
+STITCH_IMAGE_TTL_SECONDS = float(os.environ.get("STITCH_IMAGE_TTL_SECONDS", DEFAULT_IMAGE_TTL_SECONDS))
+# Stitch a tiny synthetic pair in every worker at startup, with the params a default /stitch request
+# uses; GET /ready answers 503 until all workers are warm. 0 leaves workers cold until their first job.
+STITCH_WARMUP = os.environ.get("STITCH_WARMUP", "1") == "1"
+WARMUP_PARAMS = dict(
+  maxCorners=DEFAULT_MAX_CORNERS or None, cornerSelection=DEFAULT_CORNER_SELECTION, featurePrecision=DEFAULT_FEATURE_PRECISION,
+  maxDescriptorMatches=100,
+)
+# Send per-stage durations of the computation behind each /stitch response as Server-Timing
+STITCH_SERVER_TIMING = os.environ.get("STITCH_SERVER_TIMING", "0") == "1"
+JOB_WAIT_MAX_SECONDS = 30.0
+JOB_HEARTBEAT_SECONDS = 15.0
+# Job results are content-addressed, so a fetched result never changes
+RESULT_CACHE_CONTROL = "private, max-age=31536000, immutable"
 
-def _readImg(upload):
-  data = upload.file.read()
-  if not data:
-    raise ValueError("empty upload")
-  arr = np.frombuffer(data, dtype=np.uint8)
-  img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-  if img is None:
-    raise ValueError("could not decode image")
-  return img
+@asynccontextmanager
+async def lifespan(app):
+  # Before any worker starts writing features
+  if STITCH_FEATURE_STORE_DIR and STITCH_FEATURE_STORE_BYTES > 0:
+    FeatureStore(STITCH_FEATURE_STORE_DIR, STITCH_FEATURE_STORE_BYTES).sweepTemporary()
+  app.state.pool = StitchPool(
+    STITCH_WORKERS, STITCH_QUEUE_SIZE, STITCH_DEADLINE_SECONDS, STITCH_STAGE_CACHE_BYTES, STITCH_STAGE_CACHE_SESSIONS,
+    MAX_IMAGE_PIXELS, STITCH_FEATURE_STORE_DIR, STITCH_FEATURE_STORE_BYTES, WARMUP_PARAMS if STITCH_WARMUP else None,
+  )
+  # Runs in the background so the server accepts requests (and answers /ready) while workers warm up
+  app.state.warmUp = asyncio.create_task(app.state.pool.warmUp())
+  cache = ResultCache(STITCH_CACHE_MEMORY_BYTES, STITCH_CACHE_DIR, STITCH_CACHE_DISK_BYTES)
+  app.state.images = None
+  if STITCH_IMAGE_STORE_DIR and STITCH_IMAGE_STORE_BYTES > 0:
+    app.state.images = ImageRegistry(STITCH_IMAGE_STORE_DIR, STITCH_IMAGE_STORE_BYTES, STITCH_IMAGE_TTL_SECONDS)
+  app.state.metrics = StitchMetrics()
+  app.state.jobs = JobManager(app.state.pool, cache, app.state.metrics)
+  yield
+  app.state.warmUp.cancel()
+  await app.state.jobs.shutdown()
+  app.state.pool.shutdown()
 
+app = FastAPI(title="image-stitcher", version="0.2.2", lifespan=lifespan)
 
-@app.post("/stitch")
-def stitch_endpoint(
-  image1: UploadFile = File(...),
-  image2: UploadFile = File(...),
+# Form uploads copied chunk by chunk from their spooled files into shared memory, where the pool's
+# workers decode them. Released when the block exits; jobs submitted inside it keep their own reference.
+@asynccontextmanager
+async def _sharedUploads(uploads):
+  shared = []
+  try:
+    for upload in uploads:
+      if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"upload exceeds {MAX_UPLOAD_BYTES} bytes")
+      try:
+        shared.append(await asyncio.to_thread(SharedUpload.fromFile, upload.file, MAX_UPLOAD_BYTES))
+      except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+      if shared[-1].size == 0:
+        raise HTTPException(status_code=422, detail="empty upload")
+      try:
+        shared[-1].header(MAX_IMAGE_PIXELS)
+      except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    yield shared
+  finally:
+    for upload in shared:
+      upload.release()
+
+# HTTP error for a failed stitch. Pipeline ValueErrors are client errors for multi-image jobs,
+# where frames that do not register are the caller's input; for pairs they stay server errors.
+def _stitchError(e, mode):
+  if isinstance(e, PoolBusyError):
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retryAfter)})
+  if isinstance(e, DeadlineExceededError):
+    return HTTPException(status_code=504, detail=str(e))
+  if isinstance(e, BrokenProcessPool):
+    return HTTPException(status_code=503, detail="stitch worker crashed", headers={"Retry-After": "1"})
+  if isinstance(e, ImageTooLargeError):
+    return HTTPException(status_code=413, detail=str(e))
+  if isinstance(e, (ImageDecodeError, CanvasTooLargeError)) or (isinstance(e, ValueError) and mode == "multi"):
+    return HTTPException(status_code=422, detail=str(e))
+  return HTTPException(status_code=500, detail="stitch failed")
+
+# Clients tuning parameters send a stable X-Session-Id so their jobs reuse one worker's stage cache
+def _sessionId(sessionId: Optional[str] = Header(None, alias="X-Session-Id")):
+  if sessionId is not None and len(sessionId) > MAX_SESSION_ID_LENGTH:
+    raise HTTPException(status_code=422, detail="X-Session-Id is too long")
+  return sessionId
+
+# (job, whether this request started it). debug recomputes even a cached result, tracing memory,
+# so the job carries a full profile
+def _submitJob(mode, datas, params, session=None, debug=False):
+  try:
+    return app.state.jobs.submit(mode, datas, params, session, refresh=debug, traceMemory=debug)
+  except PoolBusyError as e:
+    raise _stitchError(e, mode)
+
+# A pair preview job also queues the full-size result. Both run under one session, so they land on
+# the same worker and the full job only re-encodes from the stage cache. Returns the jobs' links;
+# without room in the pool for the full job the client can submit it later.
+def _submitPreview(datas, params, session, debug):
+  fullParams = dict(params, output=dict(params["output"], preview=0))
+  fullId = cacheKey("pair", datas, fullParams)
+  session = session or fullId
+  job, started = _submitJob("pair", datas, params, session, debug)
+  try:
+    app.state.jobs.submit("pair", datas, fullParams, session)
+  except PoolBusyError:
+    return job, started, {}
+  return job, started, {"Link": f'</jobs/{fullId}/result>; rel="full", </jobs/{fullId}>; rel="full-status"'}
+
+# (job, started, response links), see _submitJob
+def _submitPair(datas, params, session, debug=False):
+  if params["output"]["preview"]:
+    return _submitPreview(datas, params, session, debug)
+  return *_submitJob("pair", datas, params, session, debug), {}
+
+async def _jobResult(job):
+  try:
+    result = await app.state.jobs.result(job)
+  except Exception as e:
+    raise _stitchError(e, job.mode) from e
+  if result is None:
+    raise HTTPException(status_code=410, detail="result evicted from cache, submit the job again")
+  return result
+
+# Stage durations go only to the request that started the job; merged and cached ones did no work
+def _serverTiming(job, started):
+  if not started or job.profile is None:
+    return 'cache;desc="hit"'
+  stages = {}
+  for span in job.profile["spans"]:
+    seconds, cached = stages.get(span["stage"], (0.0, True))
+    stages[span["stage"]] = (seconds + span["seconds"], cached and span["cached"])
+  entries = [
+    f"{stage};dur={seconds * 1e3:.1f}" + (';desc="cached"' if cached else "")
+    for stage, (seconds, cached) in stages.items()
+  ]
+  entries.append(f"worker;dur={job.profile['seconds'] * 1e3:.1f}")
+  return ", ".join(entries)
+
+def _resultResponse(job, result, cacheControl, serverTiming=False, links=None, started=False):
+  content, media, headers = result
+  headers = dict(headers, **{"ETag": f'"{job.id}"', "Cache-Control": cacheControl}, **(links or {}))
+  if serverTiming:
+    headers["Server-Timing"] = _serverTiming(job, started)
+  return Response(content=content, media_type=media, headers=headers)
+
+# The profile of a finished job instead of its image, for ?debug=true
+def _profileResponse(job):
+  return {"id": job.id, "resultUrl": f"/jobs/{job.id}/result", "profile": job.profile}
+
+def _etagMatches(ifNoneMatch, etag):
+  if ifNoneMatch is None:
+    return False
+  candidates = [tag.strip().removeprefix("W/") for tag in ifNoneMatch.split(",")]
+  return etag in candidates or "*" in candidates
+
+def _jobStatus(job):
+  status = {"id": job.id, "status": job.status, "resultUrl": f"/jobs/{job.id}/result"}
+  if job.status == JOB_FAILED:
+    error = _stitchError(job.error, job.mode)
+    status["error"] = {"status": error.status_code, "detail": error.detail}
+  return status
+
+def _getJob(jobId):
+  job = app.state.jobs.get(jobId)
+  if job is None:
+    raise HTTPException(status_code=404, detail="unknown job")
+  return job
+
+def _validateMatchParams(matchMethod, matchIndex, ransacSampling, ransacConfidence):
+  if matchMethod not in MATCH_METHODS or matchIndex not in MATCH_INDEXES:
+    raise HTTPException(status_code=422, detail="unknown matchMethod or matchIndex")
+  if ransacSampling not in RANSAC_SAMPLINGS or not 0 < ransacConfidence < 1:
+    raise HTTPException(status_code=422, detail="invalid ransacSampling or ransacConfidence")
+
+# Response encoding. preview is the longer side of a downscaled panorama (0 for full size);
+# format "json" skips compositing and returns the canvas layout for the client to warp itself.
+def _outputParams(
+  format: str = Form("jpeg"),
+  quality: int = Form(92),
+  progressive: bool = Form(False),
+  preview: int = Form(0),
+):
+  if format not in OUTPUT_FORMATS or not 1 <= quality <= 100 or preview < 0:
+    raise HTTPException(status_code=422, detail="invalid format, quality or preview")
+  if format == "json" and preview:
+    raise HTTPException(status_code=422, detail="preview needs an image format")
+  return dict(format=format, quality=quality, progressive=progressive, preview=preview)
+
+# Form fields shared by every stitch endpoint
+def _commonParams(
   sigma: float = Form(2.0),
   harrisThreshold: float = Form(3000.0),
   harrisWindowRadius: int = Form(3),
+  maxCorners: int = Form(DEFAULT_MAX_CORNERS),
+  cornerSelection: str = Form(DEFAULT_CORNER_SELECTION),
   siftEnlarge: float = Form(1.5),
+  featurePrecision: str = Form(DEFAULT_FEATURE_PRECISION),
   maxSize: int = Form(1600),
+  blendMode: str = Form("feather"),
   maxDescriptorMatches: int = Form(100),
+  matchMethod: str = Form("greedy"),
+  matchRatio: float = Form(0.8),
+  matchIndex: str = Form("brute"),
   ransacIters: int = Form(1000),
   ransacThreshold: float = Form(1.0),
+  ransacConfidence: float = Form(0.999),
+  ransacSampling: str = Form("uniform"),
+  ransacSeed: Optional[int] = Form(None),
+  output: dict = Depends(_outputParams),
+):
+  _validateMatchParams(matchMethod, matchIndex, ransacSampling, ransacConfidence)
+  if cornerSelection not in CORNER_SELECTIONS or maxCorners < 0 or 0 < maxCorners < 4:
+    raise HTTPException(status_code=422, detail="invalid cornerSelection or maxCorners")
+  if featurePrecision not in FEATURE_PRECISIONS:
+    raise HTTPException(status_code=422, detail="invalid featurePrecision")
+  if blendMode not in BLEND_MODES:
+    raise HTTPException(status_code=422, detail="invalid blendMode")
+  return dict(
+    sigma=sigma,
+    harrisThreshold=harrisThreshold,
+    harrisWindowRadius=harrisWindowRadius,
+    maxCorners=maxCorners or None,
+    cornerSelection=cornerSelection,
+    siftEnlarge=siftEnlarge,
+    featurePrecision=featurePrecision,
+    maxSize=maxSize,
+    blendMode=blendMode,
+    maxDescriptorMatches=maxDescriptorMatches,
+    matchMethod=matchMethod,
+    matchRatio=matchRatio,
+    matchIndex=matchIndex,
+    ransacIters=ransacIters,
+    ransacThreshold=ransacThreshold,
+    ransacConfidence=ransacConfidence,
+    ransacSampling=ransacSampling,
+    ransacSeed=ransacSeed,
+    maxCanvasPixels=MAX_CANVAS_PIXELS,
+    output=output,
+  )
+
+def _pairParams(common: dict = Depends(_commonParams), pyramid: bool = Form(False)):
+  return dict(common, pyramid=pyramid)
+
+def _multiParams(
+  common: dict = Depends(_commonParams),
+  pairWindow: int = Form(1),
+  prefilterNeighbors: int = Form(2),
+  minInliers: int = Form(12),
+):
+  if pairWindow < 1 or prefilterNeighbors < 0 or minInliers < 4:
+    raise HTTPException(status_code=422, detail="invalid pairWindow, prefilterNeighbors or minInliers")
+  return dict(common, pairWindow=pairWindow, prefilterNeighbors=prefilterNeighbors, minInliers=minInliers)
+
+def _checkImageCount(images):
+  if not 2 <= len(images) <= MAX_MULTI_IMAGES:
+    raise HTTPException(status_code=422, detail=f"expected 2 to {MAX_MULTI_IMAGES} images")
+
+
+# Synchronous endpoints: submit, wait and return the panorama. They share jobs and cached
+# results with the job API, so a repeated request is served without stitching again.
+# ?debug=true answers with the job's per-stage profile as JSON instead.
+@app.post("/stitch")
+async def stitch_endpoint(
+  image1: UploadFile = File(...),
+  image2: UploadFile = File(...),
+  params: dict = Depends(_pairParams),
+  session: Optional[str] = Depends(_sessionId),
+  debug: bool = False,
+):
+  async with _sharedUploads([image1, image2]) as datas:
+    job, started, links = _submitPair(datas, params, session, debug)
+  result = await _jobResult(job)
+  if debug:
+    return _profileResponse(job)
+  return _resultResponse(job, result, "private, no-cache", STITCH_SERVER_TIMING, links, started)
+
+
+# N-image panorama: frames are registered pairwise and composited onto one reference frame
+@app.post("/stitch/multi")
+async def stitch_multi_endpoint(
+  images: list[UploadFile] = File(...),
+  params: dict = Depends(_multiParams),
+  debug: bool = False,
 ):
+  _checkImageCount(images)
+  async with _sharedUploads(images) as datas:
+    job, started = _submitJob("multi", datas, params, debug=debug)
+  result = await _jobResult(job)
+  if debug:
+    return _profileResponse(job)
+  return _resultResponse(job, result, "private, no-cache", STITCH_SERVER_TIMING, started=started)
+
+
+# Image registry: an image uploaded once is stitched by id in later requests. The id is the SHA-256
+# of the encoded bytes, so registering the same image again returns the same id. A registered image
+# stays available until its expiresAt (epoch seconds), STITCH_IMAGE_TTL_SECONDS after it was last
+# registered, so clients renew one by registering it again. When the store is full, registration
+# answers 507 rather than dropping other images. Features extracted from a registered image land in
+# the workers' feature store like any other image's, so repeated stitches against it skip feature extraction.
+def _imageInfo(imageId, meta):
+  return dict(meta, id=imageId)
+
+@app.post("/images", status_code=201)
+async def register_image_endpoint(image: UploadFile = File(...)):
+  if app.state.images is None:
+    raise HTTPException(status_code=503, detail="image registration is disabled")
+  async with _sharedUploads([image]) as (upload,):
+    data, imageId = upload.tobytes(), upload.sha256.hex()
+    # Size is read from JPEG and PNG headers; other formats are only checked when first stitched
+    header = upload.header()
+  if header is None:
+    media, size = "application/octet-stream", {}
+  else:
+    width, height, format = header
+    media, size = f"image/{format}", {"width": width, "height": height}
+  try:
+    meta, created = await asyncio.to_thread(app.state.images.register, imageId, data, media, size)
+  except RegistryFullError as e:
+    raise HTTPException(status_code=507, detail=str(e))
+  return JSONResponse(_imageInfo(imageId, meta), status_code=201 if created else 200)
+
+def _checkImageId(imageId):
+  if len(imageId) != 64 or any(c not in "0123456789abcdef" for c in imageId):
+    raise HTTPException(status_code=404, detail=f"unknown image {imageId}")
+
+@app.get("/images/{imageId}")
+async def image_info_endpoint(imageId: str):
+  _checkImageId(imageId)
+  meta = None if app.state.images is None else app.state.images.info(imageId)
+  if meta is None:
+    raise HTTPException(status_code=404, detail=f"unknown image {imageId}")
+  return _imageInfo(imageId, meta)
+
+async def _registeredImages(imageIds):
+  datas = []
+  for imageId in imageIds:
+    _checkImageId(imageId)
+    entry = None if app.state.images is None else await asyncio.to_thread(app.state.images.get, imageId)
+    if entry is None:
+      raise HTTPException(status_code=404, detail=f"unknown image {imageId}")
+    datas.append(entry[0])
+  return datas
+
+@app.post("/stitch/by-id")
+async def stitch_by_id_endpoint(
+  image1Id: str = Form(...),
+  image2Id: str = Form(...),
+  params: dict = Depends(_pairParams),
+  session: Optional[str] = Depends(_sessionId),
+  debug: bool = False,
+):
+  datas = await _registeredImages([image1Id, image2Id])
+  job, started, links = _submitPair(datas, params, session, debug)
+  result = await _jobResult(job)
+  if debug:
+    return _profileResponse(job)
+  return _resultResponse(job, result, "private, no-cache", STITCH_SERVER_TIMING, links, started)
+
+@app.post("/stitch/multi/by-id")
+async def stitch_multi_by_id_endpoint(
+  imageIds: list[str] = Form(...),
+  params: dict = Depends(_multiParams),
+  debug: bool = False,
+):
+  _checkImageCount(imageIds)
+  datas = await _registeredImages(imageIds)
+  job, started = _submitJob("multi", datas, params, debug=debug)
+  result = await _jobResult(job)
+  if debug:
+    return _profileResponse(job)
+  return _resultResponse(job, result, "private, no-cache", STITCH_SERVER_TIMING, started=started)
+
+
+# Job API: submit returns the content-addressed job id, then poll, stream or fetch the result
+def _acceptedResponse(job, links=None):
+  return JSONResponse(_jobStatus(job), status_code=202, headers={"Location": f"/jobs/{job.id}", **(links or {})})
+
+@app.post("/jobs")
+async def submit_job_endpoint(
+  image1: UploadFile = File(...),
+  image2: UploadFile = File(...),
+  params: dict = Depends(_pairParams),
+  session: Optional[str] = Depends(_sessionId),
+):
+  async with _sharedUploads([image1, image2]) as datas:
+    job, _, links = _submitPair(datas, params, session)
+  return _acceptedResponse(job, links)
+
+@app.post("/jobs/multi")
+async def submit_multi_job_endpoint(
+  images: list[UploadFile] = File(...),
+  params: dict = Depends(_multiParams),
+):
+  _checkImageCount(images)
+  async with _sharedUploads(images) as datas:
+    job, _ = _submitJob("multi", datas, params)
+  return _acceptedResponse(job)
+
+# Long-poll: wait up to `wait` seconds for the job to finish before answering
+@app.get("/jobs/{jobId}")
+async def job_status_endpoint(jobId: str, wait: float = 0.0):
+  job = _getJob(jobId)
+  if wait > 0 and not job.done.is_set():
+    try:
+      await asyncio.wait_for(job.done.wait(), min(wait, JOB_WAIT_MAX_SECONDS))
+    except asyncio.TimeoutError:
+      pass
+  return _jobStatus(job)
+
+def _statusEvent(job):
+  return f"event: status\ndata: {json.dumps(_jobStatus(job))}\n\n"
+
+async def _jobEvents(job):
+  if not job.done.is_set():
+    yield _statusEvent(job)
+    while not job.done.is_set():
+      try:
+        await asyncio.wait_for(job.done.wait(), JOB_HEARTBEAT_SECONDS)
+      except asyncio.TimeoutError:
+        yield ": keep-alive\n\n"
+  yield _statusEvent(job)
+
+# Server-sent events: the current status, heartbeats while pending, then the final status
+@app.get("/jobs/{jobId}/events")
+async def job_events_endpoint(jobId: str):
+  job = _getJob(jobId)
+  return StreamingResponse(_jobEvents(job), media_type="text/event-stream", headers={"Cache-Control": "no-store"})
+
+@app.get("/jobs/{jobId}/result")
+async def job_result_endpoint(jobId: str, ifNoneMatch: Optional[str] = Header(None, alias="If-None-Match")):
+  job = _getJob(jobId)
+  if job.status == JOB_DONE and _etagMatches(ifNoneMatch, f'"{job.id}"'):
+    return Response(status_code=304, headers={"ETag": f'"{job.id}"', "Cache-Control": RESULT_CACHE_CONTROL})
+  if not job.done.is_set():
+    return _acceptedResponse(job)
+  return _resultResponse(job, await _jobResult(job), RESULT_CACHE_CONTROL)
+
+
+# Parameters a stream's start message may set, with their defaults. Frames are matched one after another
+# at video rates, so corners are capped and spread over the frame and feature maps are float32 unless
+# the start message says otherwise.
+STREAM_DEFAULTS = dict(
+  sigma=2.0, harrisThreshold=3000.0, harrisWindowRadius=3, maxCorners=2000, cornerSelection="grid",
+  siftEnlarge=1.5, featurePrecision="float32", maxSize=1600, matchRatio=0.8, ransacIters=1000,
+  ransacThreshold=1.0, ransacConfidence=0.999, ransacSeed=None, minInliers=12, searchRadius=DEFAULT_SEARCH_RADIUS,
+  numBands=5,
+)
+
+# (stitcher params, output) from a start message, raising ValueError for anything invalid
+def _streamParams(message):
+  params, output = message.get("params") or {}, message.get("output") or {}
+  unknown = sorted(set(params) - set(STREAM_DEFAULTS)) + sorted(set(output) - {"format", "quality", "progressive"})
+  if unknown:
+    raise ValueError(f"unknown parameters: {', '.join(unknown)}")
+  params = dict(STREAM_DEFAULTS, **params)
+  for name, default in STREAM_DEFAULTS.items():
+    if isinstance(default, (int, float)) and params[name] is not None:
+      params[name] = type(default)(params[name])
+  if params["cornerSelection"] not in CORNER_SELECTIONS or params["featurePrecision"] not in FEATURE_PRECISIONS:
+    raise ValueError("invalid cornerSelection or featurePrecision")
+  if params["maxCorners"] < 0 or 0 < params["maxCorners"] < 4:
+    raise ValueError("invalid maxCorners")
+  params["maxCorners"] = params["maxCorners"] or None
+  params["maxCanvasPixels"] = MAX_CANVAS_PIXELS
+  output = dict(DEFAULT_OUTPUT, **output)
+  if output["format"] not in OUTPUT_FORMATS or output["format"] == "json" or not 1 <= int(output["quality"]) <= 100:
+    raise ValueError("invalid format or quality")
+  return params, output
+
+# One stream step in the stream's worker (see workers._streamStep); returns the step's content
+async def _streamStep(streamId, action, params=None, datas=(), output=DEFAULT_OUTPUT):
+  metrics = app.state.metrics
+  try:
+    work = app.state.pool.run("stream", list(datas), dict(params or {}, action=action, output=output), streamId)
+  except PoolBusyError:
+    metrics.countJob("stream", "rejected")
+    raise
   try:
-    img_left = _readImg(image1)
-    img_right = _readImg(image2)
-  except ValueError as e:
-    raise HTTPException(status_code=422, detail=str(e))
+    content, _, stats = await work
+  except Exception:
+    metrics.countJob("stream", "failed")
+    raise
+  metrics.countJob("stream", "computed")
+  if action == "frame":
+    metrics.observeProfile("stream", stats["profile"])
+  return content
 
+def _streamError(e):
+  if isinstance(e, PoolBusyError):
+    return {"type": "error", "detail": str(e), "retryAfter": e.retryAfter}
+  if isinstance(e, (ValueError, DeadlineExceededError)):
+    return {"type": "error", "detail": str(e)}
+  if isinstance(e, BrokenProcessPool):
+    return {"type": "error", "detail": "stitch worker crashed"}
+  return {"type": "error", "detail": "stitch failed"}
+
+def _checkFrame(data):
+  if not data:
+    raise ValueError("empty frame")
+  if len(data) > MAX_UPLOAD_BYTES:
+    raise ValueError(f"frame exceeds {MAX_UPLOAD_BYTES} bytes")
+  checkImageHeader(data, MAX_IMAGE_PIXELS)
+
+
+# Streaming stitch for frames from a panning camera. Frames are sent one per binary message and
+# each is answered with its stats as JSON text: {"type": "frame", "frame", "corners", "matches",
+# "inliers", "windowed", "homography" into the first frame, "canvas" size}, or "dropped" with the
+# reason when it does not register. Text messages control the stream:
+#   {"type": "start", "params": {...}, "output": {...}}  optional and first; STREAM_DEFAULTS otherwise
+#   {"type": "panorama"}  the canvas so far, as one binary message
+#   {"type": "end"}       the final panorama, then the socket is closed
+# Errors are answered with {"type": "error", "detail"}; only a failed start closes the stream.
+# A stream's steps all run on one worker, which keeps its stitcher between frames.
+@app.websocket("/stitch/stream")
+async def stitch_stream_endpoint(websocket: WebSocket):
+  await websocket.accept()
+  streamId = "stream-" + uuid.uuid4().hex
+  started, output = False, DEFAULT_OUTPUT
   try:
-    pano = stitchImages(
-      img_left,
-      img_right,
-      sigma=sigma,
-      harrisThreshold=harrisThreshold,
-      harrisWindowRadius=harrisWindowRadius,
-      siftEnlarge=siftEnlarge,
-      maxSize=maxSize,
-      maxDescriptorMatches=maxDescriptorMatches,
-      ransacIters=ransacIters,
-      ransacThreshold=ransacThreshold,
-    )
-  except Exception as e:
-    raise HTTPException(status_code=500, detail="stitch failed") from e
-
-  # Prefer jpeg, fallback to png
-  media = "image/jpeg"
-  ok, buf = cv2.imencode(".jpg", pano, [int(cv2.IMWRITE_JPEG_QUALITY), 92])
-  if not ok:
-    ok, buf = cv2.imencode(".png", pano)
-    if not ok:
-      raise HTTPException(status_code=500, detail="encode failed")
-    media = "image/png"
-
-  return Response(content=buf.tobytes(), media_type=media, headers={"Cache-Control": "no-store"})
+    while True:
+      message = await websocket.receive()
+      if message["type"] == "websocket.disconnect":
+        break
+      try:
+        if message.get("bytes") is not None:
+          data = message["bytes"]
+          _checkFrame(data)
+          if not started:
+            params, output = _streamParams({})
+            await _streamStep(streamId, "start", params)
+            started = True
+          stats = json.loads(await _streamStep(streamId, "frame", datas=[data]))
+          await websocket.send_json(dict(stats, type="frame"))
+          continue
+        request = json.loads(message.get("text") or "{}")
+        kind = request.get("type")
+        if kind == "start" and not started:
+          try:
+            params, output = _streamParams(request)
+            await _streamStep(streamId, "start", params)
+          except Exception as e:
+            await websocket.send_json(_streamError(e))
+            await websocket.close(code=1008)
+            return
+          started = True
+          await websocket.send_json({"type": "started", "stream": streamId})
+        elif kind in ("panorama", "end"):
+          if not started:
+            raise ValueError("no frames stitched yet")
+          await websocket.send_bytes(await _streamStep(streamId, "panorama", output=output))
+          if kind == "end":
+            await websocket.close()
+            return
+        else:
+          raise ValueError(f"unexpected message type: {kind}")
+      except WebSocketDisconnect:
+        raise
+      except Exception as e:
+        await websocket.send_json(_streamError(e))
+  except WebSocketDisconnect:
+    pass
+  finally:
+    if started:
+      try:
+        await _streamStep(streamId, "close")
+      except Exception:
+        pass
+
+
+# Readiness probe: 503 while stitch workers are still warming up (or their warm-up failed), then
+# 200 with each worker's warm-up time
+@app.get("/ready")
+def ready_endpoint():
+  warmUp = app.state.warmUp
+  if not warmUp.done():
+    raise HTTPException(status_code=503, detail="warming up", headers={"Retry-After": "1"})
+  if warmUp.cancelled() or warmUp.exception() is not None:
+    raise HTTPException(status_code=503, detail="warm-up failed")
+  return {"ready": True, "warmUpSeconds": warmUp.result()}
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+  return PlainTextResponse(
+    app.state.metrics.render(app.state.pool), media_type="text/plain; version=0.0.4; charset=utf-8"
+  )
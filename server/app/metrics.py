@@ -0,0 +1,149 @@
+import math
+import threading
+
+# Minimal Prometheus text-format registry (exposition format 0.0.4), enough for counters,
+# gauges and fixed-bucket histograms without pulling in a client library.
+
+STAGE_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PEAK_BYTES_BUCKETS = tuple(2 ** power for power in range(20, 33, 2))
+COUNT_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+CANVAS_MEGAPIXELS_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+def _formatLabels(labelNames, labelValues, extra=()):
+  pairs = list(zip(labelNames, labelValues)) + list(extra)
+  if not pairs:
+    return ""
+  escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+  return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _formatValue(value):
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+  kind = None
+
+  def __init__(self, name, help, labelNames=()):
+    self.name = name
+    self.help = help
+    self.labelNames = tuple(labelNames)
+    self._values = {}
+
+  def _header(self):
+    return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+  kind = "counter"
+
+  def inc(self, labels=(), amount=1):
+    self._values[tuple(labels)] = self._values.get(tuple(labels), 0) + amount
+
+  def render(self):
+    lines = self._header()
+    for labels, value in sorted(self._values.items()):
+      lines.append(f"{self.name}{_formatLabels(self.labelNames, labels)} {_formatValue(value)}")
+    return lines
+
+class Gauge(Counter):
+  kind = "gauge"
+
+  def set(self, value, labels=()):
+    self._values[tuple(labels)] = value
+
+class Histogram(_Metric):
+  kind = "histogram"
+
+  def __init__(self, name, help, buckets, labelNames=()):
+    super().__init__(name, help, labelNames)
+    self.buckets = tuple(buckets)
+
+  def observe(self, value, labels=()):
+    counts, total = self._values.setdefault(tuple(labels), ([0] * len(self.buckets), [0.0, 0]))
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        counts[i] += 1
+    total[0] += value
+    total[1] += 1
+
+  def render(self):
+    lines = self._header()
+    for labels, (counts, (total, count)) in sorted(self._values.items()):
+      for bound, bucketCount in zip(self.buckets, counts):
+        bucketLabels = _formatLabels(self.labelNames, labels, [("le", _formatValue(bound))])
+        lines.append(f"{self.name}_bucket{bucketLabels} {bucketCount}")
+      lines.append(f"{self.name}_bucket{_formatLabels(self.labelNames, labels, [('le', '+Inf')])} {count}")
+      lines.append(f"{self.name}_sum{_formatLabels(self.labelNames, labels)} {_formatValue(total)}")
+      lines.append(f"{self.name}_count{_formatLabels(self.labelNames, labels)} {count}")
+    return lines
+
+
+# Stitch service metrics, fed from each finished job's profile
+class StitchMetrics:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.jobs = Counter("stitch_jobs_total", "Stitch jobs by mode and outcome.", ("mode", "outcome"))
+    self.jobSeconds = Histogram(
+      "stitch_job_seconds", "Time spent in the worker per stitch job.", STAGE_SECONDS_BUCKETS, ("mode",)
+    )
+    self.stageSeconds = Histogram(
+      "stitch_stage_seconds", "Time per computed pipeline stage.", STAGE_SECONDS_BUCKETS, ("mode", "stage")
+    )
+    self.stagePeakBytes = Histogram(
+      "stitch_stage_peak_bytes", "Peak traced allocation per pipeline stage, from profiled jobs only.",
+      PEAK_BYTES_BUCKETS, ("mode", "stage"),
+    )
+    self.stageCacheHits = Counter(
+      "stitch_stage_cache_hits_total", "Pipeline stages served from a session stage cache.", ("mode", "stage")
+    )
+    self.corners = Histogram("stitch_corners", "Harris corners per image.", COUNT_BUCKETS, ("mode",))
+    self.matches = Histogram("stitch_matches", "Descriptor matches per pair.", COUNT_BUCKETS, ("mode",))
+    self.inliers = Histogram("stitch_inliers", "RANSAC inliers per pair.", COUNT_BUCKETS, ("mode",))
+    self.ransacIterations = Histogram(
+      "stitch_ransac_iterations", "RANSAC hypotheses evaluated per pair.", COUNT_BUCKETS, ("mode",)
+    )
+    self.canvasMegapixels = Histogram(
+      "stitch_canvas_megapixels", "Output panorama size.", CANVAS_MEGAPIXELS_BUCKETS, ("mode",)
+    )
+    self.poolAdmitted = Gauge("stitch_pool_admitted", "Stitch jobs running or queued in the worker pool.")
+    self.poolCapacity = Gauge("stitch_pool_capacity", "Stitch jobs the worker pool admits at once.")
+    self._metrics = [
+      self.jobs, self.jobSeconds, self.stageSeconds, self.stagePeakBytes, self.stageCacheHits, self.corners,
+      self.matches, self.inliers, self.ransacIterations, self.canvasMegapixels, self.poolAdmitted, self.poolCapacity,
+    ]
+
+  def countJob(self, mode, outcome):
+    with self._lock:
+      self.jobs.inc((mode, outcome))
+
+  def observeProfile(self, mode, profile):
+    with self._lock:
+      self.jobSeconds.observe(profile["seconds"], (mode,))
+      for span in profile["spans"]:
+        if span["cached"]:
+          self.stageCacheHits.inc((mode, span["stage"]))
+          continue
+        self.stageSeconds.observe(span["seconds"], (mode, span["stage"]))
+        if "peakBytes" in span:
+          self.stagePeakBytes.observe(span["peakBytes"], (mode, span["stage"]))
+      counters = profile["counters"]
+      for corners in counters.get("corners", []):
+        self.corners.observe(corners, (mode,))
+      for name, histogram in (("matches", self.matches), ("inliers", self.inliers),
+                              ("ransacIterations", self.ransacIterations)):
+        if name in counters:
+          histogram.observe(counters[name], (mode,))
+      if "canvasPixels" in counters:
+        self.canvasMegapixels.observe(counters["canvasPixels"] / 1e6, (mode,))
+
+  def render(self, pool=None):
+    with self._lock:
+      if pool is not None:
+        self.poolAdmitted.set(pool.admitted)
+        self.poolCapacity.set(pool.capacity)
+      lines = []
+      for metric in self._metrics:
+        lines.extend(metric.render())
+      return "\n".join(lines) + "\n"
@@ -1,3 +1,4 @@
 from .pipeline import stitchImages
+from .panorama import stitchImagesMulti
 
-__all__ = ["stitchImages"]
+__all__ = ["stitchImages", "stitchImagesMulti"]
@@ -1,11 +1,27 @@
 import numpy as np
 import cv2
-from scipy.ndimage import distance_transform_edt
+
+COMPOSITORS = ("auto", "full", "tiled")
+# "feather" weights every covered pixel by its distance to the image borders; "multiband" cuts a seam
+# through the overlap and blends pyramid bands only around it
+BLEND_MODES = ("feather", "multiband")
+DEFAULT_NUM_BANDS = 5
+# Seam cost outside the overlap, high enough that the seam only leaves it where the overlap is too
+# slanted for a path moving one column per row
+OUTSIDE_SEAM_COST = 1e6
+DEFAULT_MAX_CANVAS_PIXELS = 64_000_000
+# "auto" switches to tiles above this canvas size
+TILED_MIN_PIXELS = 4_000_000
+DEFAULT_TILE_SIZE = 512
+
+
+class CanvasTooLargeError(ValueError):
+  pass
+
 
 # Helpers
-def _computeBoundsAndTransform(img1, img2, homographyMatrix):
-  img1Height, img1Width = img1.shape
-  img2Height, img2Width = img2.shape
+def warpCorners(img2, homographyMatrix):
+  img2Height, img2Width = img2.shape[:2]
 
   topLeftH = np.array([0, 0, 1])
   topRightH = np.array([img2Width, 0, 1])
@@ -14,7 +30,22 @@ def _computeBoundsAndTransform(img1, img2, homographyMatrix):
   corners = np.vstack([topLeftH, topRightH, bottomRightH, bottomLeftH])
 
   warpedCorners = (homographyMatrix @ corners.T).T
+  if np.any(warpedCorners[:, 2] <= 1e-8):
+    raise CanvasTooLargeError("homography maps image corners to infinity")
   warpedCorners /= warpedCorners[:, 2:3]
+  return warpedCorners[:, :2]
+
+
+def checkCanvasBudget(panoramaWidth, panoramaHeight, maxCanvasPixels):
+  if maxCanvasPixels is not None and float(panoramaWidth) * float(panoramaHeight) > maxCanvasPixels:
+    raise CanvasTooLargeError(
+      f"panorama canvas {panoramaWidth:.0f}x{panoramaHeight:.0f} exceeds the {maxCanvasPixels} pixel limit"
+    )
+
+
+def _computeBoundsAndTransform(img1, img2, homographyMatrix, maxCanvasPixels=None):
+  img1Height, img1Width = img1.shape[:2]
+  warpedXY = warpCorners(img2, homographyMatrix)
 
   img1Corners = np.array([
     [0, 0],
@@ -22,9 +53,12 @@ def _computeBoundsAndTransform(img1, img2, homographyMatrix):
     [img1Width, img1Height],
     [0, img1Height],
   ])
-  warpedXY = warpedCorners[:, :2]
   allCorners = np.vstack([img1Corners, warpedXY])
 
+  # Checked in float before anything is cast or allocated
+  extent = allCorners.max(axis=0) - allCorners.min(axis=0) + 1
+  checkCanvasBudget(extent[0], extent[1], maxCanvasPixels)
+
   xMin, yMin = np.int32(allCorners.min(axis=0).ravel() - 0.5)
   xMax, yMax = np.int32(allCorners.max(axis=0).ravel() + 0.5)
 
@@ -34,28 +68,41 @@ def _computeBoundsAndTransform(img1, img2, homographyMatrix):
   return offset, offsetTransform, panoramaHeight, panoramaWidth
 
 
+# Edges are replicated so interpolated border pixels keep their color, validity comes from the alpha
 def _warpImage2(img2, offsetTransform, homographyMatrix, panoramaWidth, panoramaHeight):
-  return cv2.warpPerspective(img2, offsetTransform @ homographyMatrix, (panoramaWidth, panoramaHeight))
+  return cv2.warpPerspective(
+    img2, offsetTransform @ homographyMatrix, (panoramaWidth, panoramaHeight), borderMode=cv2.BORDER_REPLICATE
+  )
+
+
+# Warp an explicit alpha plane so black pixels in img2 still count as covered
+def _warpAlpha2(img2, offsetTransform, homographyMatrix, panoramaWidth, panoramaHeight):
+  alpha = np.full(img2.shape[:2], 255, dtype=np.uint8)
+  warpedAlpha = cv2.warpPerspective(
+    alpha, offsetTransform @ homographyMatrix, (panoramaWidth, panoramaHeight), borderMode=cv2.BORDER_CONSTANT
+  )
+  return warpedAlpha > 0
 
 
 def _placeImage1OnCanvas(img1, offset, canvasTemplate):
   canvas = np.zeros_like(canvasTemplate, dtype=np.uint8)
+  mask1 = np.zeros(canvasTemplate.shape[:2], dtype=bool)
   offsetY, offsetX = offset[1], offset[0]
-  img1Height, img1Width = img1.shape
+  img1Height, img1Width = img1.shape[:2]
   canvas[offsetY:offsetY+img1Height, offsetX:offsetX+img1Width] = img1
-  return canvas
+  mask1[offsetY:offsetY+img1Height, offsetX:offsetX+img1Width] = True
+  return canvas, mask1
 
 
-def _calcMasks(canvas1, warped2):
-  mask1 = canvas1 > 0
-  mask2 = warped2 > 0
+def _calcMasks(mask1, mask2):
   overlap = mask1 & mask2
   onlyMask1 = mask1 & (~mask2)
   onlyMask2 = mask2 & (~mask1)
-  return mask1, mask2, overlap, onlyMask1, onlyMask2
+  return overlap, onlyMask1, onlyMask2
 
 
 def _distanceWeights(mask1, mask2, eps):
+  from scipy.ndimage import distance_transform_edt
   distance1 = distance_transform_edt(mask1)
   distance2 = distance_transform_edt(mask2)
 
@@ -67,24 +114,23 @@ def _distanceWeights(mask1, mask2, eps):
   return weight1Normalized, weight2Normalized
 
 
-def _blend(canvas1, warped2, overlap, only1, only2, weight1Norm, weight2Norm):
-  out = np.zeros_like(canvas1, dtype=np.float32)
-  out[overlap] = (
-    weight1Norm[overlap] * canvas1[overlap].astype(np.float32) +
-    weight2Norm[overlap] * warped2[overlap].astype(np.float32)
-  )
-  out[only1] = canvas1[only1].astype(np.float32)
-  out[only2] = warped2[only2].astype(np.float32)
-  return np.clip(out, 0, 255).astype(np.uint8)
+# All channels at once; weights are (H, W) and broadcast over channels
+def _blend(canvas1, warped2, overlap, only2, weight1Norm, weight2Norm):
+  out = canvas1.copy()
+  out[only2] = warped2[only2]
+  weight1 = weight1Norm[overlap].reshape((-1,) + (1,) * (canvas1.ndim - 2))
+  weight2 = weight2Norm[overlap].reshape((-1,) + (1,) * (canvas1.ndim - 2))
+  blended = weight1 * canvas1[overlap].astype(np.float32) + weight2 * warped2[overlap].astype(np.float32)
+  out[overlap] = np.clip(blended, 0, 255).astype(np.uint8)
+  return out
 
 
-def stitchAndBlendImagesGray(img1, img2, homographyMatrix, eps: float = 1e-6):
-  # Use dist transform feathering
-  offset, offsetTransform, panoramaHeight, panoramaWidth = _computeBoundsAndTransform(img1, img2, homographyMatrix)
+def _stitchFull(img1, img2, homographyMatrix, offset, offsetTransform, panoramaHeight, panoramaWidth, eps):
   warped2 = _warpImage2(img2, offsetTransform, homographyMatrix, panoramaWidth, panoramaHeight)
-  canvas1 = _placeImage1OnCanvas(img1, offset, warped2)
+  mask2 = _warpAlpha2(img2, offsetTransform, homographyMatrix, panoramaWidth, panoramaHeight)
+  canvas1, mask1 = _placeImage1OnCanvas(img1, offset, warped2)
 
-  mask1, mask2, overlap, onlyMask1, onlyMask2 = _calcMasks(canvas1, warped2)
+  overlap, onlyMask1, onlyMask2 = _calcMasks(mask1, mask2)
 
   if not overlap.any():
     out = canvas1.copy()
@@ -92,16 +138,400 @@ def stitchAndBlendImagesGray(img1, img2, homographyMatrix, eps: float = 1e-6):
     return out
 
   weight1Normalized, weight2Normalized = _distanceWeights(mask1, mask2, eps)
-  return _blend(canvas1, warped2, overlap, onlyMask1, onlyMask2, weight1Normalized, weight2Normalized)
+  return _blend(canvas1, warped2, overlap, onlyMask2, weight1Normalized, weight2Normalized)
+
+
+# Tiled path helpers. Distance weights are analytic instead of a canvas-wide EDT:
+# img1 is a rectangle and warped img2 a convex quad, so the distance to the nearest
+# background pixel is the distance to their edges, ignoring parts on the canvas border.
+# An image covering the whole canvas has no such edge, so the canvas border counts instead and
+# its weight stays finite.
+def _rectDistance(coords, start, length, canvasLength, borderIsEdge=False):
+  inside = (coords >= start) & (coords < start + length)
+  distance = np.full(coords.shape, np.inf, dtype=np.float32)
+  if start > 0 or borderIsEdge:
+    distance = np.minimum(distance, coords - start + 1)
+  if start + length < canvasLength or borderIsEdge:
+    distance = np.minimum(distance, start + length - coords)
+  return np.where(inside, distance, 0).astype(np.float32)
+
+
+# Liang-Barsky clip of segment p0-p1 to a box, None if nothing is left
+def _clipSegment(p0, p1, xMin, xMax, yMin, yMax):
+  t0, t1 = 0.0, 1.0
+  dx, dy = p1[0] - p0[0], p1[1] - p0[1]
+  for p, q in ((-dx, p0[0] - xMin), (dx, xMax - p0[0]), (-dy, p0[1] - yMin), (dy, yMax - p0[1])):
+    if p == 0:
+      if q < 0:
+        return None
+      continue
+    r = q / p
+    if p < 0:
+      t0 = max(t0, r)
+    else:
+      t1 = min(t1, r)
+    if t0 > t1:
+      return None
+  return (p0[0] + t0 * dx, p0[1] + t0 * dy), (p0[0] + t1 * dx, p0[1] + t1 * dy)
+
+
+# Quad edges with background beyond them: the parts whose outside neighbourhood is on the canvas,
+# or the canvas border itself when the quad covers the whole canvas
+def _quadSegments(quadXY, canvasShape, outwardShift=1e-3):
+  panoramaHeight, panoramaWidth = canvasShape
+  centroid = quadXY.mean(axis=0)
+  segments = []
+  for i in range(4):
+    p0, p1 = np.asarray(quadXY[i], dtype=np.float64), np.asarray(quadXY[(i + 1) % 4], dtype=np.float64)
+    normal = np.array([p1[1] - p0[1], p0[0] - p1[0]])
+    length = np.hypot(*normal)
+    if length == 0:
+      continue
+    normal /= length
+    if np.dot(normal, p0 - centroid) < 0:
+      normal = -normal
+    shift = normal * outwardShift
+    clipped = _clipSegment(p0 + shift, p1 + shift, 0, panoramaWidth - 1, 0, panoramaHeight - 1)
+    if clipped is not None:
+      segments.append((tuple(np.subtract(clipped[0], shift)), tuple(np.subtract(clipped[1], shift))))
+  if not segments:
+    # The quad covers the canvas: measure to the canvas border, half a pixel outside the edge pixels
+    x0, y0, x1, y1 = -0.5, -0.5, panoramaWidth - 0.5, panoramaHeight - 0.5
+    corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    segments = [(corners[i], corners[(i + 1) % 4]) for i in range(4)]
+  return segments
+
+
+def _quadDistance(xs, ys, segments):
+  distance = np.full((len(ys), len(xs)), np.inf, dtype=np.float32)
+  px, py = xs[None, :], ys[:, None]
+  for (x0, y0), (x1, y1) in segments:
+    dx, dy = x1 - x0, y1 - y0
+    lengthSq = dx * dx + dy * dy
+    t = np.clip(((px - x0) * dx + (py - y0) * dy) / lengthSq, 0, 1) if lengthSq > 0 else 0
+    np.minimum(distance, np.hypot(px - (x0 + t * dx), py - (y0 + t * dy)), out=distance)
+  # Pixel centers sit half a pixel inside the edge, like the EDT's nearest background pixel
+  return distance + 0.5
+
+
+def _blendTile(img1, img2, alpha2, tileTransform, tileRect, offset, canvasShape, quadSegments, eps, out):
+  tileY, tileX, tileHeight, tileWidth = tileRect
+  panoramaHeight, panoramaWidth = canvasShape
+  offsetX, offsetY = offset
+  img1Height, img1Width = img1.shape[:2]
+  xs = np.arange(tileX, tileX + tileWidth, dtype=np.float32)
+  ys = np.arange(tileY, tileY + tileHeight, dtype=np.float32)
+
+  coversCanvas = (
+    offsetY <= 0 and offsetX <= 0 and offsetY + img1Height >= panoramaHeight and offsetX + img1Width >= panoramaWidth
+  )
+  rowDist1 = _rectDistance(ys, offsetY, img1Height, panoramaHeight, coversCanvas)
+  colDist1 = _rectDistance(xs, offsetX, img1Width, panoramaWidth, coversCanvas)
+  weight1 = np.minimum(rowDist1[:, None], colDist1[None, :])
+  mask1 = weight1 > 0
+
+  warped2 = cv2.warpPerspective(img2, tileTransform, (tileWidth, tileHeight), borderMode=cv2.BORDER_REPLICATE)
+  mask2 = cv2.warpPerspective(alpha2, tileTransform, (tileWidth, tileHeight), borderMode=cv2.BORDER_CONSTANT) > 0
+
+  tile = np.zeros_like(warped2)
+  rows1 = slice(max(offsetY, tileY) - tileY, min(offsetY + img1Height, tileY + tileHeight) - tileY)
+  cols1 = slice(max(offsetX, tileX) - tileX, min(offsetX + img1Width, tileX + tileWidth) - tileX)
+  if rows1.stop > rows1.start and cols1.stop > cols1.start:
+    tile[rows1, cols1] = img1[
+      rows1.start + tileY - offsetY:rows1.stop + tileY - offsetY,
+      cols1.start + tileX - offsetX:cols1.stop + tileX - offsetX,
+    ]
+
+  overlap, _, onlyMask2 = _calcMasks(mask1, mask2)
+  if overlap.any():
+    weight2 = _quadDistance(xs, ys, quadSegments) * mask2
+    weightSum = weight1 + weight2 + eps
+    tile = _blend(tile, warped2, overlap, onlyMask2, weight1 / weightSum, weight2 / weightSum)
+  else:
+    tile[onlyMask2] = warped2[onlyMask2]
+  out[tileY:tileY + tileHeight, tileX:tileX + tileWidth] = tile
+
+
+# Working memory is bounded by the tile size; only the output spans the whole canvas
+def _stitchTiled(img1, img2, homographyMatrix, offset, offsetTransform, panoramaHeight, panoramaWidth, eps, tileSize):
+  out = np.empty((panoramaHeight, panoramaWidth) + img1.shape[2:], dtype=np.uint8)
+  canvasTransform = offsetTransform @ homographyMatrix
+  quadSegments = _quadSegments(warpCorners(img2, canvasTransform), (panoramaHeight, panoramaWidth))
+  alpha2 = np.full(img2.shape[:2], 255, dtype=np.uint8)
+  for tileY in range(0, panoramaHeight, tileSize):
+    for tileX in range(0, panoramaWidth, tileSize):
+      tileHeight = min(tileSize, panoramaHeight - tileY)
+      tileWidth = min(tileSize, panoramaWidth - tileX)
+      tileTransform = np.array([[1, 0, -tileX], [0, 1, -tileY], [0, 0, 1]], dtype=np.float64) @ canvasTransform
+      _blendTile(
+        img1, img2, alpha2, tileTransform, (tileY, tileX, tileHeight, tileWidth), offset,
+        (panoramaHeight, panoramaWidth), quadSegments, eps, out,
+      )
+  return out
+
+
+# Seam-cut multiband path. Images are warped onto the canvas one after another; where a new image
+# meets what is already there, a seam is cut through the overlap bounding box and the Laplacian
+# bands are blended only in a strip around it. Everything outside the overlap is copied through,
+# so seam and pyramid cost scale with the overlap, not the canvas.
+
+# Clipped integer (x0, y0, x1, y1) box of a warped quad on the canvas, None if it misses the canvas
+def _quadBox(quad, canvasShape):
+  panoramaHeight, panoramaWidth = canvasShape
+  x0, y0 = np.maximum(np.floor(quad.min(axis=0)).astype(int), 0)
+  x1, y1 = np.minimum(np.ceil(quad.max(axis=0)).astype(int) + 1, (panoramaWidth, panoramaHeight))
+  if x1 <= x0 or y1 <= y0:
+    return None
+  return x0, y0, x1, y1
+
+
+# Column of a minimum-cost top-to-bottom path for each row, moving at most one column per row
+def _findSeam(cost):
+  height, width = cost.shape
+  total = cost.astype(np.float64)
+  steps = np.zeros((height, width), dtype=np.int8)
+  cols = np.arange(width)
+  padded = np.full(width + 2, np.inf)
+  for y in range(1, height):
+    padded[1:-1] = total[y - 1]
+    candidates = np.stack((padded[:-2], padded[1:-1], padded[2:]))
+    choice = candidates.argmin(axis=0)
+    total[y] += candidates[choice, cols]
+    steps[y] = choice - 1
+  seam = np.empty(height, dtype=np.intp)
+  seam[-1] = total[-1].argmin()
+  for y in range(height - 1, 0, -1):
+    seam[y - 1] = seam[y] + steps[y, seam[y]]
+  return seam
+
+
+def _laplacianPyramid(img, levels):
+  pyramid = []
+  for _ in range(levels):
+    down = cv2.pyrDown(img)
+    pyramid.append(img - cv2.pyrUp(down, dstsize=img.shape[1::-1]))
+    img = down
+  pyramid.append(img)
+  return pyramid
+
+
+# Burt-Adelson blend: each Laplacian band of a and b mixed by the Gaussian pyramid of weightA
+def _multibandBlend(a, b, weightA, levels):
+  weight = weightA
+  blendedBands = []
+  for bandA, bandB in zip(_laplacianPyramid(a, levels), _laplacianPyramid(b, levels)):
+    weightBand = weight.reshape(weight.shape + (1,) * (a.ndim - 2))
+    blendedBands.append(bandB + weightBand * (bandA - bandB))
+    weight = cv2.pyrDown(weight)
+  out = blendedBands[-1]
+  for band in reversed(blendedBands[:-1]):
+    out = cv2.pyrUp(out, dstsize=band.shape[1::-1]) + band
+  return out
+
+
+# (H, W) mask broadcastable over img's channels
+def _channels(mask, img):
+  return mask.reshape(mask.shape + (1,) * (img.ndim - 2))
+
+
+# Tie-break for equal-cost seams, growing with the distance from each row's overlap midpoint. It sums
+# to less than 1 along any path, below one gray level of real difference, so it only decides between
+# paths the images cannot (flat or identical overlaps), which would otherwise hug the overlap's edge
+# where the bands have no room to blend.
+def _centerBias(overlap, cols):
+  counts = overlap.sum(axis=1, keepdims=True)
+  middles = np.where(counts > 0, (overlap @ cols)[:, None] / np.maximum(counts, 1), (len(cols) - 1) / 2)
+  return np.abs(cols[None, :] - middles) / (len(cols) * overlap.shape[0])
+
+
+# Blend crop b (mask maskB) into crop a (maskA) in place, both the overlap's bounding box
+def _seamBlend(a, maskA, b, maskB, numBands):
+  overlap = maskA & maskB
+  # Seams run along the longer side of the box
+  transposed = overlap.shape[1] > overlap.shape[0]
+  if transposed:
+    a, maskA, b, maskB, overlap = (np.swapaxes(x, 0, 1) for x in (a, maskA, b, maskB, overlap))
+  floatA, floatB = a.astype(np.float32, order="C"), b.astype(np.float32, order="C")
+  difference = np.abs(floatA - floatB)
+  if difference.ndim == 3:
+    difference = difference.sum(axis=2)
+  cols = np.arange(overlap.shape[1])
+  seam = _findSeam(np.where(overlap, difference + _centerBias(overlap, cols), OUTSIDE_SEAM_COST))
+
+  # a keeps the side of the seam its coverage leans to
+  meanColA = maskA.sum(axis=0) @ cols / max(maskA.sum(), 1)
+  meanColB = maskB.sum(axis=0) @ cols / max(maskB.sum(), 1)
+  leftOfSeam = cols[None, :] < seam[:, None]
+  sideA = leftOfSeam if meanColA <= meanColB else ~leftOfSeam
+  labelA = maskA & (~maskB | sideA)
+
+  # The blend of the coarsest band spreads about 2^(levels + 1) px either side of the seam; levels are
+  # capped so that fits the overlap, and the band is cut no closer, which would leave a step
+  levels = max(0, min(numBands, int(np.log2(min(overlap.shape))) - 2))
+  result = np.where(_channels(labelA, a), floatA, floatB)
+  if levels > 0:
+    # Each image is completed with the other where it has no pixels, so the bands see no false edges
+    blended = _multibandBlend(
+      np.where(_channels(maskA, a), floatA, floatB), np.where(_channels(maskB, b), floatB, floatA),
+      labelA.astype(np.float32, order="C"), levels,
+    )
+    band = overlap & (np.abs(cols[None, :] - seam[:, None]) <= 2 ** (levels + 1))
+    np.copyto(result, blended, where=_channels(band, a))
+  np.copyto(a, np.clip(result, 0, 255).astype(np.uint8), where=_channels(overlap, a))
+  np.copyto(a, b, where=_channels(maskB & ~maskA, a))
+
+
+# Warp img onto out, seam-blending it with what covered (bool, canvas-sized) marks as already there
+def compositeMultiband(out, covered, img, canvasTransform, numBands):
+  box = _quadBox(warpCorners(img, canvasTransform), covered.shape)
+  if box is None:
+    return
+  x0, y0, x1, y1 = box
+  boxTransform = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64) @ canvasTransform
+  size = (x1 - x0, y1 - y0)
+  warped = cv2.warpPerspective(img, boxTransform, size, borderMode=cv2.BORDER_REPLICATE)
+  alpha = np.full(img.shape[:2], 255, dtype=np.uint8)
+  mask = cv2.warpPerspective(alpha, boxTransform, size, borderMode=cv2.BORDER_CONSTANT) > 0
+  coveredBox, outBox = covered[y0:y1, x0:x1], out[y0:y1, x0:x1]
+
+  overlapXY = cv2.findNonZero((coveredBox & mask).view(np.uint8))
+  if overlapXY is None:
+    np.copyto(outBox, warped, where=_channels(mask, warped))
+  else:
+    ox, oy, ow, oh = cv2.boundingRect(overlapXY)
+    rows, cols = slice(oy, oy + oh), slice(ox, ox + ow)
+    onlyNew = mask & ~coveredBox
+    onlyNew[rows, cols] = False
+    np.copyto(outBox, warped, where=_channels(onlyNew, warped))
+    _seamBlend(outBox[rows, cols], coveredBox[rows, cols], warped[rows, cols], mask[rows, cols], numBands)
+  coveredBox |= mask
+
+
+def _stitchMultiband(images, canvasTransforms, panoramaHeight, panoramaWidth, numBands):
+  out = np.zeros((panoramaHeight, panoramaWidth) + images[0].shape[2:], dtype=np.uint8)
+  covered = np.zeros((panoramaHeight, panoramaWidth), dtype=bool)
+  for img, canvasTransform in zip(images, canvasTransforms):
+    compositeMultiband(out, covered, img, canvasTransform, numBands)
+  return out
+
+
+# Gray (H, W) or multichannel (H, W, C): one warp, one set of masks and distance maps for all channels.
+# Canvases over maxCanvasPixels raise CanvasTooLargeError before any allocation; "auto" tiles large ones.
+def stitchAndBlendImages(
+  img1,
+  img2,
+  homographyMatrix,
+  eps: float = 1e-6,
+  *,
+  maxCanvasPixels=DEFAULT_MAX_CANVAS_PIXELS,
+  compositor: str = "auto",
+  tileSize: int = DEFAULT_TILE_SIZE,
+  blendMode: str = "feather",
+  numBands: int = DEFAULT_NUM_BANDS,
+):
+  if compositor not in COMPOSITORS:
+    raise ValueError(f"unknown compositor: {compositor}")
+  if blendMode not in BLEND_MODES:
+    raise ValueError(f"unknown blend mode: {blendMode}")
+  offset, offsetTransform, panoramaHeight, panoramaWidth = _computeBoundsAndTransform(
+    img1, img2, homographyMatrix, maxCanvasPixels
+  )
+  # Bounded by the overlap whatever the canvas size, so the compositor does not apply
+  if blendMode == "multiband":
+    canvasTransforms = [offsetTransform.astype(np.float64), offsetTransform @ homographyMatrix]
+    return _stitchMultiband([img1, img2], canvasTransforms, panoramaHeight, panoramaWidth, numBands)
+  if compositor == "auto":
+    compositor = "tiled" if panoramaHeight * panoramaWidth > TILED_MIN_PIXELS else "full"
+
+  # Use dist transform feathering
+  if compositor == "full":
+    return _stitchFull(img1, img2, homographyMatrix, offset, offsetTransform, panoramaHeight, panoramaWidth, eps)
+  return _stitchTiled(
+    img1, img2, homographyMatrix, offset, offsetTransform, panoramaHeight, panoramaWidth, eps, tileSize
+  )
+
+
+def stitchAndBlendImagesGray(img1, img2, homographyMatrix, eps: float = 1e-6, **kwargs):
+  return stitchAndBlendImages(img1, img2, homographyMatrix, eps, **kwargs)
+
+
+def stitchAndBlendImagesRgb(image1, image2, homographyMatrix, **kwargs):
+  return stitchAndBlendImages(image1, image2, homographyMatrix, **kwargs)
+
+
+# Canvas for several images warped into the reference frame by their homographies
+def _computeMultiBounds(images, homographies, maxCanvasPixels):
+  allCorners = np.vstack([warpCorners(img, homography) for img, homography in zip(images, homographies)])
+  extent = allCorners.max(axis=0) - allCorners.min(axis=0) + 1
+  checkCanvasBudget(extent[0], extent[1], maxCanvasPixels)
+
+  xMin, yMin = np.int32(allCorners.min(axis=0) - 0.5)
+  xMax, yMax = np.int32(allCorners.max(axis=0) + 0.5)
+  offsetTransform = np.array([[1, 0, -xMin], [0, 1, -yMin], [0, 0, 1]], dtype=np.float64)
+  return offsetTransform, int(yMax - yMin), int(xMax - xMin)
+
+
+# Weighted mean of every image covering a tile, weights are the distance to each warped quad's border
+def _blendMultiTile(images, alphas, canvasTransforms, quads, segments, tileRect, eps, out):
+  tileY, tileX, tileHeight, tileWidth = tileRect
+  xs = np.arange(tileX, tileX + tileWidth, dtype=np.float32)
+  ys = np.arange(tileY, tileY + tileHeight, dtype=np.float32)
+  channelShape = out.shape[2:]
+  numerator = np.zeros((tileHeight, tileWidth) + channelShape, dtype=np.float32)
+  weightSum = np.zeros((tileHeight, tileWidth), dtype=np.float32)
+  tileShift = np.array([[1, 0, -tileX], [0, 1, -tileY], [0, 0, 1]], dtype=np.float64)
+
+  for img, alpha, canvasTransform, quad, imgSegments in zip(images, alphas, canvasTransforms, quads, segments):
+    quadMin, quadMax = quad.min(axis=0), quad.max(axis=0)
+    if quadMax[0] < tileX or quadMin[0] > tileX + tileWidth or quadMax[1] < tileY or quadMin[1] > tileY + tileHeight:
+      continue
+    tileTransform = tileShift @ canvasTransform
+    warped = cv2.warpPerspective(img, tileTransform, (tileWidth, tileHeight), borderMode=cv2.BORDER_REPLICATE)
+    mask = cv2.warpPerspective(alpha, tileTransform, (tileWidth, tileHeight), borderMode=cv2.BORDER_CONSTANT) > 0
+    if not mask.any():
+      continue
+    weight = _quadDistance(xs, ys, imgSegments) * mask
+    weightSum += weight
+    numerator += warped.astype(np.float32) * weight.reshape(weight.shape + (1,) * len(channelShape))
+
+  covered = weightSum > 0
+  blended = numerator[covered] / (weightSum[covered] + eps).reshape((-1,) + (1,) * len(channelShape))
+  tile = np.zeros_like(numerator, dtype=np.uint8)
+  tile[covered] = np.clip(blended, 0, 255).astype(np.uint8)
+  out[tileY:tileY + tileHeight, tileX:tileX + tileWidth] = tile
+
 
+# Canvas height and width, and the transform taking each image onto the canvas, without blending
+def canvasLayout(images, homographies, maxCanvasPixels=DEFAULT_MAX_CANVAS_PIXELS):
+  offsetTransform, panoramaHeight, panoramaWidth = _computeMultiBounds(images, homographies, maxCanvasPixels)
+  return [offsetTransform @ homography for homography in homographies], panoramaHeight, panoramaWidth
 
-def stitchAndBlendImagesRgb(image1, image2, homographyMatrix):
-  red1, green1, blue1 = cv2.split(image1)
-  red2, green2, blue2 = cv2.split(image2)
 
-  stitchedRed = stitchAndBlendImagesGray(red1, red2, homographyMatrix)
-  stitchedGreen = stitchAndBlendImagesGray(green1, green2, homographyMatrix)
-  stitchedBlue = stitchAndBlendImagesGray(blue1, blue2, homographyMatrix)
+# N images in one tiled pass; homographies map each image into the reference frame.
+# With blendMode="multiband" images are seam-blended in list order instead.
+def stitchAndBlendImagesMulti(
+  images,
+  homographies,
+  eps: float = 1e-6,
+  *,
+  maxCanvasPixels=DEFAULT_MAX_CANVAS_PIXELS,
+  tileSize: int = DEFAULT_TILE_SIZE,
+  blendMode: str = "feather",
+  numBands: int = DEFAULT_NUM_BANDS,
+):
+  if blendMode not in BLEND_MODES:
+    raise ValueError(f"unknown blend mode: {blendMode}")
+  offsetTransform, panoramaHeight, panoramaWidth = _computeMultiBounds(images, homographies, maxCanvasPixels)
+  canvasTransforms = [offsetTransform @ homography for homography in homographies]
+  if blendMode == "multiband":
+    return _stitchMultiband(images, canvasTransforms, panoramaHeight, panoramaWidth, numBands)
+  quads = [warpCorners(img, transform) for img, transform in zip(images, canvasTransforms)]
+  segments = [_quadSegments(quad, (panoramaHeight, panoramaWidth)) for quad in quads]
+  alphas = [np.full(img.shape[:2], 255, dtype=np.uint8) for img in images]
 
-  panorama = cv2.merge((stitchedRed, stitchedGreen, stitchedBlue))
-  return panorama
+  out = np.empty((panoramaHeight, panoramaWidth) + images[0].shape[2:], dtype=np.uint8)
+  for tileY in range(0, panoramaHeight, tileSize):
+    for tileX in range(0, panoramaWidth, tileSize):
+      tileRect = (tileY, tileX, min(tileSize, panoramaHeight - tileY), min(tileSize, panoramaWidth - tileX))
+      _blendMultiTile(images, alphas, canvasTransforms, quads, segments, tileRect, eps, out)
+  return out
@@ -1,34 +1,63 @@
+from functools import lru_cache
 import numpy as np
-from scipy.signal import convolve2d
-from scipy.ndimage import rank_filter
-from scipy.stats import norm
+import cv2
+from .filtering import convolveSame
+
+# Normal pdf with mean 0 at the integer offsets -radius..radius, as a column
+def _gaussianPdf(radius, sigma):
+  offsets = np.arange(-radius, radius + 1, dtype=np.float64)
+  return (np.exp(-0.5 * (offsets / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))).reshape(-1, 1)
+
+def _readOnly(*arrays):
+  for arr in arrays:
+    arr.flags.writeable = False
+  return arrays
 
 def _normalizeGaussDerivative(gaussDerivative):
   return gaussDerivative * 2 / np.abs(gaussDerivative).sum()
 
+# Kernels depend only on sigma, so they are built once per process and shared read-only
+@lru_cache(maxsize=None)
 def _buildGaussDerivativeKernels(sigma):
   GaussRadius = int(4 * np.floor(sigma))
-  G = norm.pdf(np.arange(-GaussRadius, GaussRadius + 1), loc=0, scale=sigma).reshape(-1, 1)
+  G = _gaussianPdf(GaussRadius, sigma)
   G = G.T * G
 
   # Calc derivatives
   Gx, Gy = np.gradient(G)
   Gx = _normalizeGaussDerivative(Gx)
   Gy = _normalizeGaussDerivative(Gy)
-  return Gx, Gy
+  return _readOnly(Gx, Gy)
+
+SIFT_CHUNK_SIZE = 128
+
+# Precision policies: float64 throughout, float32 feature maps and descriptors, or float32 maps with
+# descriptors quantized to uint8
+FEATURE_PRECISIONS = ("float64", "float32", "uint8")
+# Scale mapping normalized descriptor entries to uint8, the one OpenCV's SIFT uses
+DESCRIPTOR_QUANTIZATION_SCALE = 512.0
+
+# dtype of the feature maps (derivatives, Harris response, gradients) under a precision policy
+def precisionDtype(precision):
+  if precision not in FEATURE_PRECISIONS:
+    raise ValueError(f"unknown feature precision: {precision}")
+  return np.float64 if precision == "float64" else np.float32
+
+def quantizeDescriptors(descriptors):
+  return np.clip(np.rint(descriptors * DESCRIPTOR_QUANTIZATION_SCALE), 0, 255).astype(np.uint8)
 
 # SIFT helpers
-def _prepSiftImg(img):
-  return img.astype(np.float64)
+def _prepSiftImg(img, dtype=np.float64):
+  return img.astype(dtype)
 
-def _calcGradients(img, sigmaEdge=1):
+def _calcGradients(img, sigmaEdge=1, backend="auto"):
   Gx, Gy = _buildGaussDerivativeKernels(sigmaEdge)
-  gradX = convolve2d(img, Gx, "same")
-  gradY = convolve2d(img, Gy, "same")
+  gradX = convolveSame(img, Gx, backend, img.dtype)
+  gradY = convolveSame(img, Gy, backend, img.dtype)
   magnitude = np.sqrt(gradX ** 2 + gradY ** 2)
-  theta = np.arctan2(gradY, gradX)
-  return gradX, gradY, magnitude, theta
+  return gradX, gradY, magnitude
 
+@lru_cache(maxsize=None)
 def _buildSiftAngleAndCellGrids(numAngles, numBins):
   angleStep = 2 * np.pi / numAngles
   angles = np.arange(0, 2 * np.pi, angleStep)
@@ -42,25 +71,27 @@ def _buildSiftAngleAndCellGrids(numAngles, numBins):
   gridX = gridX.reshape((1, -1))
   gridY = gridY.reshape((1, -1))
 
-  return angles, gridX, gridY
+  return _readOnly(angles, gridX, gridY)
 
-def _calcAngleVolume(theta, magnitude, angles, alpha, imgHeight, imgWidth):
-  # Angle strength at each pixel
-  numAngles = len(angles)
-  angleVol = np.zeros((imgHeight, imgWidth, numAngles))
-  for i in range(numAngles):
-    cosAligned = np.cos(theta - angles[i]) ** alpha
-    cosAligned = cosAligned * (cosAligned > 0)
-    angleVol[:, :, i] = cosAligned * magnitude
-  return angleVol
+# Angle strength cos(theta - angle)^alpha * magnitude for gathered pixels only, (..., numAngles)
+def _calcAngleResponses(gradX, gradY, magnitude, angles, alpha):
+  hasEdge = magnitude > 0
+  unitX = np.divide(gradX, magnitude, out=np.ones_like(magnitude), where=hasEdge)
+  unitY = np.divide(gradY, magnitude, out=np.zeros_like(magnitude), where=hasEdge)
+  cosAligned = unitX[..., None] * np.cos(angles).astype(magnitude.dtype)
+  cosAligned += unitY[..., None] * np.sin(angles).astype(magnitude.dtype)
+  np.maximum(cosAligned, 0, out=cosAligned)
+  cosAligned **= alpha
+  cosAligned *= magnitude[..., None]
+  return cosAligned
 
 # Calc rectangle bounds and gridStep for a keypoint
-def _calcKeypointBounds(centerX, centerY, keypointRadius, numBins, imgHeight, imgWidth):
+def _calcKeypointBounds(centerX, centerY, keypointRadius, numBins):
   gridStep = 2.0 / numBins * keypointRadius
-  xMin = np.floor(np.max([centerX - keypointRadius - gridStep / 2, 0])).astype(np.int32)
-  xMax = np.ceil(np.min([centerX + keypointRadius + gridStep / 2, imgWidth])).astype(np.int32)
-  yMin = np.floor(np.max([centerY - keypointRadius - gridStep / 2, 0])).astype(np.int32)
-  yMax = np.ceil(np.min([centerY + keypointRadius + gridStep / 2, imgHeight])).astype(np.int32)
+  xMin = int(np.floor(centerX - keypointRadius - gridStep / 2))
+  xMax = int(np.ceil(centerX + keypointRadius + gridStep / 2))
+  yMin = int(np.floor(centerY - keypointRadius - gridStep / 2))
+  yMax = int(np.ceil(centerY + keypointRadius + gridStep / 2))
   return xMin, xMax, yMin, yMax, gridStep
 
 # List all (x, y) pixels in rectangle
@@ -83,21 +114,62 @@ def _calcBilinearWeights(pixelXGrid, pixelYGrid, gridCenterX, gridCenterY, gridS
   weightY = (1 - weightY) * (weightY <= 1)
   return weightX * weightY
 
-def _sumAngles(angleVol, xMin, xMax, yMin, yMax, cellWeights, numAngles, numBins):
-  numSamples = numBins * numBins
-  angleHistBlock = np.zeros((numAngles, numSamples))
-  for j in range(numAngles):
-    patchResponse = angleVol[yMin:yMax, xMin:xMax, j].reshape((-1, 1))
-    angleHistBlock[j, :] = (patchResponse * cellWeights).sum(axis=0)
-  return angleHistBlock.flatten()
-
-def _calcKeypointSift(angleVol, centerX, centerY, keypointRadius, gridX, gridY, numBins, imgHeight, imgWidth, numAngles):
-  gridCenterX = gridX * keypointRadius + centerX
-  gridCenterY = gridY * keypointRadius + centerY
-  xMin, xMax, yMin, yMax, gridStep = _calcKeypointBounds(centerX, centerY, keypointRadius, numBins, imgHeight, imgWidth)
+# Cell weights for every keypoint sharing a radius and sub-pixel offset.
+# Bounds are relative to the integer part of the center, weights are (numPixels, numSamples)
+def _calcSiftKernel(fracX, fracY, keypointRadius, gridX, gridY, numBins):
+  xMin, xMax, yMin, yMax, gridStep = _calcKeypointBounds(fracX, fracY, keypointRadius, numBins)
   pixelXGrid, pixelYGrid = _buildPixelGrid(xMin, xMax, yMin, yMax)
+  gridCenterX = gridX * keypointRadius + fracX
+  gridCenterY = gridY * keypointRadius + fracY
   cellWeights = _calcBilinearWeights(pixelXGrid, pixelYGrid, gridCenterX, gridCenterY, gridStep)
-  return _sumAngles(angleVol, xMin, xMax, yMin, yMax, cellWeights, numAngles, numBins)
+  return xMin, xMax, yMin, yMax, cellWeights
+
+# Clipped gather indices for (numKeypoints, patchHeight, patchWidth) patches and their in-image mask
+def _patchIndices(originX, originY, xMin, xMax, yMin, yMax, imgHeight, imgWidth):
+  rowIdx = originY[:, None] + np.arange(yMin, yMax)[None, :]
+  colIdx = originX[:, None] + np.arange(xMin, xMax)[None, :]
+  valid = ((rowIdx >= 0) & (rowIdx < imgHeight))[:, :, None] & ((colIdx >= 0) & (colIdx < imgWidth))[:, None, :]
+  rowIdx = np.clip(rowIdx, 0, imgHeight - 1)[:, :, None]
+  colIdx = np.clip(colIdx, 0, imgWidth - 1)[:, None, :]
+  return rowIdx, colIdx, valid
+
+# Descriptors for keypoints sharing one kernel, in chunks to bound the patch buffer
+def _calcSiftGroup(edgeGradients, angles, alpha, originX, originY, kernelBounds, cellWeights, chunkSize):
+  gradX, gradY, magnitude = edgeGradients
+  imgHeight, imgWidth = magnitude.shape
+  numKeypoints = len(originX)
+  groupDescriptors = np.empty((numKeypoints, len(angles) * cellWeights.shape[1]), dtype=magnitude.dtype)
+  for start in range(0, numKeypoints, chunkSize):
+    stop = min(start + chunkSize, numKeypoints)
+    rowIdx, colIdx, valid = _patchIndices(originX[start:stop], originY[start:stop], *kernelBounds, imgHeight, imgWidth)
+    patchMagnitude = magnitude[rowIdx, colIdx] * valid
+    patches = _calcAngleResponses(gradX[rowIdx, colIdx], gradY[rowIdx, colIdx], patchMagnitude, angles, alpha)
+    patches = patches.reshape(stop - start, -1, len(angles))
+    # (k, angles, pixels) @ (pixels, samples), flattened angle-major
+    angleHist = np.matmul(patches.transpose(0, 2, 1), cellWeights.astype(patches.dtype))
+    groupDescriptors[start:stop] = angleHist.reshape(stop - start, -1)
+  return groupDescriptors
+
+# Raw descriptors; keypoints with the same radius and sub-pixel offset share one weight kernel
+def _accumulateSift(edgeGradients, angles, alpha, keypointsXYR, enlargeFactor, gridX, gridY, numBins):
+  centers = keypointsXYR[:, :2].astype(np.float64)
+  origins = np.floor(centers).astype(np.intp)
+  sampleRadii = keypointsXYR[:, 2].astype(np.float64) * enlargeFactor
+  kernelKeys = np.column_stack((sampleRadii, centers - origins))
+  uniqueKeys, groupOf = np.unique(kernelKeys, axis=0, return_inverse=True)
+  groupOf = groupOf.ravel()
+
+  magnitude = edgeGradients[2]
+  siftDescriptors = np.zeros((len(keypointsXYR), numBins * numBins * len(angles)), dtype=magnitude.dtype)
+  for groupIdx, (sampleRadius, fracX, fracY) in enumerate(uniqueKeys):
+    members = np.flatnonzero(groupOf == groupIdx)
+    xMin, xMax, yMin, yMax, cellWeights = _calcSiftKernel(fracX, fracY, sampleRadius, gridX, gridY, numBins)
+    siftDescriptors[members] = _calcSiftGroup(
+      edgeGradients, angles, alpha, origins[members, 0], origins[members, 1],
+      (xMin, xMax, yMin, yMax), cellWeights, SIFT_CHUNK_SIZE
+    )
+
+  return siftDescriptors
 
 def _normalizeDescriptors(siftDescriptors):
   normalizedDescriptors = np.sqrt(np.sum(siftDescriptors ** 2, axis=-1))
@@ -109,73 +181,159 @@ def _normalizeDescriptors(siftDescriptors):
     siftDescriptors[normalizedDescriptors > 1, :] = siftDescriptorsNorm
   return siftDescriptors
 
-# Calc sift descriptors at circles
-def findSift(img, keypointsXYR, enlargeFactor=1.5):
-  img = _prepSiftImg(img)
+# Calc sift descriptors at circles, img may be a FeatureContext shared with harrisFindCorners
+def findSift(img, keypointsXYR, enlargeFactor=1.5, *, backend="auto", dtype=np.float64):
+  context = _asContext(img, backend, dtype)
 
   NUM_ANGLES = 8
   NUM_BINS = 4
-  NUM_SAMPLES = NUM_BINS * NUM_BINS
   ALPHA = 9
   SIGMA_EDGE = 1
 
   angles, gridX, gridY = _buildSiftAngleAndCellGrids(NUM_ANGLES, NUM_BINS)
-  imgHeight, imgWidth = img.shape[:2]
-  numKeypoints = keypointsXYR.shape[0]
-
-  # Gradients and angle tensor
-  _, _, magnitude, theta = _calcGradients(img, sigmaEdge=SIGMA_EDGE)
-  angleVol = _calcAngleVolume(theta, magnitude, angles, ALPHA, imgHeight, imgWidth)
-
-  # Accumulate descriptors
-  siftDescriptors = np.zeros((numKeypoints, NUM_SAMPLES * NUM_ANGLES))
-  for i in range(numKeypoints):
-    centerX, centerY = keypointsXYR[i, :2]
-    sampleRadius = keypointsXYR[i, 2] * enlargeFactor
-    siftDescriptors[i, :] = _calcKeypointSift(
-      angleVol, centerX, centerY, sampleRadius, gridX, gridY,
-      NUM_BINS, imgHeight, imgWidth, NUM_ANGLES
-    )
 
+  # Gradients are cached per image, angle responses only exist inside keypoint patches
+  edgeGradients = context.edgeGradients(SIGMA_EDGE)
+  siftDescriptors = _accumulateSift(edgeGradients, angles, ALPHA, keypointsXYR, enlargeFactor, gridX, gridY, NUM_BINS)
   return _normalizeDescriptors(siftDescriptors)
 
 # Harris helpers
+@lru_cache(maxsize=None)
 def _buildHarrisGaussKernel(sigma):
   kernelRadius = int(np.round(3 * np.floor(sigma)))
-  gaussKernel = norm.pdf(np.arange(-kernelRadius, kernelRadius + 1), loc=0, scale=sigma).reshape(-1, 1)
+  gaussKernel = _gaussianPdf(kernelRadius, sigma)
   gaussKernel = gaussKernel.T * gaussKernel
-  return gaussKernel / gaussKernel.sum()
+  return _readOnly(gaussKernel / gaussKernel.sum())[0]
 
 # Calc gradient derivatives
-def _calcImgDerivatives(img):
+def _calcImgDerivatives(img, backend="auto", dtype=np.float64):
   dx = np.tile([[-1, 0, 1]], [3, 1])
   dy = dx.T
-  gradX = convolve2d(img, dx, "same")
-  gradY = convolve2d(img, dy, "same")
+  gradX = convolveSame(img, dx, backend, dtype)
+  gradY = convolveSame(img, dy, backend, dtype)
   return gradX, gradY
 
-def _calcHarrisResponse(gradX, gradY, gaussKernel):
-  gradX2 = convolve2d(gradX ** 2, gaussKernel, "same")
-  gradY2 = convolve2d(gradY ** 2, gaussKernel, "same")
-  gradXY = convolve2d(gradX * gradY, gaussKernel, "same")
+def _calcHarrisResponse(gradX, gradY, gaussKernel, backend="auto"):
+  dtype = gradX.dtype
+  gradX2 = convolveSame(gradX ** 2, gaussKernel, backend, dtype)
+  gradY2 = convolveSame(gradY ** 2, gaussKernel, backend, dtype)
+  gradXY = convolveSame(gradX * gradY, gaussKernel, backend, dtype)
   den = gradX2 + gradY2
   num = (gradX2 * gradY2 - gradXY ** 2)
-  return np.divide(num, den, out=np.zeros_like(den, dtype=float), where=den != 0)
+  return np.divide(num, den, out=np.zeros_like(den), where=den != 0)
 
+# Window max by grayscale dilation; the border is ignored, which matches a reflected border
 def _suppressNonMaxAndThreshold(response, threshold, windowRadius):
   size = int(2 * windowRadius + 1)
-  windowMax = rank_filter(response, -1, size=size)
+  windowMax = cv2.dilate(response, np.ones((size, size), dtype=np.uint8))
   suppressionMask = (response == windowMax) & (response > threshold)
   cornerRows, cornerCols = suppressionMask.nonzero()
   return suppressionMask, cornerRows, cornerCols
 
-# Img must be in grayscale
-def harrisFindCorners(img, sigma, threshold=None, radius=None):
-  gradX, gradY = _calcImgDerivatives(img)
-  gaussKernel = _buildHarrisGaussKernel(sigma)
-  response = _calcHarrisResponse(gradX, gradY, gaussKernel)
+# Ways to choose maxCorners of the corners that pass NMS: the strongest ones, the strongest per grid
+# cell taken round-robin across cells, or adaptive non-maximal suppression (largest suppression radius)
+CORNER_SELECTIONS = ("strongest", "grid", "anms")
+# Grid cells are sized to hold this many of the kept corners on average
+GRID_CORNERS_PER_CELL = 4
+# A corner only suppresses weaker ones when robustness * its response still exceeds theirs
+ANMS_ROBUSTNESS = 0.9
+ANMS_BLOCK_SIZE = 128
+
+def _selectGrid(strengths, rows, cols, shape, maxCorners):
+  cellSize = max(1.0, np.sqrt(shape[0] * shape[1] * GRID_CORNERS_PER_CELL / maxCorners))
+  gridCols = int(np.ceil(shape[1] / cellSize))
+  cells = (rows // cellSize).astype(np.int64) * gridCols + (cols // cellSize).astype(np.int64)
+  byCell = np.lexsort((-strengths, cells))
+  sortedCells = cells[byCell]
+  rankInCell = np.arange(len(byCell)) - np.searchsorted(sortedCells, sortedCells)
+  # Every cell's best corner comes before any cell's second best, and so on
+  byRank = np.lexsort((-strengths[byCell], rankInCell))
+  return byCell[byRank[:maxCorners]]
+
+# Suppression radius of each corner: distance to the nearest sufficiently stronger one. Only corners
+# earlier in strength order can qualify, so blocks compare against their prefix.
+def _selectAnms(strengths, rows, cols, maxCorners):
+  order = np.argsort(-strengths, kind="stable")
+  sortedStrengths = strengths[order]
+  sortedRows, sortedCols = rows[order].astype(np.float64), cols[order].astype(np.float64)
+  radii = np.full(len(order), np.inf)
+  for start in range(1, len(order), ANMS_BLOCK_SIZE):
+    stop = min(start + ANMS_BLOCK_SIZE, len(order))
+    stronger = sortedStrengths[None, :stop] * ANMS_ROBUSTNESS > sortedStrengths[start:stop, None]
+    dist2 = (sortedRows[start:stop, None] - sortedRows[None, :stop]) ** 2
+    dist2 += (sortedCols[start:stop, None] - sortedCols[None, :stop]) ** 2
+    radii[start:stop] = np.where(stronger, dist2, np.inf).min(axis=1)
+  return order[np.argsort(-radii, kind="stable")[:maxCorners]]
+
+# At most maxCorners of the given corners, kept in raster order; all of them when maxCorners is None
+def selectCorners(response, rows, cols, maxCorners=None, selection="strongest"):
+  if selection not in CORNER_SELECTIONS:
+    raise ValueError(f"unknown corner selection: {selection}")
+  if maxCorners is None or len(rows) <= maxCorners:
+    return rows, cols
+  strengths = response[rows, cols]
+  if selection == "grid":
+    keep = _selectGrid(strengths, rows, cols, response.shape, maxCorners)
+  elif selection == "anms":
+    keep = _selectAnms(strengths, rows, cols, maxCorners)
+  else:
+    keep = np.argpartition(-strengths, maxCorners - 1)[:maxCorners]
+  keep = np.sort(keep)
+  return rows[keep], cols[keep]
+
+# (mask, rows, cols) of corners from a response computed with threshold=None, so only this step
+# reruns when the threshold, window or corner budget changes
+def harrisCornersFromResponse(response, threshold, radius, maxCorners=None, selection="strongest"):
+  suppressionMask, cornerRows, cornerCols = _suppressNonMaxAndThreshold(response, threshold, radius)
+  selectedRows, selectedCols = selectCorners(response, cornerRows, cornerCols, maxCorners, selection)
+  if len(selectedRows) < len(cornerRows):
+    suppressionMask = np.zeros_like(suppressionMask)
+    suppressionMask[selectedRows, selectedCols] = True
+  return suppressionMask, selectedRows, selectedCols
+
+# Img must be in grayscale, or a FeatureContext built from one
+def harrisFindCorners(
+  img, sigma, threshold=None, radius=None, *, maxCorners=None, selection="strongest", backend="auto", dtype=np.float64
+):
+  response = _asContext(img, backend, dtype).harrisResponse(sigma)
 
   if threshold is None or radius is None:
     return response
   else:
-    return _suppressNonMaxAndThreshold(response, threshold, radius)
+    return harrisCornersFromResponse(response, threshold, radius, maxCorners, selection)
+
+# Per-image derivative cache so the Harris and SIFT stages (and later ones) differentiate once
+class FeatureContext:
+  def __init__(self, img, *, backend="auto", dtype=np.float64):
+    self.img = img
+    self.backend = backend
+    self.dtype = dtype
+    self.shape = img.shape[:2]
+    self._cache = {}
+
+  def _cached(self, key, compute):
+    if key not in self._cache:
+      self._cache[key] = compute()
+    return self._cache[key]
+
+  def floatImg(self):
+    return self._cached("float", lambda: _prepSiftImg(self.img, self.dtype))
+
+  # Box derivatives used by Harris
+  def imgDerivatives(self):
+    return self._cached("box", lambda: _calcImgDerivatives(self.floatImg(), self.backend, self.dtype))
+
+  def harrisResponse(self, sigma):
+    def compute():
+      gradX, gradY = self.imgDerivatives()
+      return _calcHarrisResponse(gradX, gradY, _buildHarrisGaussKernel(sigma), self.backend)
+    return self._cached(("harris", float(sigma)), compute)
+
+  # Gaussian derivatives used by SIFT, (gradX, gradY, magnitude)
+  def edgeGradients(self, sigmaEdge=1):
+    return self._cached(("edge", float(sigmaEdge)), lambda: _calcGradients(self.floatImg(), sigmaEdge, self.backend))
+
+def _asContext(img, backend, dtype):
+  if isinstance(img, FeatureContext):
+    return img
+  return FeatureContext(img, backend=backend, dtype=dtype)
@@ -0,0 +1,141 @@
+import os
+import struct
+import time
+import numpy as np
+
+# Persistent store of per-image features (SIFT descriptors and keypoints), keyed by the pipeline's
+# stage key for them, which covers the image pixels and every feature parameter. One file per entry:
+# a fixed header, then both arrays raw. Entries are memory-mapped read-only, so worker processes
+# reading the same entry share its pages through the OS page cache instead of each holding a copy.
+# Writes go through a temporary file and a rename, so concurrent writers and readers never see a
+# partial entry; the store is bounded by bytes, evicting the least recently used entries.
+
+DEFAULT_FEATURE_STORE_BYTES = 1 * 2**30
+# Bumped whenever the layout, or how features are computed, changes; older entries are never read
+FEATURE_STORE_VERSION = 1
+_MAGIC = b"FEAT"
+# magic, version, keypoint count, keypoint columns, descriptor length, then both dtypes as numpy strings
+_HEADER = struct.Struct("<4sHIHI8s8s")
+_HEADER_SIZE = 64
+_ALIGN = 16
+# A temporary file is orphaned once its writer process is gone, or past any time a write could take
+TEMPORARY_MAX_AGE_SECONDS = 3600
+
+
+def _aligned(offset):
+  return -(-offset // _ALIGN) * _ALIGN
+
+# Whether the process that wrote a "<entry>.<pid>.tmp" file has exited. Only checked on POSIX,
+# where signal 0 probes a process without touching it.
+def _writerExited(name):
+  try:
+    pid = int(name.rsplit(".", 2)[-2])
+  except (IndexError, ValueError):
+    return False
+  if os.name != "posix" or pid == os.getpid():
+    return False
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return True
+  except PermissionError:
+    pass
+  return False
+
+
+class FeatureStore:
+  def __init__(self, directory, maxBytes=DEFAULT_FEATURE_STORE_BYTES):
+    self.directory = directory
+    self.maxBytes = maxBytes
+    os.makedirs(directory, exist_ok=True)
+
+  def _path(self, key):
+    return os.path.join(self.directory, f"{key}.v{FEATURE_STORE_VERSION}.feat")
+
+  # (descriptors, keypoints) as read-only memory maps, or None when the entry is missing or unreadable
+  def get(self, key):
+    path = self._path(key)
+    try:
+      data = np.memmap(path, dtype=np.uint8, mode="r")
+    except FileNotFoundError:
+      return None
+    except ValueError:
+      # Empty file, which put would otherwise never replace
+      self._remove(path)
+      return None
+    try:
+      magic, version, numKeypoints, keypointCols, descriptorLength, keypointDtype, descriptorDtype = _HEADER.unpack_from(data)
+      if magic != _MAGIC or version != FEATURE_STORE_VERSION:
+        raise ValueError("not a feature store entry")
+      keypointDtype = np.dtype(keypointDtype.rstrip(b"\0").decode())
+      descriptorDtype = np.dtype(descriptorDtype.rstrip(b"\0").decode())
+      keypointsBytes = numKeypoints * keypointCols * keypointDtype.itemsize
+      descriptorsOffset = _aligned(_HEADER_SIZE + keypointsBytes)
+      keypoints = np.ndarray((numKeypoints, keypointCols), keypointDtype, data, _HEADER_SIZE)
+      descriptors = np.ndarray((numKeypoints, descriptorLength), descriptorDtype, data, descriptorsOffset)
+    except (struct.error, TypeError, ValueError, UnicodeDecodeError):
+      self._remove(path)
+      return None
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      pass
+    return descriptors, keypoints
+
+  def put(self, key, features):
+    descriptors, keypoints = (np.ascontiguousarray(arr) for arr in features)
+    path = self._path(key)
+    if os.path.exists(path):
+      return
+    header = _HEADER.pack(
+      _MAGIC, FEATURE_STORE_VERSION, len(keypoints), keypoints.shape[1], descriptors.shape[1],
+      keypoints.dtype.str.encode(), descriptors.dtype.str.encode(),
+    )
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    with open(tmpPath, "wb") as f:
+      f.write(header.ljust(_HEADER_SIZE, b"\0"))
+      f.write(keypoints.data)
+      f.write(b"\0" * (_aligned(_HEADER_SIZE + keypoints.nbytes) - _HEADER_SIZE - keypoints.nbytes))
+      f.write(descriptors.data)
+    os.replace(tmpPath, path)
+    self._evict()
+
+  # Temporary files left by writers that died before their rename, which eviction never sees.
+  # Run at server startup; returns how many were removed.
+  def sweepTemporary(self, maxAgeSeconds=TEMPORARY_MAX_AGE_SECONDS):
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(self.directory):
+      if not entry.name.endswith(".tmp"):
+        continue
+      try:
+        stale = now - entry.stat().st_mtime > maxAgeSeconds
+      except FileNotFoundError:
+        continue
+      if stale or _writerExited(entry.name):
+        self._remove(entry.path)
+        removed += 1
+    return removed
+
+  def _remove(self, path):
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+
+  # Oldest entries by last use go first. Mapped entries stay readable after removal.
+  def _evict(self):
+    entries = []
+    for entry in os.scandir(self.directory):
+      if entry.name.endswith(".feat"):
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    usedBytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if usedBytes <= self.maxBytes:
+        break
+      self._remove(path)
+      usedBytes -= size
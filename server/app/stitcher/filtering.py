@@ -0,0 +1,66 @@
+import numpy as np
+import cv2
+
+FILTER_BACKENDS = ("auto", "direct", "separable", "opencv", "fft")
+
+# Non-separable kernels up to this many taps go through filter2D, larger ones through FFT
+OPENCV_MAX_TAPS = 15 * 15
+SEPARABLE_RTOL = 1e-10
+
+# Split a rank-1 kernel into (column, row) 1-D filters, None if it is not separable
+def _separateKernel(kernel):
+  U, S, Vt = np.linalg.svd(kernel)
+  if S[0] == 0 or (len(S) > 1 and S[1] > SEPARABLE_RTOL * S[0]):
+    return None
+  scale = np.sqrt(S[0])
+  return U[:, 0] * scale, Vt[0] * scale
+
+def _cvDepth(dtype):
+  return cv2.CV_32F if dtype == np.float32 else cv2.CV_64F
+
+# OpenCV correlates, so kernels are flipped to match convolve2d
+def _convolveSeparable(img, columnKernel, rowKernel):
+  return cv2.sepFilter2D(
+    img, _cvDepth(img.dtype), rowKernel[::-1].astype(img.dtype), columnKernel[::-1].astype(img.dtype),
+    borderType=cv2.BORDER_CONSTANT,
+  )
+
+def _convolveOpencv(img, kernel):
+  return cv2.filter2D(img, _cvDepth(img.dtype), kernel[::-1, ::-1].astype(img.dtype), borderType=cv2.BORDER_CONSTANT)
+
+# scipy.signal is slow to import and only needed by the fallback backends, so it loads on first use
+def _convolveFft(img, kernel):
+  from scipy.signal import fftconvolve
+  return fftconvolve(img, kernel.astype(img.dtype), mode="same")
+
+def _pickBackend(kernel):
+  if kernel.shape[0] % 2 == 0 or kernel.shape[1] % 2 == 0:
+    # OpenCV anchors even kernels differently than convolve2d
+    return "fft"
+  if _separateKernel(kernel) is not None:
+    return "separable"
+  if kernel.size <= OPENCV_MAX_TAPS:
+    return "opencv"
+  return "fft"
+
+# Same result as convolve2d(img, kernel, "same") with zero fill, computed by the chosen backend
+def convolveSame(img, kernel, backend="auto", dtype=np.float64):
+  if backend not in FILTER_BACKENDS:
+    raise ValueError(f"unknown filter backend: {backend}")
+  img = np.ascontiguousarray(img, dtype=dtype)
+  kernel = np.asarray(kernel, dtype=np.float64)
+
+  if backend == "auto":
+    backend = _pickBackend(kernel)
+  if backend == "direct":
+    from scipy.signal import convolve2d
+    return convolve2d(img, kernel.astype(dtype), "same")
+  if backend == "fft":
+    return _convolveFft(img, kernel)
+  if backend == "opencv":
+    return _convolveOpencv(img, kernel)
+
+  separated = _separateKernel(kernel)
+  if separated is None:
+    raise ValueError("kernel is not separable")
+  return _convolveSeparable(img, *separated)
@@ -1,19 +1,37 @@
 import numpy as np
 
+RANSAC_SAMPLINGS = ("uniform", "prosac")
+DEFAULT_BATCH_SIZE = 64
+# Smallest triangle area (px^2) any 3 of the 4 sample points may span
+MIN_SAMPLE_AREA = 1.0
+
+# Rows of the DLT system, shape (..., 2 * numPoints, 9)
+def _buildDltRows(matchedPoints1, matchedPoints2):
+  x1, y1 = matchedPoints1[..., 0], matchedPoints1[..., 1]
+  x2, y2 = matchedPoints2[..., 0], matchedPoints2[..., 1]
+  zeros, ones = np.zeros_like(x1), np.ones_like(x1)
+  rowsX = np.stack([-x1, -y1, -ones, zeros, zeros, zeros, x1 * x2, y1 * x2, x2], axis=-1)
+  rowsY = np.stack([zeros, zeros, zeros, -x1, -y1, -ones, x1 * y2, y1 * y2, y2], axis=-1)
+  A = np.stack([rowsX, rowsY], axis=-2)
+  return A.reshape(A.shape[:-3] + (-1, 9))
+
 def _calcHomography(matchedPoints1, matchedPoints2):
-  numPoints = matchedPoints1.shape[0]
-  A = np.zeros((2 * numPoints, 9))
-  for i in range(numPoints):
-    x1, y1 = matchedPoints1[i]
-    x2, y2 = matchedPoints2[i]
-    A[2 * i] = [-x1, -y1, -1, 0, 0, 0, x1 * x2, y1 * x2, x2]
-    A[2 * i + 1] = [0, 0, 0, -x1, -y1, -1, x1 * y2, y1 * y2, y2]
+  A = _buildDltRows(np.asarray(matchedPoints1, dtype=np.float64), np.asarray(matchedPoints2, dtype=np.float64))
 
   # Solve Ah = 0
   _, _, V = np.linalg.svd(A)
   H = V[-1].reshape(3, 3)
   return H / H[2, 2]
 
+# Stacked 8x9 systems solved with one batched SVD, (B, 3, 3) plus a validity mask
+def _calcHomographiesBatch(samplePoints1, samplePoints2):
+  _, _, V = np.linalg.svd(_buildDltRows(samplePoints1, samplePoints2))
+  H = V[:, -1].reshape(-1, 3, 3)
+  scale = H[:, 2, 2]
+  valid = np.abs(scale) > 1e-12
+  H[valid] /= scale[valid, None, None]
+  return H, valid
+
 def _asArrayOrRaise(descriptorMatches):
   arr = np.array(descriptorMatches)
   if len(arr) < 4:
@@ -28,58 +46,166 @@ def _filterValidMatches(descriptorMatches, keypoints1, keypoints2):
   validIndices = index1Valid & index2Valid
   return descriptorMatches[validIndices]
 
-def _sampleFourIndices(numMatches):
-  return np.random.choice(numMatches, size=4, replace=False)
-
-def _homographyFromSample(descriptorMatches, keypoints1, keypoints2, sampleIndices):
-  selectedMatches = descriptorMatches[sampleIndices]
-  matchedPoints1 = keypoints1[selectedMatches[:, 0]]
-  matchedPoints2 = keypoints2[selectedMatches[:, 1]]
-  return _calcHomography(matchedPoints1, matchedPoints2)
-
-def _projectPoints(homographyMatrix, keypoints1):
-  homogenousKeypoints1 = np.column_stack((keypoints1[:, :2], np.ones(len(keypoints1))))
-  transformedPoints = (homographyMatrix @ homogenousKeypoints1.T)
-  transformedPoints /= (transformedPoints[2] + 1e-10)
-  return transformedPoints
-
-def _calcMatchErrors(transformedPoints, descriptorMatches, keypoints2):
-  predictedPoints = transformedPoints[:2].T[descriptorMatches[:, 0]]
-  targetPoints = keypoints2[descriptorMatches[:, 1]]
-  return np.sum((predictedPoints - targetPoints) ** 2, axis=1)
-
-def _filterInlierMatches(descriptorMatches, errors, inlierThresh):
-  return descriptorMatches[errors < inlierThresh**2]
-
-def _refitIfNeeded(bestInliers, keypoints1, keypoints2, bestHomographyMatrix):
-  if len(bestInliers) > 4:
-    sourceInlierPoints = keypoints1[bestInliers[:, 0]]
-    destinationInlierPoints = keypoints2[bestInliers[:, 1]]
-    return _calcHomography(sourceInlierPoints, destinationInlierPoints)
-  return bestHomographyMatrix
-
-def runRANSAC(descriptorMatches, keypoints1, keypoints2, iters=2000, inlierThresh=0.1):
+# Adds a column to samples, drawn uniformly from [0, poolSizes) minus the indices already in its row:
+# a draw among the unused values is shifted past every used one at or below it, in ascending order
+def _appendDistinct(rng, samples, poolSizes):
+  draw = rng.integers(0, np.asarray(poolSizes) - samples.shape[1], size=len(samples))
+  for used in np.sort(samples, axis=1).T:
+    draw += draw >= used
+  return np.column_stack((samples, draw))
+
+# (batchSize, count) indices, distinct within each row, from [0, poolSizes) (a scalar or one per row)
+def _sampleDistinct(rng, poolSizes, count, batchSize):
+  samples = np.empty((batchSize, 0), dtype=np.int64)
+  for _ in range(count):
+    samples = _appendDistinct(rng, samples, poolSizes)
+  return samples
+
+def _sampleUniform(rng, numMatches, batchSize):
+  return _sampleDistinct(rng, numMatches, 4, batchSize)
+
+# PROSAC schedule (Chum & Matas 2005): iteration t samples the n-th best match plus 3 from the
+# n - 1 better ones, where n is the smallest pool whose cumulative budget T'_n covers t
+def _prosacSchedule(numMatches, maxIters):
+  poolBudget = np.empty(numMatches + 1)
+  poolBudget[:4] = 0
+  expected = maxIters * np.prod([(4 - i) / (numMatches - i) for i in range(4)])
+  cumulative = 1.0
+  poolBudget[4] = cumulative
+  for n in range(4, numMatches):
+    nextExpected = expected * (n + 1) / (n + 1 - 4)
+    cumulative += np.ceil(nextExpected - expected)
+    expected = nextExpected
+    poolBudget[n + 1] = cumulative
+  return poolBudget
+
+def _sampleProsac(rng, poolBudget, numMatches, firstIter, batchSize):
+  iterIdx = np.arange(firstIter, firstIter + batchSize) + 1
+  poolSize = np.clip(np.searchsorted(poolBudget, iterIdx), 4, numMatches)
+  growing = poolSize < numMatches
+  samples = _sampleDistinct(rng, np.where(growing, poolSize - 1, numMatches), 3, batchSize)
+  samples = _appendDistinct(rng, samples, numMatches)
+  samples[growing, 3] = poolSize[growing] - 1
+  return samples
+
+# Triangle areas of every 3-point subset of (B, 4, 2) samples
+def _minTriangleArea(samplePoints):
+  areas = []
+  for a, b, c in ((0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)):
+    ab = samplePoints[:, b] - samplePoints[:, a]
+    ac = samplePoints[:, c] - samplePoints[:, a]
+    areas.append(np.abs(ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]) / 2)
+  return np.min(areas, axis=0)
+
+# Repeated indices or near-collinear points in either image
+def _isDegenerateSample(sampleIndices, samplePoints1, samplePoints2):
+  sortedIdx = np.sort(sampleIndices, axis=1)
+  repeated = (sortedIdx[:, 1:] == sortedIdx[:, :-1]).any(axis=1)
+  collinear = (_minTriangleArea(samplePoints1) < MIN_SAMPLE_AREA) | (_minTriangleArea(samplePoints2) < MIN_SAMPLE_AREA)
+  return repeated | collinear
+
+# Squared reprojection errors of the matched points only, (B, numMatches)
+def _calcMatchErrors(homographies, matchedPoints1, matchedPoints2):
+  homogeneous = np.column_stack((matchedPoints1, np.ones(len(matchedPoints1))))
+  transformedPoints = homographies @ homogeneous.T
+  predicted = transformedPoints[:, :2] / (transformedPoints[:, 2:3] + 1e-10)
+  return np.sum((predicted - matchedPoints2.T[None]) ** 2, axis=1)
+
+# Iterations needed to draw one all-inlier sample with the given confidence
+def _requiredIters(inlierRatio, confidence):
+  if inlierRatio >= 1:
+    return 0
+  allInlierProb = inlierRatio ** 4
+  if allInlierProb <= 0:
+    return np.inf
+  return np.log(1 - confidence) / np.log(1 - allInlierProb)
+
+# Refit on the inliers and rescore until the inlier set stops growing, since early
+# termination leaves fewer hypotheses to pick the best minimal sample from
+def _refineInliers(inlierMask, homographyMatrix, matchedPoints1, matchedPoints2, inlierThresh, maxRounds=3):
+  for _ in range(maxRounds):
+    if inlierMask.sum() <= 4:
+      break
+    refit = _calcHomography(matchedPoints1[inlierMask], matchedPoints2[inlierMask])
+    refitMask = _calcMatchErrors(refit[None], matchedPoints1, matchedPoints2)[0] < inlierThresh ** 2
+    if refitMask.sum() < inlierMask.sum():
+      break
+    inlierMask, homographyMatrix = refitMask, refit
+  return inlierMask, homographyMatrix
+
+# Hypotheses are drawn and scored in batches; stops once `confidence` is reached or after `iters`.
+# PROSAC sampling assumes descriptorMatches is ordered best first, as findDescriptorMatches returns it.
+def runRANSAC(
+  descriptorMatches,
+  keypoints1,
+  keypoints2,
+  iters=2000,
+  inlierThresh=0.1,
+  *,
+  confidence=0.999,
+  sampling="uniform",
+  seed=None,
+  batchSize=DEFAULT_BATCH_SIZE,
+  returnStats=False,
+):
+  if sampling not in RANSAC_SAMPLINGS:
+    raise ValueError(f"unknown RANSAC sampling: {sampling}")
+
   # Convert to arr and validate
   descriptorMatches = _asArrayOrRaise(descriptorMatches)
-  descriptorMatches = _filterValidMatches(descriptorMatches, keypoints1, keypoints2)
-
-  bestInliers = np.array([], dtype=int)
-  bestHomographyMatrix = None
+  descriptorMatches = _asArrayOrRaise(_filterValidMatches(descriptorMatches, keypoints1, keypoints2))
 
-  for _ in range(iters):
-    sampleIndices = _sampleFourIndices(len(descriptorMatches))
+  rng = np.random.default_rng(seed)
+  numMatches = len(descriptorMatches)
+  matchedPoints1 = keypoints1[descriptorMatches[:, 0], :2].astype(np.float64)
+  matchedPoints2 = keypoints2[descriptorMatches[:, 1], :2].astype(np.float64)
+  poolBudget = _prosacSchedule(numMatches, iters) if sampling == "prosac" else None
 
-    curHomographyMatrix = _homographyFromSample(
-      descriptorMatches, keypoints1, keypoints2, sampleIndices
-    )
-    transformedPoints = _projectPoints(curHomographyMatrix, keypoints1)
-    errors = _calcMatchErrors(transformedPoints, descriptorMatches, keypoints2)
-    inliers = _filterInlierMatches(descriptorMatches, errors, inlierThresh)
+  bestInlierMask = np.zeros(numMatches, dtype=bool)
+  bestHomographyMatrix = None
+  itersUsed, numDegenerate = 0, 0
+  requiredIters = np.inf
+
+  while itersUsed < min(iters, requiredIters):
+    curBatch = int(min(batchSize, iters - itersUsed))
+    if sampling == "prosac":
+      sampleIndices = _sampleProsac(rng, poolBudget, numMatches, itersUsed, curBatch)
+    else:
+      sampleIndices = _sampleUniform(rng, numMatches, curBatch)
+    itersUsed += curBatch
+
+    samplePoints1, samplePoints2 = matchedPoints1[sampleIndices], matchedPoints2[sampleIndices]
+    degenerate = _isDegenerateSample(sampleIndices, samplePoints1, samplePoints2)
+    numDegenerate += int(degenerate.sum())
+    if degenerate.all():
+      continue
+
+    homographies, valid = _calcHomographiesBatch(samplePoints1[~degenerate], samplePoints2[~degenerate])
+    homographies = homographies[valid]
+    if len(homographies) == 0:
+      continue
+
+    inlierMasks = _calcMatchErrors(homographies, matchedPoints1, matchedPoints2) < inlierThresh ** 2
+    inlierCounts = inlierMasks.sum(axis=1)
+    best = int(np.argmax(inlierCounts))
 
     # If more inliers save cur H
-    if len(inliers) > len(bestInliers):
-      bestInliers = inliers
-      bestHomographyMatrix = curHomographyMatrix
-
-  bestHomographyMatrix = _refitIfNeeded(bestInliers, keypoints1, keypoints2, bestHomographyMatrix)
-  return bestHomographyMatrix
+    if inlierCounts[best] > bestInlierMask.sum():
+      bestInlierMask = inlierMasks[best]
+      bestHomographyMatrix = homographies[best]
+      requiredIters = _requiredIters(bestInlierMask.sum() / numMatches, confidence)
+
+  if bestHomographyMatrix is not None:
+    bestInlierMask, bestHomographyMatrix = _refineInliers(
+      bestInlierMask, bestHomographyMatrix, matchedPoints1, matchedPoints2, inlierThresh
+    )
+  bestInliers = descriptorMatches[bestInlierMask]
+  if not returnStats:
+    return bestHomographyMatrix
+  stats = {
+    "iterations": itersUsed,
+    "inliers": int(len(bestInliers)),
+    "matches": numMatches,
+    "degenerateSamples": numDegenerate,
+  }
+  return bestHomographyMatrix, stats
@@ -1,21 +1,114 @@
 import numpy as np
 
-def _calcSquaredDistance(queryDescriptors, candidateDescriptors):
-  assert queryDescriptors.shape[1] == candidateDescriptors.shape[1], "Descriptor dimensions must match"
-  queryDescriptors = np.expand_dims(queryDescriptors, axis=0)
-  candidateDescriptors = np.expand_dims(candidateDescriptors, axis=1)
-  return np.sum((queryDescriptors - candidateDescriptors) ** 2, axis=-1)
-
-# Flatten distance matrix into (i, j, squaredDist)
-def _buildPairs(distances: np.ndarray) -> list[tuple[int, int, float]]:
-  numQuery, numCandidate = distances.shape
-  return [(i, j, float(distances[i, j])) for i in range(numQuery) for j in range(numCandidate)]
-
-# Ascending order
-def _sortPairsByDist(pairs: list[tuple[int, int, float]]) -> list[tuple[int, int, float]]:
-  return sorted(pairs, key=lambda pair: pair[2])
-
-def _greedyNonconflictingSelection(sortedPairs: list[tuple[int, int, float]], maxMatches: int) -> list[tuple[int, int]]:
+DEFAULT_BLOCK_SIZE = 1024
+MATCH_METHODS = ("greedy", "ratio")
+MATCH_INDEXES = ("brute", "kdtree")
+
+def _squaredNorms(descriptors):
+  return np.einsum("ij,ij->i", descriptors, descriptors)
+
+# Quantized descriptors are matched in float32: products of uint8 vectors are integers below 2^24
+# for up to 258 dimensions, so BLAS computes them exactly. Rows are converted a block at a time.
+def asFloatDescriptors(descriptors):
+  if np.issubdtype(descriptors.dtype, np.integer):
+    return descriptors.astype(np.float32)
+  return descriptors
+
+# ||a||^2 + ||b||^2 - 2a.b for one block of rows against all cols
+def _calcSquaredDistanceBlock(rowBlock, rowNorms, colDescriptors, colNorms):
+  distances = rowBlock @ colDescriptors.T
+  distances *= -2
+  distances += rowNorms[:, None]
+  distances += colNorms[None, :]
+  return np.maximum(distances, 0, out=distances)
+
+# The expansion leaves rounding error where the direct sum of squared differences gives exactly
+# zero; flushing it keeps identical descriptors tied across rows too. Not needed for quantized
+# descriptors, whose distances are exact.
+def _flushRoundingError(dist, idx, rowNorms, colNorms, dim):
+  tolerance = rowNorms[:, None] + colNorms[idx]
+  tolerance *= dim * np.finfo(dist.dtype).eps
+  dist[dist <= tolerance] = 0
+
+# The k smallest cols of every row in ascending col order. A row whose kth distance is tied with
+# a col left out takes the lowest-indexed tied cols, so ties are broken like a stable sort.
+def _topKCols(distances, k):
+  part = np.argpartition(distances, k, axis=1)
+  idx = part[:, :k]
+  kth = np.take_along_axis(distances, idx, axis=1).max(axis=1)
+  for row in np.flatnonzero(distances[np.arange(len(distances)), part[:, k]] == kth).tolist():
+    rowDist = distances[row]
+    below = np.flatnonzero(rowDist < kth[row])
+    idx[row] = np.concatenate((below, np.flatnonzero(rowDist == kth[row])[:k - len(below)]))
+  return np.sort(idx, axis=1)
+
+# Smallest k cols of every row, computed block by block so only (blockSize x numCols) is live.
+# Equal distances are ordered by col.
+def _knnBrute(rowDescriptors, colDescriptors, k, blockSize):
+  numRows, numCols = rowDescriptors.shape[0], colDescriptors.shape[0]
+  exact = np.issubdtype(rowDescriptors.dtype, np.integer) and np.issubdtype(colDescriptors.dtype, np.integer)
+  colDescriptors = asFloatDescriptors(colDescriptors)
+  knnDist = np.empty((numRows, k), dtype=np.result_type(asFloatDescriptors(rowDescriptors[:0]), colDescriptors))
+  knnIdx = np.empty((numRows, k), dtype=np.intp)
+  colNorms = _squaredNorms(colDescriptors)
+  for start in range(0, numRows, blockSize):
+    stop = min(start + blockSize, numRows)
+    rowBlock = asFloatDescriptors(rowDescriptors[start:stop])
+    rowNorms = _squaredNorms(rowBlock)
+    distances = _calcSquaredDistanceBlock(rowBlock, rowNorms, colDescriptors, colNorms)
+    if k < numCols:
+      idx = _topKCols(distances, k)
+      dist = np.take_along_axis(distances, idx, axis=1)
+    else:
+      idx = np.broadcast_to(np.arange(numCols), distances.shape)
+      dist = distances
+    if not exact:
+      _flushRoundingError(dist, idx, rowNorms, colNorms, rowBlock.shape[1])
+    # idx is ascending, so the stable sort orders equal distances by col
+    order = np.argsort(dist, axis=1, kind="stable")
+    knnIdx[start:stop] = np.take_along_axis(idx, order, axis=1)
+    knnDist[start:stop] = np.take_along_axis(dist, order, axis=1)
+  return knnDist, knnIdx
+
+def _knnTree(rowDescriptors, colDescriptors, k):
+  from scipy.spatial import cKDTree
+  rowDescriptors, colDescriptors = asFloatDescriptors(rowDescriptors), asFloatDescriptors(colDescriptors)
+  tree = cKDTree(colDescriptors)
+  knnDist, knnIdx = tree.query(rowDescriptors, k=k)
+  knnDist = np.asarray(knnDist).reshape(len(rowDescriptors), k)
+  knnIdx = np.asarray(knnIdx).reshape(len(rowDescriptors), k)
+  return knnDist ** 2, knnIdx
+
+def _findNearestCols(rowDescriptors, colDescriptors, k, index, blockSize):
+  if index == "kdtree":
+    return _knnTree(rowDescriptors, colDescriptors, k)
+  return _knnBrute(rowDescriptors, colDescriptors, k, blockSize)
+
+# Keep nearest neighbour only where it beats the second by the Lowe ratio
+def _applyRatioTest(knnDist, knnIdx, ratioThresh):
+  rows = np.arange(knnDist.shape[0])
+  if knnDist.shape[1] < 2:
+    return rows, knnIdx[:, 0], knnDist[:, 0]
+  keep = knnDist[:, 0] < (ratioThresh ** 2) * knnDist[:, 1]
+  return rows[keep], knnIdx[keep, 0], knnDist[keep, 0]
+
+# Flatten kNN table into (i, j, squaredDist) candidates
+def _buildPairs(knnDist, knnIdx):
+  numRows, k = knnIdx.shape
+  return np.repeat(np.arange(numRows), k), knnIdx.ravel(), knnDist.ravel()
+
+# Ascending distance, ties in row-major order
+def _sortPairsByDist(rows, cols, dists):
+  order = np.lexsort((cols, rows, dists))
+  return rows[order], cols[order], dists[order]
+
+# Pairs as python tuples, converted lazily since the greedy pass usually stops early
+def _iterPairs(rows, cols, dists, chunkSize=4096):
+  for start in range(0, len(rows), chunkSize):
+    stop = start + chunkSize
+    yield from zip(rows[start:stop].tolist(), cols[start:stop].tolist(), dists[start:stop].tolist())
+
+def _greedyNonconflictingSelection(sortedPairs, maxMatches: int) -> list[tuple[int, int]]:
   usedQuery, usedCandidate = set(), set()
   matches: list[tuple[int, int]] = []
   for i, j, _ in sortedPairs:
@@ -27,8 +120,37 @@ def _greedyNonconflictingSelection(sortedPairs: list[tuple[int, int, float]], ma
       usedCandidate.add(j)
   return matches
 
-def findDescriptorMatches(descriptorsSet1, descriptorsSet2, numMatchesToFind):
-  distances = _calcSquaredDistance(descriptorsSet1, descriptorsSet2)
-  pairs = _buildPairs(distances)
-  sortedPairs = _sortPairsByDist(pairs)
-  return _greedyNonconflictingSelection(sortedPairs, numMatchesToFind)
+# Returns (i, j) pairs with i indexing descriptorsSet2 and j indexing descriptorsSet1, best first.
+# "greedy" is the global one-to-one selection; a pair it picks is always within its row's
+# numMatchesToFind nearest cols, so only that many candidates per row are kept.
+# "ratio" keeps nearest neighbours passing the Lowe ratio test before the one-to-one pass.
+def findDescriptorMatches(
+  descriptorsSet1,
+  descriptorsSet2,
+  numMatchesToFind,
+  *,
+  method="greedy",
+  ratioThresh=0.8,
+  index="brute",
+  blockSize=DEFAULT_BLOCK_SIZE,
+):
+  if method not in MATCH_METHODS:
+    raise ValueError(f"unknown match method: {method}")
+  if index not in MATCH_INDEXES:
+    raise ValueError(f"unknown match index: {index}")
+  assert descriptorsSet1.shape[1] == descriptorsSet2.shape[1], "Descriptor dimensions must match"
+
+  numCols = descriptorsSet1.shape[0]
+  if numMatchesToFind <= 0 or numCols == 0 or descriptorsSet2.shape[0] == 0:
+    return []
+
+  k = min(numMatchesToFind if method == "greedy" else 2, numCols)
+  knnDist, knnIdx = _findNearestCols(descriptorsSet2, descriptorsSet1, k, index, blockSize)
+
+  if method == "ratio":
+    rows, cols, dists = _applyRatioTest(knnDist, knnIdx, ratioThresh)
+  else:
+    rows, cols, dists = _buildPairs(knnDist, knnIdx)
+
+  rows, cols, dists = _sortPairsByDist(rows, cols, dists)
+  return _greedyNonconflictingSelection(_iterPairs(rows, cols, dists), numMatchesToFind)
@@ -0,0 +1,225 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from .features import FeatureContext, harrisFindCorners, findSift, precisionDtype, quantizeDescriptors
+from .matching import findDescriptorMatches
+from .geometry import runRANSAC
+from .blending import DEFAULT_MAX_CANVAS_PIXELS, stitchAndBlendImagesMulti
+from .pipeline import KEYPOINT_RADIUS, downscale, featureKeys, layoutFrames
+from .stagecache import arrayKey, stageKey
+from .profiling import Profile
+
+# Keypoints (N, 2) as (x, y) and their descriptors for one grayscale image
+def extractFeatures(
+  imgGray, sigma=2.0, harrisThreshold=3000.0, harrisWindowRadius=3, siftEnlarge=1.5, maxCorners=None,
+  cornerSelection="strongest", featurePrecision="float64",
+):
+  context = FeatureContext(imgGray, dtype=precisionDtype(featurePrecision))
+  _, cornerRows, cornerCols = harrisFindCorners(
+    context, sigma, harrisThreshold, harrisWindowRadius, maxCorners=maxCorners, selection=cornerSelection
+  )
+  keypointsXYR = np.column_stack((cornerCols, cornerRows, np.full(len(cornerRows), KEYPOINT_RADIUS)))
+  descriptors = findSift(context, keypointsXYR, enlargeFactor=siftEnlarge)
+  if featurePrecision == "uint8":
+    descriptors = quantizeDescriptors(descriptors)
+  return np.column_stack((cornerCols, cornerRows)), descriptors
+
+def _extractFeaturesArgs(args):
+  return extractFeatures(*args)
+
+def _extractAll(imagesGray, featureParams, workers):
+  jobs = [(imgGray,) + featureParams for imgGray in imagesGray]
+  if workers <= 1 or len(jobs) <= 1:
+    return [_extractFeaturesArgs(job) for job in jobs]
+  with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+    return list(pool.map(_extractFeaturesArgs, jobs))
+
+# Features from a FeatureStore where present, extracting and storing only the missing ones. Keys are
+# stitchImages' SIFT stage keys, so pair and multi-image stitching share entries.
+def _extractWithStore(originalsBgr, imagesGray, featureParams, maxSize, workers, featureStore):
+  sigma, harrisThreshold, harrisWindowRadius, siftEnlarge, maxCorners, cornerSelection, featurePrecision = featureParams
+  keys = [
+    featureKeys(
+      stageKey("prep", [arrayKey(imgBgr)], (maxSize,)), sigma, harrisThreshold, harrisWindowRadius, maxCorners,
+      cornerSelection, siftEnlarge, featurePrecision,
+    )[2]
+    for imgBgr in originalsBgr
+  ]
+  stored = [featureStore.get(key) for key in keys]
+  missing = [i for i, entry in enumerate(stored) if entry is None]
+  extracted = _extractAll([imagesGray[i] for i in missing], featureParams, workers)
+  for i, (keypoints, descriptors) in zip(missing, extracted):
+    stored[i] = (descriptors, keypoints)
+    featureStore.put(keys[i], stored[i])
+  return [(keypoints, descriptors) for descriptors, keypoints in stored], len(keys) - len(missing)
+
+# Mean SIFT descriptor per image, centered across the set so cosine similarity is informative.
+# Unlike a thumbnail it does not depend on where in the frame the shared content sits.
+def _globalDescriptors(features):
+  globalDescriptors = np.stack([descriptors.mean(axis=0) for _, descriptors in features])
+  globalDescriptors -= globalDescriptors.mean(axis=0)
+  norms = np.linalg.norm(globalDescriptors, axis=1, keepdims=True)
+  return np.divide(globalDescriptors, norms, out=np.zeros_like(globalDescriptors), where=norms > 0)
+
+# Adjacent frames within pairWindow, plus each frame's most similar frames by global descriptor
+def _candidatePairs(features, pairWindow, prefilterNeighbors):
+  numImages = len(features)
+  pairs = {(i, j) for i in range(numImages) for j in range(i + 1, min(i + 1 + pairWindow, numImages))}
+  if prefilterNeighbors > 0 and numImages > 2:
+    globalDescriptors = _globalDescriptors(features)
+    similarity = globalDescriptors @ globalDescriptors.T
+    np.fill_diagonal(similarity, -np.inf)
+    for i in range(numImages):
+      for j in np.argsort(-similarity[i])[:prefilterNeighbors]:
+        pairs.add((min(i, int(j)), max(i, int(j))))
+  return sorted(pairs)
+
+# Homography mapping image i into image j, with its inlier count, or None if the pair does not register
+def _matchPair(features, i, j, matchParams, ransacParams, minInliers):
+  (keypointsI, descriptorsI), (keypointsJ, descriptorsJ) = features[i], features[j]
+  maxMatches = matchParams["maxDescriptorMatches"]
+  if maxMatches is None:
+    maxMatches = min(100, len(keypointsI), len(keypointsJ))
+  matches = findDescriptorMatches(
+    descriptorsJ, descriptorsI, maxMatches,
+    method=matchParams["method"], ratioThresh=matchParams["ratioThresh"], index=matchParams["index"],
+  )
+  if len(matches) < 4:
+    return None
+  homography, ransacStats = runRANSAC(matches, keypointsI, keypointsJ, returnStats=True, **ransacParams)
+  if homography is None or ransacStats["inliers"] < minInliers:
+    return None
+  return homography, ransacStats["inliers"]
+
+# Maximum spanning tree over inlier counts, rooted at its center so chains to the reference stay short
+def _buildTree(numImages, edges):
+  from scipy.sparse import csr_matrix
+  from scipy.sparse.csgraph import connected_components, minimum_spanning_tree, shortest_path
+  rows, cols, costs = [], [], []
+  for (i, j), (_, inliers) in edges.items():
+    rows.append(i)
+    cols.append(j)
+    costs.append(1.0 / inliers)
+  graph = csr_matrix((costs, (rows, cols)), shape=(numImages, numImages))
+  tree = minimum_spanning_tree(graph)
+
+  _, labels = connected_components(tree, directed=False)
+  component = np.flatnonzero(labels == np.bincount(labels).argmax())
+  hops = shortest_path(tree, directed=False, unweighted=True, indices=component)[:, component]
+  reference = int(component[np.argmin(hops.max(axis=1))])
+  return tree, reference, component
+
+# Chain pairwise homographies along the tree into image -> reference transforms
+def _chainHomographies(tree, reference, edges):
+  from scipy.sparse.csgraph import breadth_first_order
+  order, predecessors = breadth_first_order(tree, reference, directed=False, return_predecessors=True)
+  toReference = {reference: np.eye(3)}
+  for node in order[1:]:
+    parent = int(predecessors[node])
+    if (node, parent) in edges:
+      nodeToParent = edges[(node, parent)][0]
+    else:
+      nodeToParent = np.linalg.inv(edges[(parent, node)][0])
+    chained = toReference[parent] @ nodeToParent
+    toReference[int(node)] = chained / chained[2, 2]
+  return toReference
+
+def stitchImagesMulti(
+  imagesBgr,
+  *,
+  sigma: float = 2.0,
+  harrisThreshold: float = 3000.0,
+  harrisWindowRadius: int = 3,
+  maxCorners=None,
+  cornerSelection: str = "strongest",
+  siftEnlarge: float = 1.5,
+  featurePrecision: str = "float64",
+  maxSize: int = 1600,
+  maxDescriptorMatches=None,
+  matchMethod: str = "greedy",
+  matchRatio: float = 0.8,
+  matchIndex: str = "brute",
+  ransacIters=1000,
+  ransacThreshold=1.0,
+  ransacConfidence: float = 0.999,
+  ransacSampling: str = "uniform",
+  ransacSeed=None,
+  pairWindow: int = 1,
+  prefilterNeighbors: int = 2,
+  minInliers: int = 12,
+  workers=None,
+  maxCanvasPixels=DEFAULT_MAX_CANVAS_PIXELS,
+  blendMode: str = "feather",
+  blend: bool = True,
+  featureStore=None,
+  profile=None,
+  stats=None,
+):
+  # Frames that do not connect to the largest registered group are left out and listed in stats.
+  # With blend=False None is returned and stats["layout"] describes the canvas of the stitched frames.
+  # A FeatureStore supplies features of images seen before and keeps those extracted now.
+  if len(imagesBgr) < 2:
+    raise ValueError("Need at least two images.")
+  if profile is None:
+    profile = Profile()
+  originalsBgr = imagesBgr
+  with profile.span("prep"):
+    imagesBgr = [downscale(img, maxSize)[0] for img in imagesBgr]
+    imagesGray = [cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for img in imagesBgr]
+
+  if workers is None:
+    workers = os.cpu_count() or 1
+  with profile.span("features"):
+    featureParams = (sigma, harrisThreshold, harrisWindowRadius, siftEnlarge, maxCorners, cornerSelection, featurePrecision)
+    if featureStore is None:
+      features = _extractAll(imagesGray, featureParams, workers)
+    else:
+      features, numStored = _extractWithStore(originalsBgr, imagesGray, featureParams, maxSize, workers, featureStore)
+      profile.count("storedFeatures", numStored)
+
+  matchParams = dict(maxDescriptorMatches=maxDescriptorMatches, method=matchMethod, ratioThresh=matchRatio, index=matchIndex)
+  ransacParams = dict(
+    iters=ransacIters, inlierThresh=ransacThreshold, confidence=ransacConfidence, sampling=ransacSampling, seed=ransacSeed,
+  )
+  with profile.span("register"):
+    pairs = _candidatePairs(features, pairWindow, prefilterNeighbors)
+    edges = {}
+    for i, j in pairs:
+      registered = _matchPair(features, i, j, matchParams, ransacParams, minInliers)
+      if registered is not None:
+        edges[(i, j)] = registered
+  profile.count("corners", [len(keypoints) for keypoints, _ in features])
+  profile.count("registeredPairs", len(edges))
+  if not edges:
+    raise ValueError("No image pair could be registered.")
+
+  tree, reference, component = _buildTree(len(imagesBgr), edges)
+  toReference = _chainHomographies(tree, reference, edges)
+  frames = [int(i) for i in component]
+
+  if stats is not None:
+    stats["candidatePairs"] = len(pairs)
+    stats["registeredPairs"] = len(edges)
+    stats["referenceFrame"] = reference
+    stats["stitchedFrames"] = frames
+    stats["droppedFrames"] = [i for i in range(len(imagesBgr)) if i not in toReference]
+
+  profile.count("frames", len(frames))
+  if not blend:
+    with profile.span("layout"):
+      layout = layoutFrames(
+        [originalsBgr[i] for i in frames], [imagesBgr[i] for i in frames], [toReference[i] for i in frames], maxCanvasPixels
+      )
+    profile.count("canvasPixels", layout["width"] * layout["height"])
+    if stats is not None:
+      stats["layout"] = layout
+    return None
+
+  with profile.span("blend"):
+    imagesRgb = [cv2.cvtColor(imagesBgr[i], cv2.COLOR_BGR2RGB) for i in frames]
+    panoramaRgb = stitchAndBlendImagesMulti(
+      imagesRgb, [toReference[i] for i in frames], maxCanvasPixels=maxCanvasPixels, blendMode=blendMode
+    )
+  profile.count("canvasPixels", panoramaRgb.shape[0] * panoramaRgb.shape[1])
+  return cv2.cvtColor(panoramaRgb, cv2.COLOR_RGB2BGR)
@@ -1,11 +1,17 @@
 import numpy as np
 import cv2
-from .features import harrisFindCorners, findSift
+from .features import FeatureContext, harrisCornersFromResponse, harrisFindCorners, findSift, precisionDtype, quantizeDescriptors
 from .matching import findDescriptorMatches
 from .geometry import runRANSAC
-from .blending import stitchAndBlendImagesRgb
+from .blending import DEFAULT_MAX_CANVAS_PIXELS, canvasLayout, stitchAndBlendImagesRgb
+from .pyramid import rescaleHomography, scaleMatrix, refineHomographyPyramid
+from .stagecache import arrayKey, stageKey
+from .profiling import Profile
 
-def _downscale(img, maxSize):
+# SIFT radius given to every Harris corner, scaled by siftEnlarge
+KEYPOINT_RADIUS = 8
+
+def downscale(img, maxSize):
   # Resize so longer size <= maxSize
   imgHeight, imgWidth = img.shape[:2]
   if max(imgHeight, imgWidth) <= maxSize:
@@ -13,57 +19,106 @@ def _downscale(img, maxSize):
   scaleFactor = maxSize / float(max(imgHeight, imgWidth))
   return cv2.resize(img, None, fx=scaleFactor, fy=scaleFactor, interpolation=cv2.INTER_AREA), scaleFactor
 
-def _prepImages(img1Bgr, img2Bgr, maxSize,):
-  # Convert both to RGB and make grayscale copies
-  img1Bgr, _ = _downscale(img1Bgr, maxSize)
-  img2Bgr, _ = _downscale(img2Bgr, maxSize)
-
-  img1Gray = cv2.cvtColor(img1Bgr, cv2.COLOR_BGR2GRAY)
-  img2Gray = cv2.cvtColor(img2Bgr, cv2.COLOR_BGR2GRAY)
-  img1Rgb = cv2.cvtColor(img1Bgr, cv2.COLOR_BGR2RGB)
-  img2Rgb = cv2.cvtColor(img2Bgr, cv2.COLOR_BGR2RGB)
-
-  return img1Rgb, img2Rgb, img1Gray, img2Gray
+def _prepImage(imgBgr, maxSize):
+  # RGB copy for blending and grayscale copy for features
+  imgBgr, _ = downscale(imgBgr, maxSize)
+  return cv2.cvtColor(imgBgr, cv2.COLOR_BGR2RGB), cv2.cvtColor(imgBgr, cv2.COLOR_BGR2GRAY)
 
-def _findHarrisCorners(img1Gray, img2Gray, sigma, harrisThresh, windowRadius):
-  _, cornerRows1, cornerCols1 = harrisFindCorners(img1Gray, sigma, harrisThresh, windowRadius)
-  _, cornerRows2, cornerCols2 = harrisFindCorners(img2Gray, sigma, harrisThresh, windowRadius)
+def _siftAtCorners(context, cornerRows, cornerCols, siftEnlarge, precision="float64"):
+  keypointsXYR = np.column_stack((cornerCols, cornerRows, np.full(len(cornerRows), KEYPOINT_RADIUS)))
+  siftDescriptors = findSift(context, keypointsXYR, enlargeFactor=siftEnlarge)
+  if precision == "uint8":
+    siftDescriptors = quantizeDescriptors(siftDescriptors)
+  return siftDescriptors, np.column_stack((cornerCols, cornerRows))
 
-  if len(cornerRows1) < 4 or len(cornerRows2) < 4:
-    raise ValueError("Not enough Harris corners detected.")
-  return cornerRows1, cornerCols1, cornerRows2, cornerCols2
+def _matchDescriptors(siftDescriptors1, siftDescriptors2, maxDescriptorMatches, method, ratioThresh, index):
+  if maxDescriptorMatches is None:
+    maxDescriptorMatches = min(100, len(siftDescriptors1), len(siftDescriptors2))
+  return findDescriptorMatches(
+    siftDescriptors2, siftDescriptors1, maxDescriptorMatches,
+    method=method, ratioThresh=ratioThresh, index=index,
+  )
 
-def _siftAtCorners(img1Gray, img2Gray, cornerRows1, cornerCols1, cornerRows2, cornerCols2, siftEnlarge):
-  keypointRadii1 = np.full(len(cornerRows1), 8)
-  keypointRadii2 = np.full(len(cornerRows2), 8)
+def _findHomography(descriptorMatches, keypoints1, keypoints2, iters, thresh, confidence, sampling, seed):
+  homographyMatrix, ransacStats = runRANSAC(
+    descriptorMatches, keypoints1, keypoints2, iters, thresh,
+    confidence=confidence, sampling=sampling, seed=seed, returnStats=True,
+  )
+  if homographyMatrix is None:
+    raise ValueError("Homography estimation failed.")
+  return homographyMatrix, ransacStats
 
-  keypoints1XYR = np.column_stack((cornerCols1, cornerRows1, keypointRadii1))
-  keypoints2XYR = np.column_stack((cornerCols2, cornerRows2, keypointRadii2))
+# Coarse-level homography lifted to the original images' resolution
+def _refineAtFullResolution(img1Bgr, img2Bgr, img1Gray, img2Gray, homographyMatrix, keypoints1XY, ransacThreshold, seed):
+  fullGray1 = cv2.cvtColor(img1Bgr, cv2.COLOR_BGR2GRAY)
+  fullGray2 = cv2.cvtColor(img2Bgr, cv2.COLOR_BGR2GRAY)
+  scale1 = img1Gray.shape[1] / fullGray1.shape[1]
+  scale2 = img2Gray.shape[1] / fullGray2.shape[1]
+  pyramidStats = {}
+  homographyMatrix = refineHomographyPyramid(
+    fullGray1, fullGray2, homographyMatrix, keypoints1XY, scale1, scale2,
+    ransacThreshold=ransacThreshold, seed=seed, stats=pyramidStats,
+  )
+  return homographyMatrix, pyramidStats
 
-  siftDescriptors1 = findSift(img1Gray, keypoints1XYR, enlargeFactor=siftEnlarge)
-  siftDescriptors2 = findSift(img2Gray, keypoints2XYR, enlargeFactor=siftEnlarge)
+def _blendWarpedImages(img2Rgb, img1Rgb, homographyMatrix, maxCanvasPixels, compositor, blendMode):
+  blendedImageRgb = stitchAndBlendImagesRgb(
+    img2Rgb, img1Rgb, homographyMatrix, maxCanvasPixels=maxCanvasPixels, compositor=compositor, blendMode=blendMode
+  )
+  outputImageBgr = cv2.cvtColor(blendedImageRgb, cv2.COLOR_RGB2BGR)
+  return outputImageBgr
 
-  keypoints1XY = np.column_stack((cornerCols1, cornerRows1))
-  keypoints2XY = np.column_stack((cornerCols2, cornerRows2))
+# Canvas the blend would fill, with each frame's transform from its original (not downscaled) pixels
+# onto it. This is what a client needs to warp and composite the frames itself.
+def layoutFrames(originalsBgr, workingImgs, canvasHomographies, maxCanvasPixels):
+  transforms, height, width = canvasLayout(workingImgs, canvasHomographies, maxCanvasPixels)
+  fromOriginal = []
+  for original, working, transform in zip(originalsBgr, workingImgs, transforms):
+    transform = transform @ scaleMatrix(working.shape[1] / original.shape[1])
+    fromOriginal.append((transform / transform[2, 2]).tolist())
+  return {"width": int(width), "height": int(height), "transforms": fromOriginal}
 
-  return siftDescriptors1, siftDescriptors2, keypoints1XY, keypoints2XY
+# Stage keys of the Harris response, corners and SIFT features of the image with this prep key.
+# The SIFT key covers the pixels and every feature parameter, so it also keys the FeatureStore.
+def featureKeys(prepKey, sigma, harrisThreshold, harrisWindowRadius, maxCorners, cornerSelection, siftEnlarge, featurePrecision):
+  harrisKey = stageKey("harris", [prepKey], (sigma, featurePrecision))
+  cornersKey = stageKey("corners", [harrisKey], (harrisThreshold, harrisWindowRadius, maxCorners, cornerSelection))
+  siftKey = stageKey("sift", [prepKey, cornersKey], (siftEnlarge, featurePrecision))
+  return harrisKey, cornersKey, siftKey
 
-def _matchDescriptors(siftDescriptors1, siftDescriptors2, cornerRows1, cornerRows2, maxDescriptorMatches):
-  if maxDescriptorMatches is None:
-    maxDescriptorMatches = min(100, len(cornerRows1), len(cornerRows2))
-  matches = findDescriptorMatches(siftDescriptors2, siftDescriptors1, maxDescriptorMatches)
-  return matches
+# Runs pipeline stages through an optional StageCache, recording a profile span for each. A stage's key
+# covers the keys of the outputs it consumes and the parameters it reads, so a parameter change only
+# misses the stages downstream of it.
+class _StageRunner:
+  def __init__(self, cache, profile):
+    self.cache = cache
+    self.profile = profile
+    self.hits = []
 
-def _findHomography(descriptorMatches, keypoints1, keypoints2, iters, thresh):
-  homographyMatrix = runRANSAC(descriptorMatches, keypoints1, keypoints2, iters, thresh)
-  if homographyMatrix is None:
-    raise ValueError("Homography estimation failed.")
-  return homographyMatrix
+  # A computed output is also saved to store (a FeatureStore) when one is given
+  def run(self, name, parentKeys, params, compute, store=None):
+    key = stageKey(name, parentKeys, params)
+    value = self.lookup(name, key)
+    if value is not None:
+      return key, value
+    with self.profile.span(name):
+      value = compute()
+    if self.cache is not None:
+      self.cache.put(key, value)
+    if store is not None:
+      store.put(key, value)
+    return key, value
 
-def _blendWarpedImages(img2Rgb, img1Rgb, homographyMatrix):
-  blendedImageRgb = stitchAndBlendImagesRgb(img2Rgb, img1Rgb, homographyMatrix)
-  outputImageBgr = cv2.cvtColor(blendedImageRgb, cv2.COLOR_RGB2BGR)
-  return outputImageBgr
+  # Output already available for a stage key, from the StageCache or else from store, without
+  # computing it; None when neither has it
+  def lookup(self, name, key, store=None):
+    value = self.cache.get(key) if self.cache is not None else None
+    if value is None and store is not None:
+      value = store.get(key)
+    if value is not None:
+      self.hits.append(name)
+      self.profile.hit(name)
+    return value
 
 def stitchImages(
   img1Bgr,
@@ -72,19 +127,136 @@ def stitchImages(
   sigma: float = 2.0,
   harrisThreshold: float = 3000.0,
   harrisWindowRadius: int = 3,
+  maxCorners=None,
+  cornerSelection: str = "strongest",
   siftEnlarge: float = 1.5,
+  featurePrecision: str = "float64",
   maxSize: int = 1600,
   maxDescriptorMatches=None,
+  matchMethod: str = "greedy",
+  matchRatio: float = 0.8,
+  matchIndex: str = "brute",
   ransacIters=1000,
   ransacThreshold=1.0,
+  ransacConfidence: float = 0.999,
+  ransacSampling: str = "uniform",
+  ransacSeed=None,
+  maxCanvasPixels=DEFAULT_MAX_CANVAS_PIXELS,
+  compositor: str = "auto",
+  blendMode: str = "feather",
+  pyramid: bool = False,
+  blend: bool = True,
+  cache=None,
+  featureStore=None,
+  profile=None,
+  stats=None,
 ):
-  img1Rgb, img2Rgb, img1Gray, img2Gray = _prepImages(img1Bgr, img2Bgr, maxSize)
-  cornerRows1, cornerCols1, cornerRows2, cornerCols2 = _findHarrisCorners(
-    img1Gray, img2Gray, sigma, harrisThreshold, harrisWindowRadius
+  # Pass a dict as stats to receive RANSAC iteration and inlier counts, the final homography and
+  # the names of stages served from cache.
+  # With pyramid=True features are still found at maxSize, but the homography is refined
+  # level by level up to the original resolution and the panorama is blended at full size.
+  # With blend=False nothing is composited: None is returned and stats["layout"] describes the canvas
+  # (see layoutFrames, frames in input order) plus the homography between the original images.
+  # blendMode is "feather" or "multiband" (seam cut plus pyramid blending, see blending.BLEND_MODES).
+  # With a StageCache, outputs of stages whose inputs and parameters are unchanged are reused:
+  # decode/downscale -> Harris response -> NMS/threshold -> SIFT -> matching -> RANSAC -> blend.
+  # That includes RANSAC without a seed, and the returned image, which must not be modified.
+  # With a FeatureStore, each image's features persist across calls and processes, keyed by its
+  # pixels and the feature parameters; a stored image skips the Harris, corner and SIFT stages.
+  # A Profile receives a span per stage and counters for corners, matches, inliers, RANSAC
+  # iterations and canvas size.
+  if profile is None:
+    profile = Profile()
+  runner = _StageRunner(cache, profile)
+  imgsBgr = (img1Bgr, img2Bgr)
+  # Derivatives are computed once per image and call, shared by the Harris and SIFT stages that miss.
+  # featurePrecision sets their dtype and the descriptors' (see FEATURE_PRECISIONS).
+  featureDtype = precisionDtype(featurePrecision)
+  contexts = {}
+  def contextFor(i, imgGray):
+    if i not in contexts:
+      contexts[i] = FeatureContext(imgGray, dtype=featureDtype)
+    return contexts[i]
+
+  prepKeys, prepped, siftKeys, features = [], [], [], []
+  for i, imgBgr in enumerate(imgsBgr):
+    prepKey, (imgRgb, imgGray) = runner.run("prep", [arrayKey(imgBgr)], (maxSize,), lambda: _prepImage(imgBgr, maxSize))
+    harrisKey, cornersKey, siftKey = featureKeys(
+      prepKey, sigma, harrisThreshold, harrisWindowRadius, maxCorners, cornerSelection, siftEnlarge, featurePrecision
+    )
+    siftOutput = runner.lookup("sift", siftKey, featureStore)
+    if siftOutput is None:
+      _, response = runner.run(
+        "harris", [prepKey], (sigma, featurePrecision), lambda: harrisFindCorners(contextFor(i, imgGray), sigma)
+      )
+      _, (cornerRows, cornerCols) = runner.run(
+        "corners", [harrisKey], (harrisThreshold, harrisWindowRadius, maxCorners, cornerSelection),
+        lambda: harrisCornersFromResponse(response, harrisThreshold, harrisWindowRadius, maxCorners, cornerSelection)[1:],
+      )
+      if len(cornerRows) < 4:
+        raise ValueError("Not enough Harris corners detected.")
+      _, siftOutput = runner.run(
+        "sift", [prepKey, cornersKey], (siftEnlarge, featurePrecision),
+        lambda: _siftAtCorners(contextFor(i, imgGray), cornerRows, cornerCols, siftEnlarge, featurePrecision),
+        featureStore,
+      )
+    elif len(siftOutput[1]) < 4:
+      # Stored by stitchImagesMulti, which keeps images with few corners
+      raise ValueError("Not enough Harris corners detected.")
+    prepKeys.append(prepKey)
+    prepped.append((imgRgb, imgGray))
+    siftKeys.append(siftKey)
+    features.append(siftOutput)
+  (sift1, keypoints1XY), (sift2, keypoints2XY) = features
+  (img1Rgb, img1Gray), (img2Rgb, img2Gray) = prepped
+
+  matchKey, descriptorMatches = runner.run(
+    "match", siftKeys, (maxDescriptorMatches, matchMethod, matchRatio, matchIndex),
+    lambda: _matchDescriptors(sift1, sift2, maxDescriptorMatches, matchMethod, matchRatio, matchIndex),
   )
-  sift1, sift2, keypoints1XY, keypoints2XY = _siftAtCorners(
-    img1Gray, img2Gray, cornerRows1, cornerCols1, cornerRows2, cornerCols2, siftEnlarge
+  homographyKey, (homographyMatrix, ransacStats) = runner.run(
+    "ransac", [matchKey] + siftKeys, (ransacIters, ransacThreshold, ransacConfidence, ransacSampling, ransacSeed),
+    lambda: _findHomography(
+      descriptorMatches, keypoints1XY, keypoints2XY, ransacIters, ransacThreshold,
+      ransacConfidence, ransacSampling, ransacSeed,
+    ),
   )
-  descriptorMatches = _matchDescriptors(sift1, sift2, cornerRows1, cornerRows2, maxDescriptorMatches)
-  homographyMatrix = _findHomography(descriptorMatches, keypoints1XY, keypoints2XY, ransacIters, ransacThreshold)
-  return _blendWarpedImages(img2Rgb, img1Rgb, homographyMatrix)
+  pyramidStats = None
+  if pyramid:
+    homographyKey, (homographyMatrix, pyramidStats) = runner.run(
+      "pyramid", [homographyKey] + prepKeys, (ransacThreshold, ransacSeed),
+      lambda: _refineAtFullResolution(
+        img1Bgr, img2Bgr, img1Gray, img2Gray, homographyMatrix, keypoints1XY, ransacThreshold, ransacSeed
+      ),
+    )
+    img1Rgb = cv2.cvtColor(img1Bgr, cv2.COLOR_BGR2RGB)
+    img2Rgb = cv2.cvtColor(img2Bgr, cv2.COLOR_BGR2RGB)
+  layout, outputImageBgr = None, None
+  if blend:
+    _, outputImageBgr = runner.run(
+      "blend", [homographyKey] + prepKeys, (pyramid, maxCanvasPixels, compositor, blendMode),
+      lambda: _blendWarpedImages(img2Rgb, img1Rgb, homographyMatrix, maxCanvasPixels, compositor, blendMode),
+    )
+    canvasPixels = outputImageBgr.shape[0] * outputImageBgr.shape[1]
+  else:
+    with profile.span("layout"):
+      layout = layoutFrames(imgsBgr, (img1Rgb, img2Rgb), (homographyMatrix, np.eye(3)), maxCanvasPixels)
+      scale1, scale2 = img1Rgb.shape[1] / img1Bgr.shape[1], img2Rgb.shape[1] / img2Bgr.shape[1]
+      layout["homography"] = rescaleHomography(homographyMatrix, 1 / scale1, 1 / scale2).tolist()
+    canvasPixels = layout["width"] * layout["height"]
+
+  profile.count("corners", [len(keypoints1XY), len(keypoints2XY)])
+  profile.count("matches", len(descriptorMatches))
+  profile.count("inliers", ransacStats["inliers"])
+  profile.count("ransacIterations", ransacStats["iterations"])
+  profile.count("canvasPixels", canvasPixels)
+  if stats is not None:
+    if layout is not None:
+      stats["layout"] = layout
+    stats["ransacIterations"] = ransacStats["iterations"]
+    stats["ransacInliers"] = ransacStats["inliers"]
+    if pyramidStats is not None:
+      stats.update(pyramidStats)
+    stats["homography"] = homographyMatrix
+    stats["cachedStages"] = runner.hits
+  return outputImageBgr
@@ -0,0 +1,36 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Per-request spans (stage, seconds, cached, and peak traced bytes when tracemalloc is running)
+# plus named counters. Spans must not nest: each one resets the tracemalloc peak.
+class Profile:
+  def __init__(self, traceMemory=False):
+    self.traceMemory = traceMemory
+    self.spans = []
+    self.counters = {}
+
+  @contextmanager
+  def span(self, stage):
+    tracing = self.traceMemory and tracemalloc.is_tracing()
+    if tracing:
+      tracemalloc.reset_peak()
+      baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      record = {"stage": stage, "seconds": time.perf_counter() - start, "cached": False}
+      if tracing:
+        record["peakBytes"] = tracemalloc.get_traced_memory()[1] - baseline
+      self.spans.append(record)
+
+  # A stage whose output came from the stage cache
+  def hit(self, stage):
+    self.spans.append({"stage": stage, "seconds": 0.0, "cached": True})
+
+  def count(self, name, value):
+    self.counters[name] = value
+
+  def asDict(self):
+    return {"spans": self.spans, "counters": self.counters}
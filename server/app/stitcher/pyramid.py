@@ -0,0 +1,152 @@
+import numpy as np
+import cv2
+from .geometry import runRANSAC
+
+# Guided matching: a template around each image1 point is searched for in image2 (warped into
+# image1's frame by the current homography) within PYRAMID_SEARCH_RADIUS pixels of the prediction
+PYRAMID_PATCH_RADIUS = 7
+PYRAMID_SEARCH_RADIUS = 4
+PYRAMID_MIN_SCORE = 0.8
+PYRAMID_MAX_POINTS = 500
+# Templates flatter than this (gray-level std) give meaningless correlation peaks
+PYRAMID_MIN_TEXTURE = 2.0
+PYRAMID_MIN_MATCHES = 8
+
+# Maps pixel centers at one scale to another, matching cv2.resize's half-pixel convention
+def scaleMatrix(factor):
+  shift = 0.5 * (factor - 1)
+  return np.array([[factor, 0, shift], [0, factor, shift], [0, 0, 1]])
+
+# Re-express an image1 -> image2 homography after rescaling both images
+def rescaleHomography(homography, factor1, factor2):
+  rescaled = scaleMatrix(factor2) @ homography @ np.linalg.inv(scaleMatrix(factor1))
+  return rescaled / rescaled[2, 2]
+
+def _resizeToScale(img, scale):
+  if scale >= 1.0:
+    return img
+  height, width = img.shape[:2]
+  size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+  return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def _applyHomography(homography, points):
+  homogeneous = np.column_stack((points, np.ones(len(points)))) @ homography.T
+  return homogeneous[:, :2] / homogeneous[:, 2:3]
+
+# Points whose template fits in image1 and whose search window lands inside image2, capped to maxPoints
+def _selectPoints(points1, homography, shape1, shape2, window, maxPoints):
+  points1 = np.round(points1).astype(np.intp)
+  predicted = _applyHomography(homography, points1)
+  valid = (
+    (points1[:, 0] >= window) & (points1[:, 0] < shape1[1] - window)
+    & (points1[:, 1] >= window) & (points1[:, 1] < shape1[0] - window)
+    & (predicted[:, 0] >= window) & (predicted[:, 0] < shape2[1] - window)
+    & (predicted[:, 1] >= window) & (predicted[:, 1] < shape2[0] - window)
+  )
+  points1 = points1[valid]
+  if len(points1) > maxPoints:
+    points1 = points1[np.linspace(0, len(points1) - 1, maxPoints).astype(np.intp)]
+  return points1
+
+# Search windows of image2 resampled on image1's pixel grid, (N, 2 * window + 1, 2 * window + 1)
+def _warpSearchWindows(img2, homography, points1, window):
+  offsets = np.arange(-window, window + 1)
+  gridX = points1[:, 0, None, None] + offsets[None, None, :]
+  gridY = points1[:, 1, None, None] + offsets[None, :, None]
+  gridX, gridY = np.broadcast_arrays(gridX, gridY)
+  mapped = _applyHomography(homography, np.column_stack((gridX.ravel(), gridY.ravel())))
+  size = 2 * window + 1
+  mapX = mapped[:, 0].astype(np.float32).reshape(-1, size)
+  mapY = mapped[:, 1].astype(np.float32).reshape(-1, size)
+  warped = cv2.remap(img2, mapX, mapY, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+  return warped.reshape(len(points1), size, size)
+
+# Sub-pixel offset of a peak from a 3-point parabola fit
+def _parabolaPeak(left, center, right):
+  denom = left - 2 * center + right
+  if denom >= 0:
+    return 0.0
+  return 0.5 * (left - right) / denom
+
+# Offset (dx, dy) of each point's best correlation within the search radius, NaN where it is unreliable
+def _correlateTemplates(img1, warpedWindows, points1, patchRadius, searchRadius, minScore):
+  offsets = np.full((len(points1), 2), np.nan)
+  size = 2 * patchRadius + 1
+  for i, (x, y) in enumerate(points1):
+    template = img1[y - patchRadius:y + patchRadius + 1, x - patchRadius:x + patchRadius + 1]
+    if template.shape != (size, size) or template.std() < PYRAMID_MIN_TEXTURE:
+      continue
+    scores = cv2.matchTemplate(warpedWindows[i], template, cv2.TM_CCOEFF_NORMED)
+    peakY, peakX = np.unravel_index(np.argmax(scores), scores.shape)
+    # A peak on the border means the true offset may lie outside the search area
+    if scores[peakY, peakX] < minScore or peakX in (0, 2 * searchRadius) or peakY in (0, 2 * searchRadius):
+      continue
+    subX = _parabolaPeak(scores[peakY, peakX - 1], scores[peakY, peakX], scores[peakY, peakX + 1])
+    subY = _parabolaPeak(scores[peakY - 1, peakX], scores[peakY, peakX], scores[peakY + 1, peakX])
+    offsets[i] = (peakX - searchRadius + subX, peakY - searchRadius + subY)
+  return offsets
+
+# Guided correspondences at one level and the homography refit on them, or None if too few survive
+def _refineLevel(img1, img2, homography, points1, ransacThreshold, seed, patchRadius, searchRadius, minScore, maxPoints):
+  window = patchRadius + searchRadius
+  points1 = _selectPoints(points1, homography, img1.shape, img2.shape, window, maxPoints)
+  if len(points1) < PYRAMID_MIN_MATCHES:
+    return None, 0
+  warpedWindows = _warpSearchWindows(img2, homography, points1, window)
+  offsets = _correlateTemplates(img1, warpedWindows, points1, patchRadius, searchRadius, minScore)
+  found = ~np.isnan(offsets[:, 0])
+  if found.sum() < PYRAMID_MIN_MATCHES:
+    return None, 0
+
+  # image1(p) looks like warped2(p + offset) = image2(H(p + offset))
+  matched1 = points1[found].astype(np.float64)
+  matched2 = _applyHomography(homography, matched1 + offsets[found])
+  matches = np.column_stack((np.arange(len(matched1)), np.arange(len(matched1))))
+  refined, ransacStats = runRANSAC(matches, matched1, matched2, 200, ransacThreshold, seed=seed, returnStats=True)
+  if refined is None or ransacStats["inliers"] < PYRAMID_MIN_MATCHES:
+    return None, 0
+  return refined, ransacStats["inliers"]
+
+# Scale per image at each level, doubling from the coarse scale up to full resolution
+def pyramidScales(scale1, scale2):
+  numLevels = max(0, int(np.ceil(np.log2(1.0 / min(scale1, scale2)) - 1e-9)))
+  return [(min(1.0, scale1 * 2 ** level), min(1.0, scale2 * 2 ** level)) for level in range(1, numLevels + 1)]
+
+# Lift a homography estimated on images downscaled by scale1 / scale2 to full resolution, refining it at
+# each pyramid level from correspondences near its predictions. points1 are image1 keypoints at the coarse level.
+def refineHomographyPyramid(
+  img1Gray,
+  img2Gray,
+  homography,
+  points1,
+  scale1,
+  scale2,
+  *,
+  ransacThreshold=1.0,
+  seed=None,
+  patchRadius=PYRAMID_PATCH_RADIUS,
+  searchRadius=PYRAMID_SEARCH_RADIUS,
+  minScore=PYRAMID_MIN_SCORE,
+  maxPoints=PYRAMID_MAX_POINTS,
+  stats=None,
+):
+  levelMatches = []
+  prevScale1, prevScale2 = scale1, scale2
+  for levelScale1, levelScale2 in pyramidScales(scale1, scale2):
+    homography = rescaleHomography(homography, levelScale1 / prevScale1, levelScale2 / prevScale2)
+    levelImg1 = _resizeToScale(img1Gray, levelScale1).astype(np.float32)
+    levelImg2 = _resizeToScale(img2Gray, levelScale2).astype(np.float32)
+    levelPoints1 = _applyHomography(scaleMatrix(levelScale1 / scale1), points1)
+    refined, numMatches = _refineLevel(
+      levelImg1, levelImg2, homography, levelPoints1, ransacThreshold, seed, patchRadius, searchRadius, minScore, maxPoints
+    )
+    # Keep the propagated estimate when a level has too little texture to refine on
+    if refined is not None:
+      homography = refined
+    levelMatches.append(numMatches)
+    prevScale1, prevScale2 = levelScale1, levelScale2
+
+  if stats is not None:
+    stats["pyramidLevels"] = len(levelMatches)
+    stats["pyramidMatches"] = levelMatches
+  return homography
@@ -0,0 +1,57 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_STAGE_CACHE_BYTES = 256 * 2**20
+
+# Content key for an image array; stage keys derive from these, so equal pixels share entries
+def arrayKey(arr):
+  digest = hashlib.blake2b(np.ascontiguousarray(arr).data, digest_size=16)
+  digest.update(repr((arr.shape, arr.dtype.str)).encode())
+  return digest.hexdigest()
+
+# Key of a stage output: its name, the keys of the outputs it consumes and the parameters it reads
+def stageKey(name, parentKeys, params):
+  return hashlib.blake2b(repr((name, tuple(parentKeys), params)).encode(), digest_size=16).hexdigest()
+
+def _sizeOf(value):
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if isinstance(value, (tuple, list)):
+    return sum(_sizeOf(item) for item in value)
+  if isinstance(value, dict):
+    return sum(_sizeOf(item) for item in value.values())
+  return 64
+
+# Byte-bounded LRU of stage outputs. Cached arrays are shared with callers and must not be mutated.
+class StageCache:
+  def __init__(self, maxBytes=DEFAULT_STAGE_CACHE_BYTES):
+    self.maxBytes = maxBytes
+    self.usedBytes = 0
+    self._entries = OrderedDict()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+    self._entries.move_to_end(key)
+    return entry[0]
+
+  def put(self, key, value):
+    size = _sizeOf(value)
+    if size > self.maxBytes:
+      return
+    if key in self._entries:
+      self.usedBytes -= self._entries.pop(key)[1]
+    self._entries[key] = (value, size)
+    self.usedBytes += size
+    while self.usedBytes > self.maxBytes:
+      _, (_, evictedSize) = self._entries.popitem(last=False)
+      self.usedBytes -= evictedSize
+
+  def clear(self):
+    self._entries.clear()
+    self.usedBytes = 0
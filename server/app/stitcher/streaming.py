@@ -0,0 +1,247 @@
+import numpy as np
+import cv2
+from .features import CORNER_SELECTIONS, precisionDtype
+from .matching import asFloatDescriptors, findDescriptorMatches
+from .geometry import runRANSAC
+from .blending import (
+  DEFAULT_MAX_CANVAS_PIXELS, DEFAULT_NUM_BANDS, CanvasTooLargeError, checkCanvasBudget, compositeMultiband, warpCorners,
+)
+from .panorama import extractFeatures
+from .pipeline import downscale
+from .profiling import Profile
+
+# Frames from a panning camera, stitched one at a time. Each frame's features are computed once and
+# kept to match the next frame against. The next frame-to-frame homography is predicted from the
+# last one, so a keypoint is only compared with the previous frame's keypoints near its predicted
+# position; whole-frame matching is the fallback when the prediction misses. The canvas grows in
+# place and only the new frame is seam-blended onto it, so per-frame cost does not grow with the
+# number of frames stitched.
+
+# Previous-frame keypoints examined per keypoint inside the search window
+SEARCH_CANDIDATES = 8
+# Pixels at the working resolution (maxSize) around each predicted position
+DEFAULT_SEARCH_RADIUS = 48
+# Extra room added when the canvas grows, as a fraction of its size, so growth is amortized
+CANVAS_GROWTH = 0.5
+
+
+def _project(homography, points):
+  projected = np.column_stack((points, np.ones(len(points)))) @ homography.T
+  return projected[:, :2] / projected[:, 2:3]
+
+
+class StreamStitcher:
+  def __init__(
+    self,
+    *,
+    sigma: float = 2.0,
+    harrisThreshold: float = 3000.0,
+    harrisWindowRadius: int = 3,
+    maxCorners=None,
+    cornerSelection: str = "strongest",
+    siftEnlarge: float = 1.5,
+    featurePrecision: str = "float64",
+    maxSize: int = 1600,
+    maxDescriptorMatches=None,
+    matchRatio: float = 0.8,
+    ransacIters=1000,
+    ransacThreshold=1.0,
+    ransacConfidence: float = 0.999,
+    ransacSeed=None,
+    minInliers: int = 12,
+    searchRadius: float = DEFAULT_SEARCH_RADIUS,
+    numBands: int = DEFAULT_NUM_BANDS,
+    maxCanvasPixels=DEFAULT_MAX_CANVAS_PIXELS,
+  ):
+    if cornerSelection not in CORNER_SELECTIONS:
+      raise ValueError(f"unknown corner selection: {cornerSelection}")
+    precisionDtype(featurePrecision)
+    if searchRadius <= 0 or numBands < 0 or minInliers < 4:
+      raise ValueError("searchRadius must be positive, numBands non-negative and minInliers at least 4")
+    self.maxSize = maxSize
+    self.maxDescriptorMatches = maxDescriptorMatches
+    self.matchRatio = matchRatio
+    self.minInliers = minInliers
+    self.searchRadius = searchRadius
+    self.numBands = numBands
+    self.maxCanvasPixels = maxCanvasPixels
+    self._featureParams = (sigma, harrisThreshold, harrisWindowRadius, siftEnlarge, maxCorners, cornerSelection, featurePrecision)
+    self._ransacParams = dict(iters=ransacIters, inlierThresh=ransacThreshold, confidence=ransacConfidence, seed=ransacSeed)
+    self.numFrames = 0
+    self.stitchedFrames = []
+    # Last stitched frame: keypoints, descriptors, spatial index and homography into the first frame
+    self._previous = None
+    # Last frame-to-previous-frame homography, the prediction for the next one
+    self._motion = None
+    self._canvas = None
+    self._covered = None
+    # Canvas position of the first frame's origin, and the (x0, y0, x1, y1) box of covered pixels
+    self._origin = np.zeros(2, dtype=int)
+    self._usedBox = None
+
+  # Stitch one BGR frame and return its stats. A frame that does not register, or would push the
+  # canvas past maxCanvasPixels, raises ValueError and leaves the stitcher as it was.
+  def addFrame(self, imgBgr, profile=None):
+    from scipy.spatial import cKDTree
+    if profile is None:
+      profile = Profile()
+    index = self.numFrames
+    self.numFrames += 1
+    with profile.span("prep"):
+      imgBgr, _ = downscale(imgBgr, self.maxSize)
+      imgGray = cv2.cvtColor(imgBgr, cv2.COLOR_BGR2GRAY)
+    with profile.span("features"):
+      keypoints, descriptors = extractFeatures(imgGray, *self._featureParams)
+    stats = {"frame": index, "corners": len(keypoints)}
+    profile.count("corners", [len(keypoints)])
+
+    if self._previous is None:
+      motion, toReference = None, np.eye(3)
+    else:
+      with profile.span("match"):
+        motion = self._register(keypoints, descriptors, stats)
+      profile.count("matches", stats["matches"])
+      profile.count("inliers", stats["inliers"])
+      toReference = self._previous["toReference"] @ motion
+      toReference /= toReference[2, 2]
+    with profile.span("composite"):
+      self._composite(imgBgr, toReference)
+
+    self._previous = {
+      "keypoints": keypoints, "descriptors": descriptors, "tree": cKDTree(keypoints), "toReference": toReference,
+    }
+    if motion is not None:
+      self._motion = motion
+    self.stitchedFrames.append(index)
+    x0, y0, x1, y1 = self._usedBox
+    stats["homography"] = toReference.tolist()
+    stats["canvas"] = [int(x1 - x0), int(y1 - y0)]
+    profile.count("canvasPixels", int((x1 - x0) * (y1 - y0)))
+    return stats
+
+  # Stats for each frame in turn; frames that fail are reported with "dropped" instead of raising
+  def stream(self, framesBgr, profile=None):
+    for imgBgr in framesBgr:
+      try:
+        yield self.addFrame(imgBgr, profile)
+      except ValueError as e:
+        yield {"frame": self.numFrames - 1, "dropped": str(e)}
+
+  # The covered part of the canvas, or None before the first frame
+  def panorama(self):
+    if self._usedBox is None:
+      return None
+    x0, y0, x1, y1 = self._usedBox
+    return self._canvas[y0:y1, x0:x1].copy()
+
+  # Homography from the new frame into the previous one, predicted matching first
+  def _register(self, keypoints, descriptors, stats):
+    previous = self._previous
+    if self._motion is not None:
+      matches = self._windowMatches(keypoints, descriptors, self._motion)
+      result = self._ransac(matches, keypoints, previous["keypoints"])
+      if result is not None:
+        stats.update(matches=len(matches), inliers=result[1], windowed=True)
+        return result[0]
+    # No motion yet, or the camera moved differently than predicted
+    maxMatches = self.maxDescriptorMatches or min(100, len(keypoints), len(previous["keypoints"]))
+    matches = findDescriptorMatches(
+      previous["descriptors"], descriptors, maxMatches, method="ratio", ratioThresh=self.matchRatio
+    )
+    result = self._ransac(matches, keypoints, previous["keypoints"])
+    if result is None:
+      raise ValueError(f"frame {stats['frame']} does not register with the previous frame")
+    stats.update(matches=len(matches), inliers=result[1], windowed=False)
+    return result[0]
+
+  def _ransac(self, matches, keypoints, previousKeypoints):
+    if len(matches) < max(4, self.minInliers):
+      return None
+    homography, ransacStats = runRANSAC(matches, keypoints, previousKeypoints, returnStats=True, **self._ransacParams)
+    if homography is None or ransacStats["inliers"] < self.minInliers:
+      return None
+    return homography, ransacStats["inliers"]
+
+  # (new, previous) index pairs, best first: each keypoint's nearest descriptor among the previous
+  # keypoints within searchRadius of where the motion puts it, kept if it passes the ratio test
+  # against the runner-up there and no better pair already claimed that previous keypoint
+  def _windowMatches(self, keypoints, descriptors, motion):
+    previous = self._previous
+    numPrevious = len(previous["keypoints"])
+    if len(keypoints) == 0 or numPrevious == 0:
+      return np.empty((0, 2), dtype=np.intp)
+    k = min(SEARCH_CANDIDATES, numPrevious)
+    _, candidates = previous["tree"].query(
+      _project(motion, keypoints), k=k, distance_upper_bound=self.searchRadius
+    )
+    candidates = np.asarray(candidates).reshape(len(keypoints), k)
+    inWindow = candidates < numPrevious
+    candidates = np.where(inWindow, candidates, 0)
+
+    differences = asFloatDescriptors(descriptors)[:, None, :] - asFloatDescriptors(previous["descriptors"])[candidates]
+    distances = np.einsum("nkd,nkd->nk", differences, differences)
+    distances[~inWindow] = np.inf
+    order = np.argsort(distances, axis=1)[:, :2]
+    nearest = np.take_along_axis(distances, order, axis=1)
+    best = nearest[:, 0]
+    secondBest = nearest[:, 1] if k > 1 else np.full(len(best), np.inf)
+    keep = np.isfinite(best) & (best < (self.matchRatio ** 2) * secondBest)
+
+    rows = np.flatnonzero(keep)
+    cols = np.take_along_axis(candidates, order[:, :1], axis=1)[keep, 0]
+    byDistance = np.argsort(best[keep], kind="stable")
+    rows, cols = rows[byDistance], cols[byDistance]
+    _, firstClaim = np.unique(cols, return_index=True)
+    firstClaim.sort()
+    return np.column_stack((rows[firstClaim], cols[firstClaim]))
+
+  # Grow the canvas if the frame reaches past it, then seam-blend the frame onto it
+  def _composite(self, imgBgr, toReference):
+    quad = warpCorners(imgBgr, toReference) + self._origin
+    x0, y0 = np.floor(quad.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(quad.max(axis=0)).astype(int) + 1
+    if self._canvas is None:
+      checkCanvasBudget(x1 - x0, y1 - y0, self.maxCanvasPixels)
+      self._origin -= (x0, y0)
+      x0, y0, x1, y1 = 0, 0, x1 - x0, y1 - y0
+      self._canvas = np.zeros((y1, x1) + imgBgr.shape[2:], dtype=np.uint8)
+      self._covered = np.zeros((y1, x1), dtype=bool)
+    else:
+      shift = self._growCanvas(x0, y0, x1, y1)
+      x0, y0, x1, y1 = x0 + shift[0], y0 + shift[1], x1 + shift[0], y1 + shift[1]
+
+    canvasTransform = np.array([[1, 0, self._origin[0]], [0, 1, self._origin[1]], [0, 0, 1]], dtype=np.float64) @ toReference
+    compositeMultiband(self._canvas, self._covered, imgBgr, canvasTransform, self.numBands)
+    if self._usedBox is None:
+      self._usedBox = (x0, y0, x1, y1)
+    else:
+      u0, v0, u1, v1 = self._usedBox
+      self._usedBox = (min(u0, x0), min(v0, y0), max(u1, x1), max(v1, y1))
+
+  # Reallocate so the box fits, with CANVAS_GROWTH slack on each side that had to grow (dropped
+  # if it alone would break the pixel budget). Returns the shift applied to canvas coordinates.
+  def _growCanvas(self, x0, y0, x1, y1):
+    height, width = self._covered.shape
+    need = np.array([max(0, -x0), max(0, -y0), max(0, x1 - width), max(0, y1 - height)])
+    if not need.any():
+      return 0, 0
+    slack = (need > 0) * np.array([width, height, width, height]) * CANVAS_GROWTH
+    for pad in (need + slack.astype(int), need):
+      newWidth, newHeight = width + pad[0] + pad[2], height + pad[1] + pad[3]
+      try:
+        checkCanvasBudget(newWidth, newHeight, self.maxCanvasPixels)
+        break
+      except CanvasTooLargeError:
+        if pad is need:
+          raise
+    left, top = int(pad[0]), int(pad[1])
+    canvas = np.zeros((int(newHeight), int(newWidth)) + self._canvas.shape[2:], dtype=np.uint8)
+    covered = np.zeros((int(newHeight), int(newWidth)), dtype=bool)
+    canvas[top:top + height, left:left + width] = self._canvas
+    covered[top:top + height, left:left + width] = self._covered
+    self._canvas, self._covered = canvas, covered
+    self._origin += (left, top)
+    if self._usedBox is not None:
+      u0, v0, u1, v1 = self._usedBox
+      self._usedBox = (u0 + left, v0 + top, u1 + left, v1 + top)
+    return left, top
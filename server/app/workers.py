@@ -0,0 +1,519 @@
+import asyncio
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from app.stitcher.pipeline import downscale
+
+# Stitch jobs run in a dedicated process pool so CPU-bound work never holds the event loop's GIL.
+# Encoded uploads reach workers through shared memory; only small parameter dicts are pickled.
+# Each worker keeps per-session stage caches, and a session's jobs always go to the same worker.
+# Per-image features persist in a FeatureStore directory that all workers map read-only.
+
+class PoolBusyError(RuntimeError):
+  def __init__(self, retryAfter):
+    super().__init__("stitch queue is full")
+    self.retryAfter = retryAfter
+
+class DeadlineExceededError(RuntimeError):
+  pass
+
+class ImageDecodeError(ValueError):
+  pass
+
+class ImageTooLargeError(ImageDecodeError):
+  pass
+
+class UploadTooLargeError(ValueError):
+  pass
+
+
+# JPEG start-of-frame markers, which carry the image size (C4, C8 and CC are other segments)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG decoding at 1/8, 1/4 or 1/2 scale happens inside the IDCT, so the full-size bitmap never exists
+_REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def _jpegSize(data):
+  i = 2
+  while i + 9 <= len(data):
+    if data[i] != 0xFF:
+      return None
+    marker = data[i + 1]
+    if marker == 0xFF:
+      i += 1
+    elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+      i += 2
+    elif marker in _JPEG_SOF_MARKERS:
+      return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+    else:
+      i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+  return None
+
+# (width, height, format) read from the header without decoding, None for other formats
+def imageHeader(data):
+  if bytes(data[:3]) == b"\xff\xd8\xff":
+    size = _jpegSize(data)
+    return None if size is None else size + ("jpeg",)
+  if bytes(data[:8]) == _PNG_SIGNATURE and bytes(data[12:16]) == b"IHDR":
+    return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big"), "png"
+  return None
+
+def _checkPixels(width, height, maxPixels):
+  if maxPixels and width * height > maxPixels:
+    raise ImageTooLargeError(f"image has {width * height} pixels, the limit is {maxPixels}")
+
+# Rejects images over maxPixels from the header alone; returns the header
+def checkImageHeader(data, maxPixels):
+  header = imageHeader(data)
+  if header is not None:
+    _checkPixels(header[0], header[1], maxPixels)
+  return header
+
+# Largest JPEG reduction that still leaves the longer side at least maxSize
+def _decodeFlag(header, maxSize):
+  if maxSize is None or header is None or header[2] != "jpeg":
+    return cv2.IMREAD_COLOR
+  for factor, flag in _REDUCED_DECODE_FLAGS:
+    if max(header[:2]) >= factor * maxSize:
+      return flag
+  return cv2.IMREAD_COLOR
+
+def _decodeOrNone(data, flags=cv2.IMREAD_COLOR):
+  if len(data) == 0:
+    return None
+  return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+# maxSize is the longer side the stitcher will downscale to, so larger JPEGs are decoded reduced.
+# Images over maxPixels are rejected before decoding when the header is readable, after otherwise.
+def decodeImg(data, maxSize=None, maxPixels=None):
+  if len(data) == 0:
+    raise ImageDecodeError("empty upload")
+  header = checkImageHeader(data, maxPixels)
+  img = _decodeOrNone(data, _decodeFlag(header, maxSize))
+  if img is None:
+    raise ImageDecodeError("could not decode image")
+  if header is None:
+    _checkPixels(img.shape[1], img.shape[0], maxPixels)
+  return img
+
+# Response formats; "json" skips compositing and returns the canvas layout (see stitchImages)
+OUTPUT_FORMATS = ("jpeg", "webp", "png", "json")
+DEFAULT_OUTPUT = {"format": "jpeg", "quality": 92, "progressive": False, "preview": 0}
+
+# Requested format, falling back to png when it fails (e.g. beyond the JPEG or WebP size limits)
+def encodeImg(img, format="jpeg", quality=92, progressive=False):
+  if format == "jpeg":
+    flags = [int(cv2.IMWRITE_JPEG_QUALITY), quality, int(cv2.IMWRITE_JPEG_PROGRESSIVE), int(progressive)]
+    ok, buf = cv2.imencode(".jpg", img, flags)
+    if ok:
+      return buf.tobytes(), "image/jpeg"
+  elif format == "webp":
+    ok, buf = cv2.imencode(".webp", img, [int(cv2.IMWRITE_WEBP_QUALITY), quality])
+    if ok:
+      return buf.tobytes(), "image/webp"
+  ok, buf = cv2.imencode(".png", img)
+  if not ok:
+    raise RuntimeError("encode failed")
+  return buf.tobytes(), "image/png"
+
+# The encoded response for a job: the panorama (downscaled to the preview size if one is set),
+# or the layout JSON when the stitcher was asked not to blend
+def _encodeOutput(pano, stats, output):
+  if output["format"] == "json":
+    layout = dict(stats["layout"], frames=stats.get("stitchedFrames", [0, 1]))
+    return json.dumps(layout).encode(), "application/json"
+  if output["preview"]:
+    pano, _ = downscale(pano, output["preview"])
+  return encodeImg(pano, output["format"], output["quality"], output["progressive"])
+
+
+# Worker side
+
+def _raiseDeadline(signum, frame):
+  raise DeadlineExceededError("stitch deadline exceeded")
+
+# Per-process stage caches, most recently used session last
+_sessionCaches = OrderedDict()
+# Per-process streaming stitchers by stream id, most recently used last; the oldest is dropped
+# past the limit, so an abandoned stream cannot hold a worker's memory forever
+_streams = OrderedDict()
+MAX_STREAMS_PER_WORKER = 8
+_stageCacheLimits = (0, 0)
+_maxImagePixels = None
+# FeatureStore shared by every worker through its directory, None when disabled
+_featureStore = None
+
+def _initWorker(stageCacheBytes, stageCacheSessions, maxImagePixels, featureStoreDir=None, featureStoreBytes=0):
+  global _stageCacheLimits, _maxImagePixels, _featureStore
+  if hasattr(signal, "SIGALRM"):
+    signal.signal(signal.SIGALRM, _raiseDeadline)
+  _stageCacheLimits = (stageCacheBytes, stageCacheSessions)
+  _maxImagePixels = maxImagePixels
+  if featureStoreDir and featureStoreBytes > 0:
+    from app.stitcher.featurestore import FeatureStore
+    _featureStore = FeatureStore(featureStoreDir, featureStoreBytes)
+
+# Warm-up pair: two overlapping windows of blurred random blocks, sized so the stitch is cheap but
+# still takes every pipeline stage (features, matching, RANSAC, blending) through its first call
+WARMUP_SIZE = 160
+
+def _warmUpPair():
+  rng = np.random.default_rng(0)
+  blocks = rng.integers(0, 256, (WARMUP_SIZE // 8, WARMUP_SIZE // 4, 3), dtype=np.uint8)
+  scene = cv2.resize(blocks, (2 * WARMUP_SIZE, WARMUP_SIZE), interpolation=cv2.INTER_NEAREST)
+  scene = cv2.GaussianBlur(scene, (0, 0), 1.5)
+  width = WARMUP_SIZE * 4 // 3
+  return scene[:, :width].copy(), scene[:, -width:].copy()
+
+# Stitch the warm-up pair with the server's stitch params, round-tripping it through the codecs, so
+# the first real job finds imports loaded, kernels built and libraries initialized. Returns seconds.
+def _warmUp(params):
+  from app.stitcher import stitchImages
+  start = time.monotonic()
+  imgs = [decodeImg(encodeImg(img, "png")[0]) for img in _warmUpPair()]
+  pano = stitchImages(imgs[0], imgs[1], ransacSeed=0, **params)
+  encodeImg(pano)
+  return time.monotonic() - start
+
+# The session's StageCache, evicting the least recently used session past the limit
+def _stageCacheFor(session):
+  from app.stitcher.stagecache import StageCache
+  maxBytes, maxSessions = _stageCacheLimits
+  if session is None or maxBytes <= 0 or maxSessions <= 0:
+    return None
+  cache = _sessionCaches.get(session)
+  if cache is None:
+    cache = _sessionCaches[session] = StageCache(maxBytes)
+  _sessionCaches.move_to_end(session)
+  while len(_sessionCaches) > maxSessions:
+    _sessionCaches.popitem(last=False)
+  return cache
+
+# Decode straight out of the parent's segment; the parent owns and unlinks it.
+# Workers share the parent's resource tracker, so attaching needs no extra bookkeeping.
+def _decodeShared(name, size, maxSize):
+  segment = shared_memory.SharedMemory(name=name)
+  view = segment.buf[:size]
+  img, error = None, None
+  try:
+    img = decodeImg(view, maxSize, _maxImagePixels)
+  except ImageDecodeError as e:
+    error = e.with_traceback(None)
+  finally:
+    # The view must be gone before close(), so decode errors are raised only after it
+    view.release()
+    segment.close()
+  if error is not None:
+    raise error
+  return img
+
+def _armDeadline(deadline):
+  remaining = deadline - time.time()
+  if remaining <= 0:
+    raise DeadlineExceededError("stitch deadline exceeded before start")
+  if hasattr(signal, "setitimer"):
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+
+def _disarmDeadline():
+  if hasattr(signal, "setitimer"):
+    signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _stitchJob(mode, segments, params, output, session, profile, stats):
+  from app.stitcher import stitchImages, stitchImagesMulti
+  params["blend"] = output["format"] != "json"
+  # Pyramid refinement and blending work at the original resolution, and the JSON layout is given
+  # in original pixels, so those decode in full
+  decodeMaxSize = None if params.get("pyramid") or not params["blend"] else params["maxSize"]
+  with profile.span("decode"):
+    imgs = [_decodeShared(name, size, decodeMaxSize) for name, size in segments]
+  if mode == "multi":
+    # One job per worker process: nested feature-extraction pools would oversubscribe the CPUs
+    pano = stitchImagesMulti(imgs, workers=1, featureStore=_featureStore, profile=profile, stats=stats, **params)
+  else:
+    pano = stitchImages(
+      imgs[0], imgs[1], cache=_stageCacheFor(session), featureStore=_featureStore, profile=profile, stats=stats, **params
+    )
+  with profile.span("encode"):
+    return _encodeOutput(pano, stats, output)
+
+# One step of the stream with this id, by params["action"]: "start" creates its StreamStitcher
+# from the other params, "frame" stitches the upload and answers with the frame's stats as JSON
+# (a frame that does not register is reported with "dropped"), "panorama" encodes the canvas so far
+# and "close" drops the stitcher.
+def _streamStep(streamId, segments, params, output, profile):
+  from app.stitcher.streaming import StreamStitcher
+  action = params.pop("action")
+  if action == "start":
+    _streams[streamId] = StreamStitcher(**params)
+    _streams.move_to_end(streamId)
+    while len(_streams) > MAX_STREAMS_PER_WORKER:
+      _streams.popitem(last=False)
+    return b"{}", "application/json"
+  if action == "close":
+    _streams.pop(streamId, None)
+    return b"{}", "application/json"
+  stitcher = _streams.get(streamId)
+  if stitcher is None:
+    raise ValueError("stream was closed or evicted")
+  _streams.move_to_end(streamId)
+  if action == "panorama":
+    pano = stitcher.panorama()
+    if pano is None:
+      raise ValueError("no frames stitched yet")
+    with profile.span("encode"):
+      return encodeImg(pano, output["format"], output["quality"], output["progressive"])
+  with profile.span("decode"):
+    img = _decodeShared(*segments[0], stitcher.maxSize)
+  try:
+    frameStats = stitcher.addFrame(img, profile)
+  except ValueError as e:
+    frameStats = {"frame": stitcher.numFrames - 1, "dropped": str(e)}
+  return json.dumps(frameStats).encode(), "application/json"
+
+# Returns the encoded panorama, its media type, pipeline stats (with the job's profile under
+# "profile") and the time spent in the worker. traceMemory adds peak-memory to each span.
+# mode is "pair", "multi" or "stream"; stream jobs use the session as the stream id.
+def _runJob(mode, segments, params, deadline, session, traceMemory):
+  from app.stitcher.profiling import Profile
+  start = time.monotonic()
+  profile = Profile(traceMemory)
+  _armDeadline(deadline)
+  if traceMemory:
+    tracemalloc.start()
+  try:
+    output = params.pop("output", DEFAULT_OUTPUT)
+    stats = {}
+    if mode == "stream":
+      content, media = _streamStep(session, segments, params, output, profile)
+    else:
+      content, media = _stitchJob(mode, segments, params, output, session, profile, stats)
+  finally:
+    _disarmDeadline()
+    if traceMemory:
+      tracemalloc.stop()
+  serviceSeconds = time.monotonic() - start
+  stats["profile"] = dict(profile.asDict(), seconds=serviceSeconds)
+  return content, media, stats, serviceSeconds
+
+
+# Server side
+
+UPLOAD_CHUNK_BYTES = 2**20
+
+# An encoded upload in a shared-memory segment, which workers decode from without another copy.
+# The creator holds one reference and every job admitted with it another; the segment is unlinked
+# when the last one is released. sha256 is the digest of the bytes, taken while they are copied in.
+class SharedUpload:
+  def __init__(self, size):
+    self.size = size
+    self.segment = shared_memory.SharedMemory(create=True, size=max(1, size))
+    self.sha256 = None
+    self._refs = 1
+
+  @classmethod
+  def fromBytes(cls, data):
+    upload = cls(len(data))
+    upload.segment.buf[:len(data)] = data
+    upload.sha256 = hashlib.sha256(data).digest()
+    return upload
+
+  # Copies a file (e.g. a spooled form upload) in chunks, never reading past maxBytes.
+  # Raises UploadTooLargeError for a larger file. Blocking, so run it in a thread.
+  @classmethod
+  def fromFile(cls, file, maxBytes):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    if size > maxBytes:
+      raise UploadTooLargeError(f"upload exceeds {maxBytes} bytes")
+    file.seek(0)
+    upload = cls(size)
+    digest = hashlib.sha256()
+    try:
+      offset = 0
+      while offset < size:
+        with upload.segment.buf[offset:min(offset + UPLOAD_CHUNK_BYTES, size)] as chunk:
+          read = file.readinto(chunk)
+          if not read:
+            raise ValueError("upload ended early")
+          digest.update(chunk[:read])
+        offset += read
+    except BaseException:
+      upload.release()
+      raise
+    upload.sha256 = digest.digest()
+    return upload
+
+  # The (width, height, format) header of the image, see checkImageHeader
+  def header(self, maxPixels=None):
+    with self.segment.buf[:self.size] as data:
+      return checkImageHeader(data, maxPixels)
+
+  def tobytes(self):
+    return bytes(self.segment.buf[:self.size])
+
+  def acquire(self):
+    self._refs += 1
+    return self
+
+  def release(self):
+    self._refs -= 1
+    if self._refs == 0:
+      self.segment.close()
+      self.segment.unlink()
+
+# Fixed-size pool of single-process shards with a bounded admission count. Jobs beyond
+# workers + queueSize are rejected with PoolBusyError instead of queuing without limit; each job
+# carries an absolute deadline. Jobs with a session go to the shard holding that session's stage
+# cache, others to the least loaded shard. With warmUpParams every shard starts its process and
+# stitches a synthetic pair with them (see _warmUp) ahead of its first job.
+class StitchPool:
+  def __init__(
+    self, workers=None, queueSize=None, deadlineSeconds=60.0, stageCacheBytes=0, stageCacheSessions=0,
+    maxImagePixels=None, featureStoreDir=None, featureStoreBytes=0, warmUpParams=None, deadlineGraceSeconds=1.0,
+  ):
+    self.workers = workers or os.cpu_count() or 1
+    self.queueSize = self.workers * 2 if queueSize is None else queueSize
+    self.deadlineSeconds = deadlineSeconds
+    self.deadlineGraceSeconds = deadlineGraceSeconds
+    self._initArgs = (stageCacheBytes, stageCacheSessions, maxImagePixels, featureStoreDir, featureStoreBytes)
+    self.warmUpParams = warmUpParams
+    self._lock = threading.Lock()
+    self._admitted = 0
+    # Smoothed in-worker job duration, used to suggest Retry-After to rejected clients
+    self._avgSeconds = 1.0
+    self._shards = [self._newExecutor() for _ in range(self.workers)]
+    self._shardLoad = [0] * self.workers
+    self._warmUps = [self._submitWarmUp(executor) for executor in self._shards]
+
+  def _newExecutor(self):
+    return ProcessPoolExecutor(
+      max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+      initializer=_initWorker, initargs=self._initArgs,
+    )
+
+  # A fresh executor for the shard, unless a concurrent failure already replaced it. kill ends the old
+  # worker first and waits for it to exit; jobs still queued on it then fail with BrokenProcessPool.
+  async def _replaceShard(self, shard, executor, kill=False):
+    if executor is not self._shards[shard]:
+      return
+    self._shards[shard] = self._newExecutor()
+    self._submitWarmUp(self._shards[shard])
+    if kill:
+      # ProcessPoolExecutor has no public way to kill its workers before Python 3.14
+      processes = list((executor._processes or {}).values())
+      for process in processes:
+        process.kill()
+      await asyncio.to_thread(lambda: [process.join() for process in processes])
+    executor.shutdown(wait=False)
+
+  # Queued before any job, so the shard's process spawns and warms up while it would otherwise idle
+  def _submitWarmUp(self, executor):
+    if self.warmUpParams is None:
+      return None
+    return executor.submit(_warmUp, self.warmUpParams)
+
+  # Wait for every shard's startup warm-up and return their durations in seconds (none without
+  # warmUpParams). A warm-up that fails raises here; the shard itself stays usable.
+  async def warmUp(self):
+    return await asyncio.gather(*(asyncio.wrap_future(future) for future in self._warmUps if future is not None))
+
+  def _pickShard(self, session):
+    with self._lock:
+      if session is not None:
+        shard = zlib.crc32(session.encode()) % self.workers
+      else:
+        shard = min(range(self.workers), key=self._shardLoad.__getitem__)
+      self._shardLoad[shard] += 1
+      return shard
+
+  @property
+  def admitted(self):
+    return self._admitted
+
+  @property
+  def capacity(self):
+    return self.workers + self.queueSize
+
+  def retryAfter(self):
+    with self._lock:
+      waves = max(1, self._admitted) / self.workers
+      return max(1, math.ceil(self._avgSeconds * waves))
+
+  def _admit(self):
+    with self._lock:
+      if self._admitted >= self.capacity:
+        return False
+      self._admitted += 1
+      return True
+
+  def _release(self, serviceSeconds=None):
+    with self._lock:
+      self._admitted -= 1
+      if serviceSeconds is not None:
+        self._avgSeconds = 0.8 * self._avgSeconds + 0.2 * serviceSeconds
+
+  # Admit one stitch job and return the coroutine that runs it, raising PoolBusyError when full.
+  # mode is "pair", "multi" or "stream" (see _runJob), uploads are encoded image bytes or
+  # SharedUploads; the job holds a reference to the latter, so callers may release theirs.
+  def run(self, mode, uploads, params, session=None, traceMemory=False):
+    if not self._admit():
+      raise PoolBusyError(self.retryAfter())
+    shared = []
+    try:
+      for data in uploads:
+        shared.append(data.acquire() if isinstance(data, SharedUpload) else SharedUpload.fromBytes(data))
+    except BaseException:
+      for upload in shared:
+        upload.release()
+      self._release()
+      raise
+    return self._run(mode, shared, params, session, traceMemory)
+
+  async def _run(self, mode, uploads, params, session, traceMemory):
+    serviceSeconds = None
+    shard = self._pickShard(session)
+    try:
+      deadline = time.time() + self.deadlineSeconds
+      shared = [(upload.segment.name, upload.size) for upload in uploads]
+      executor = self._shards[shard]
+      try:
+        future = executor.submit(_runJob, mode, shared, params, deadline, session, traceMemory)
+        # The worker enforces the deadline itself; the grace period only covers a worker that never
+        # reports back, e.g. stuck in native code, which SIGALRM interrupts only once it returns
+        content, media, stats, serviceSeconds = await asyncio.wait_for(
+          asyncio.wrap_future(future), self.deadlineSeconds + self.deadlineGraceSeconds
+        )
+      except asyncio.TimeoutError:
+        # A job still queued was cancelled with the wait; a running one is killed with its worker
+        # before its segments are released below
+        if future.running():
+          await self._replaceShard(shard, executor, kill=True)
+        raise DeadlineExceededError("stitch deadline exceeded")
+      except BrokenProcessPool:
+        # The worker died (e.g. killed for memory); replace the shard so later jobs can run
+        await self._replaceShard(shard, executor)
+        raise
+      return content, media, stats
+    finally:
+      for upload in uploads:
+        upload.release()
+      with self._lock:
+        self._shardLoad[shard] -= 1
+      self._release(serviceSeconds)
+
+  def shutdown(self):
+    for executor in self._shards:
+      executor.shutdown(wait=True, cancel_futures=True)
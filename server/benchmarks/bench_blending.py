@@ -0,0 +1,51 @@
+# Compositor latency and peak working memory as the panorama grows.
+# Peak is traced numpy/OpenCV allocation during the call minus the output buffer itself.
+# Run from server/: python -m benchmarks.bench_blending
+import argparse
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from app.stitcher.blending import stitchAndBlendImages
+
+def _makeImage(side, rng):
+  noise = rng.random((side // 8, side // 8, 3)) * 255
+  return cv2.resize(noise.astype(np.uint8), (side, side), interpolation=cv2.INTER_CUBIC)
+
+# Half-overlapping pair with a mild perspective component
+def _makeHomography(side):
+  return np.array([[1.0, 0.02, -0.5 * side], [0.01, 1.0, 0.02 * side], [2e-6 * 1000 / side, 0.0, 1.0]])
+
+def _measure(fn):
+  start = time.perf_counter()
+  fn()
+  elapsed = time.perf_counter() - start
+  tracemalloc.start()
+  out = fn()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return elapsed, peak - out.nbytes, out
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--sides", type=int, nargs="+", default=[1000, 2000, 3000])
+  parser.add_argument("--tile-size", type=int, default=512)
+  parser.add_argument("--full-max", type=int, default=3000, help="skip the full-canvas compositor above this side")
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  print(f"{'side':>6} {'canvas MP':>10} {'compositor':<10} {'ms':>9} {'work MB':>9} {'output MB':>10}")
+  for side in args.sides:
+    img1, img2 = _makeImage(side, rng), _makeImage(side, rng)
+    homography = _makeHomography(side)
+    compositors = ["tiled"] + (["full"] if side <= args.full_max else [])
+    for compositor in compositors:
+      elapsed, workBytes, out = _measure(lambda: stitchAndBlendImages(
+        img1, img2, homography, maxCanvasPixels=None, compositor=compositor, tileSize=args.tile_size,
+      ))
+      canvasMp = out.shape[0] * out.shape[1] / 1e6
+      print(f"{side:>6} {canvasMp:>10.1f} {compositor:<10} {elapsed * 1e3:>9.1f} "
+            f"{workBytes / 2**20:>9.1f} {out.nbytes / 2**20:>10.1f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,58 @@
+# Filtering backends against scipy convolve2d: numerical equivalence and latency.
+# Exits non-zero if any backend drifts past the tolerance for its dtype.
+# Run from server/: python -m benchmarks.bench_filtering
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+from pathlib import Path
+from app.stitcher import features
+from app.stitcher.filtering import convolveSame
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "tests" / "data"
+TOLERANCE = {np.float64: 1e-9, np.float32: 1e-4}
+
+def _relErr(result, reference):
+  return np.abs(result - reference).max() / max(np.abs(reference).max(), 1e-12)
+
+def _timeIt(fn):
+  start = time.perf_counter()
+  result = fn()
+  return time.perf_counter() - start, result
+
+def _harrisResponse(img, sigma, backend, dtype):
+  gradX, gradY = features._calcImgDerivatives(img, backend, dtype)
+  return features._calcHarrisResponse(gradX, gradY, features._buildHarrisGaussKernel(sigma), backend)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--image", default=str(DATA_DIR / "sample_left.jpg"))
+  parser.add_argument("--sigmas", type=float, nargs="+", default=[1.0, 2.0, 4.0, 6.0])
+  args = parser.parse_args()
+
+  img = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2GRAY)
+  failed = False
+  print(f"{'stage':<10} {'sigma':>5} {'backend':<10} {'dtype':<8} {'ms':>9} {'rel err':>10}")
+  for sigma in args.sigmas:
+    gaussX, _ = features._buildGaussDerivativeKernels(sigma)
+    stages = (
+      ("gradient", lambda backend, dtype: convolveSame(img, gaussX, backend, dtype)),
+      ("harris", lambda backend, dtype: _harrisResponse(img, sigma, backend, dtype)),
+    )
+    for stage, run in stages:
+      directTime, reference = _timeIt(lambda: run("direct", np.float64))
+      print(f"{stage:<10} {sigma:>5.1f} {'direct':<10} {'float64':<8} {directTime * 1e3:>9.1f} {0:>10.1e}")
+      for backend in ("auto", "separable", "opencv", "fft"):
+        for dtype in (np.float64, np.float32):
+          elapsed, result = _timeIt(lambda: run(backend, dtype))
+          err = _relErr(result, reference)
+          failed |= bool(err > TOLERANCE[dtype])
+          print(f"{stage:<10} {sigma:>5.1f} {backend:<10} {dtype.__name__:<8} {elapsed * 1e3:>9.1f} {err:>10.1e}")
+
+  if failed:
+    print("backend output differs from convolve2d beyond tolerance")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
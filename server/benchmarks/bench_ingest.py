@@ -0,0 +1,67 @@
+# Full-resolution decode then downscale, against reduced JPEG decoding, for a large camera-sized upload.
+# Each mode runs in a fresh process so its peak RSS is its own.
+# Run from server/: python -m benchmarks.bench_ingest [--width 8000] [--max-size 1600]
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from app.workers import decodeImg
+from app.stitcher.pipeline import downscale
+from benchmarks.synthetic import makeScene
+
+MODES = ("full", "reduced")
+
+# High-water RSS of this process image. ru_maxrss would carry over the parent's peak across fork/exec.
+def _peakRssMiB():
+  status = Path("/proc/self/status")
+  if status.exists():
+    for line in status.read_text().splitlines():
+      if line.startswith("VmHWM:"):
+        return int(line.split()[1]) / 1024
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _child(mode, path, maxSize, outPath):
+  data = Path(path).read_bytes()
+  baseline = _peakRssMiB()
+  start = time.perf_counter()
+  img, _ = downscale(decodeImg(data, maxSize if mode == "reduced" else None), maxSize)
+  elapsed = time.perf_counter() - start
+  np.save(outPath, img)
+  print(f"{elapsed} {baseline} {_peakRssMiB()}")
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--width", type=int, default=8000)
+  parser.add_argument("--max-size", type=int, default=1600)
+  parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.child:
+    mode, path, outPath = args.child
+    _child(mode, path, args.max_size, outPath)
+    return
+
+  with tempfile.TemporaryDirectory() as tmp:
+    height = args.width * 3 // 4
+    path = Path(tmp) / "large.jpg"
+    cv2.imwrite(str(path), makeScene(height, args.width, 0), [int(cv2.IMWRITE_JPEG_QUALITY), 92])
+    print(f"input        {args.width}x{height} JPEG, {path.stat().st_size / 2**20:.1f} MiB, maxSize {args.max_size}")
+    outputs = {}
+    for mode in MODES:
+      outPath = Path(tmp) / f"{mode}.npy"
+      result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_ingest", "--max-size", str(args.max_size), "--child", mode, str(path), str(outPath)],
+        capture_output=True, text=True, check=True,
+      )
+      elapsed, beforeMiB, peakMiB = map(float, result.stdout.split())
+      outputs[mode] = np.load(outPath)
+      print(f"{mode:<12} {elapsed * 1e3:>8.1f} ms  peak RSS {peakMiB:>7.1f} MiB ({beforeMiB:.1f} before decode)  output {outputs[mode].shape[1]}x{outputs[mode].shape[0]}")
+    diff = np.abs(outputs["full"].astype(np.int16) - outputs["reduced"].astype(np.int16))
+    print(f"difference   mean {diff.mean():.2f}  max {diff.max()} gray levels")
+
+if __name__ == "__main__":
+  main()
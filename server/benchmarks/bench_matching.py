@@ -0,0 +1,69 @@
+# Matching latency and peak memory as corner counts grow.
+# Run from server/: python -m benchmarks.bench_matching
+import argparse
+import time
+import tracemalloc
+import numpy as np
+from app.stitcher.matching import findDescriptorMatches
+
+# Previous full-broadcast matcher, kept here as the reference point
+def _legacyFindDescriptorMatches(descriptorsSet1, descriptorsSet2, numMatchesToFind):
+  distances = np.sum((descriptorsSet1[None, :, :] - descriptorsSet2[:, None, :]) ** 2, axis=-1)
+  numQuery, numCandidate = distances.shape
+  pairs = [(i, j, float(distances[i, j])) for i in range(numQuery) for j in range(numCandidate)]
+  pairs.sort(key=lambda pair: pair[2])
+  usedQuery, usedCandidate, matches = set(), set(), []
+  for i, j, _ in pairs:
+    if len(matches) >= numMatchesToFind:
+      break
+    if i not in usedQuery and j not in usedCandidate:
+      matches.append((i, j))
+      usedQuery.add(i)
+      usedCandidate.add(j)
+  return matches
+
+# SIFT-like descriptors: non-negative, unit norm, second set is a noisy shuffled copy
+def _makeDescriptors(numCorners, rng):
+  descriptors1 = rng.random((numCorners, 128)) ** 4
+  descriptors1 /= np.linalg.norm(descriptors1, axis=1, keepdims=True)
+  descriptors2 = descriptors1[rng.permutation(numCorners)] + rng.normal(0, 0.01, descriptors1.shape)
+  return descriptors1, np.clip(descriptors2, 0, None)
+
+# Latency is timed untraced, peak memory comes from a second traced run
+def _measure(fn):
+  start = time.perf_counter()
+  result = fn()
+  elapsed = time.perf_counter() - start
+  tracemalloc.start()
+  fn()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return elapsed, peak, result
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--corners", type=int, nargs="+", default=[250, 500, 1000, 2000, 4000])
+  parser.add_argument("--matches", type=int, default=100)
+  parser.add_argument("--legacy-max", type=int, default=1000, help="skip the legacy matcher above this count")
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  variants = [
+    ("greedy/brute", dict(method="greedy", index="brute")),
+    ("greedy/kdtree", dict(method="greedy", index="kdtree")),
+    ("ratio/brute", dict(method="ratio", index="brute")),
+    ("ratio/kdtree", dict(method="ratio", index="kdtree")),
+  ]
+  print(f"{'corners':>8} {'variant':<14} {'ms':>10} {'peak MB':>10} {'matches':>8}")
+  for numCorners in args.corners:
+    descriptors1, descriptors2 = _makeDescriptors(numCorners, rng)
+    rows = []
+    if numCorners <= args.legacy_max:
+      rows.append(("legacy",) + _measure(lambda: _legacyFindDescriptorMatches(descriptors1, descriptors2, args.matches)))
+    for name, kwargs in variants:
+      rows.append((name,) + _measure(lambda: findDescriptorMatches(descriptors1, descriptors2, args.matches, **kwargs)))
+    for name, elapsed, peak, matches in rows:
+      print(f"{numCorners:>8} {name:<14} {elapsed * 1e3:>10.1f} {peak / 2**20:>10.1f} {len(matches):>8}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,77 @@
+# Feature precision policies (features.FEATURE_PRECISIONS) on the synthetic pairs: pipeline time,
+# descriptor bytes, matches and inliers, and homography error against the float64 reference.
+# Exits 1 if a policy fails a pair float64 stitches or its error grows past the suite's threshold.
+# Run from server/: python -m benchmarks.bench_precision [--sizes 480 960] [--repeats 3]
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+from app.stitcher import stitchImages
+from app.stitcher.features import FEATURE_PRECISIONS, FeatureContext, findSift, harrisFindCorners, precisionDtype, quantizeDescriptors
+from benchmarks.suite import DEFAULT_THRESHOLD, HARRIS_RADIUS, HARRIS_THRESHOLD, KEYPOINT_RADIUS, MIN_ERROR_DELTA, SIGMA
+from benchmarks.synthetic import DEFAULT_NOISE, DEFAULT_OVERLAPS, DEFAULT_SIZES, cases, homographyError, makePair, overlapPoints
+
+def _descriptorBytes(gray, precision):
+  context = FeatureContext(gray, dtype=precisionDtype(precision))
+  _, rows, cols = harrisFindCorners(context, SIGMA, HARRIS_THRESHOLD, HARRIS_RADIUS, maxCorners=2000, selection="grid")
+  descriptors = findSift(context, np.column_stack((cols, rows, np.full(len(rows), KEYPOINT_RADIUS))))
+  if precision == "uint8":
+    descriptors = quantizeDescriptors(descriptors)
+  return descriptors.nbytes
+
+def _runPrecision(img1, img2, precision, repeats):
+  stats, times = {}, []
+  for _ in range(repeats):
+    stats = {}
+    start = time.perf_counter()
+    try:
+      stitchImages(img1, img2, ransacSeed=0, maxCorners=2000, cornerSelection="grid", featurePrecision=precision, stats=stats)
+    except ValueError as e:
+      return {"failed": str(e)}
+    times.append(time.perf_counter() - start)
+  return {"seconds": min(times), "homography": stats["homography"], "inliers": stats["ransacInliers"]}
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+  parser.add_argument("--overlaps", type=float, nargs="+", default=list(DEFAULT_OVERLAPS))
+  parser.add_argument("--noise", type=float, nargs="+", default=list(DEFAULT_NOISE))
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+  args = parser.parse_args()
+
+  regressions = []
+  for case in cases(args.sizes, args.overlaps, args.noise):
+    img1, img2, trueHomography = makePair(case["width"], case["overlap"], case["noise"], case["seed"])
+    gray = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
+    points = overlapPoints(img1.shape[1], img1.shape[0], case["overlap"])
+    print(case["name"])
+    reference = None
+    for precision in FEATURE_PRECISIONS:
+      result = _runPrecision(img1, img2, precision, args.repeats)
+      descriptorKiB = _descriptorBytes(gray, precision) / 1024
+      if "failed" in result:
+        print(f"  {precision:<8} failed: {result['failed']}")
+        if reference is not None and "failed" not in reference:
+          regressions.append(f"{case['name']} {precision} failed: {result['failed']}")
+      else:
+        error, maxError = homographyError(result["homography"], trueHomography, points)
+        result["error"] = error
+        print(f"  {precision:<8} {result['seconds'] * 1e3:>8.1f} ms  descriptors {descriptorKiB:>7.1f} KiB  "
+              f"inliers {result['inliers']:>3}  error mean {error:.3f} px  max {maxError:.3f} px")
+        if reference is not None and "error" in reference:
+          baseError = reference["error"]
+          if error > baseError * (1 + args.threshold) and error - baseError > MIN_ERROR_DELTA:
+            regressions.append(f"{case['name']} {precision} error {error:.3f} px vs {baseError:.3f} px float64")
+      if reference is None:
+        reference = result
+
+  for regression in regressions:
+    print(f"REGRESSION {regression}")
+  print(f"{len(regressions)} regressions against float64")
+  if regressions:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,59 @@
+# Single-level vs pyramid homography estimation on a synthetic pair with a known homography.
+# Error is the reprojection distance to the true homography over the overlap, in full-resolution pixels.
+# Run from server/: python -m benchmarks.bench_pyramid
+import argparse
+import time
+import cv2
+import numpy as np
+from pathlib import Path
+from app.stitcher import stitchImages
+from app.stitcher.pyramid import rescaleHomography
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "tests" / "data"
+
+# img1 is the left part of an upscaled sample, img2 the same scene seen through trueHomography
+def _makePair(imagePath, upscale, width):
+  src = cv2.imread(imagePath)
+  src = cv2.resize(src, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+  height = src.shape[0]
+  shift = src.shape[1] - width
+  trueHomography = np.array([[0.98, 0.03, -shift], [-0.02, 1.0, 0.01 * height], [2e-6, 1e-6, 1.0]])
+  img2 = cv2.warpPerspective(src, trueHomography, (width, height))
+  return src[:, :width].copy(), img2, trueHomography
+
+def _project(homography, points):
+  projected = np.column_stack((points, np.ones(len(points)))) @ homography.T
+  return projected[:, :2] / projected[:, 2:3]
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--image", default=str(DATA_DIR / "sample_left.jpg"))
+  parser.add_argument("--upscale", type=float, default=2.5)
+  parser.add_argument("--width", type=int, default=1800)
+  parser.add_argument("--coarse-sizes", type=int, nargs="+", default=[450, 900])
+  args = parser.parse_args()
+
+  img1, img2, trueHomography = _makePair(args.image, args.upscale, args.width)
+  height, width = img1.shape[:2]
+  fullSize = max(height, width)
+  overlapX, overlapY = np.meshgrid(np.linspace(width - 0.4 * width, width - 1, 20), np.linspace(0, height - 1, 20))
+  overlap = np.column_stack((overlapX.ravel(), overlapY.ravel()))
+
+  runs = [(fullSize, False)] + [(size, pyramid) for size in args.coarse_sizes for pyramid in (False, True)]
+  print(f"{'maxSize':>8} {'mode':<8} {'ms':>9} {'mean err':>9} {'max err':>9} {'output':>12}")
+  for maxSize, pyramid in runs:
+    stats = {}
+    start = time.perf_counter()
+    out = stitchImages(img1, img2, maxSize=maxSize, ransacSeed=0, pyramid=pyramid, stats=stats)
+    elapsed = time.perf_counter() - start
+    homography = stats["homography"]
+    if not pyramid and maxSize < fullSize:
+      scale = fullSize / maxSize
+      homography = rescaleHomography(homography, scale, scale)
+    err = np.linalg.norm(_project(homography, overlap) - _project(trueHomography, overlap), axis=1)
+    mode = "pyramid" if pyramid else "single"
+    print(f"{maxSize:>8} {mode:<8} {elapsed * 1e3:>9.1f} {err.mean():>9.3f} {err.max():>9.3f} "
+          f"{out.shape[1]:>6}x{out.shape[0]:<5}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,107 @@
+# Batched SIFT extraction against the previous per-keypoint loop.
+# Run from server/: python -m benchmarks.bench_sift
+import argparse
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from pathlib import Path
+from app.stitcher import features
+from app.stitcher.features import harrisFindCorners, findSift
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "tests" / "data"
+
+# Previous dense (H, W, 8) angle volume
+def _angleVolume(img):
+  img = img.astype(np.float64)
+  angles, _, _ = features._buildSiftAngleAndCellGrids(8, 4)
+  gradX, gradY, magnitude = features._calcGradients(img, sigmaEdge=1)
+  theta = np.arctan2(gradY, gradX)
+  angleVol = np.zeros(img.shape[:2] + (len(angles),))
+  for i in range(len(angles)):
+    cosAligned = np.cos(theta - angles[i]) ** 9
+    angleVol[:, :, i] = cosAligned * (cosAligned > 0) * magnitude
+  return angleVol
+
+# Previous accumulation: one meshgrid, weight table and 8-step angle loop per keypoint
+def _legacyAccumulate(angleVol, keypointsXYR, enlargeFactor=1.5):
+  numAngles, numBins = 8, 4
+  _, gridX, gridY = features._buildSiftAngleAndCellGrids(numAngles, numBins)
+  imgHeight, imgWidth = angleVol.shape[:2]
+  descriptors = np.zeros((keypointsXYR.shape[0], numBins * numBins * numAngles))
+  for k in range(keypointsXYR.shape[0]):
+    centerX, centerY = keypointsXYR[k, :2]
+    radius = keypointsXYR[k, 2] * enlargeFactor
+    gridStep = 2.0 / numBins * radius
+    xMin = int(np.floor(max(centerX - radius - gridStep / 2, 0)))
+    xMax = int(np.ceil(min(centerX + radius + gridStep / 2, imgWidth)))
+    yMin = int(np.floor(max(centerY - radius - gridStep / 2, 0)))
+    yMax = int(np.ceil(min(centerY + radius + gridStep / 2, imgHeight)))
+    pixelX, pixelY = np.meshgrid(np.arange(xMin, xMax), np.arange(yMin, yMax))
+    cellWeights = features._calcBilinearWeights(
+      pixelX.reshape(-1, 1), pixelY.reshape(-1, 1),
+      gridX * radius + centerX, gridY * radius + centerY, gridStep,
+    )
+    hist = np.zeros((numAngles, numBins * numBins))
+    for j in range(numAngles):
+      hist[j] = (angleVol[yMin:yMax, xMin:xMax, j].reshape(-1, 1) * cellWeights).sum(axis=0)
+    descriptors[k] = hist.flatten()
+  return descriptors
+
+def _legacyFindSift(img, keypointsXYR, enlargeFactor=1.5):
+  return features._normalizeDescriptors(_legacyAccumulate(_angleVolume(img), keypointsXYR, enlargeFactor))
+
+def _batchedAccumulate(edgeGradients, keypointsXYR, enlargeFactor=1.5):
+  angles, gridX, gridY = features._buildSiftAngleAndCellGrids(8, 4)
+  return features._accumulateSift(edgeGradients, angles, 9, keypointsXYR, enlargeFactor, gridX, gridY, 4)
+
+def _timeIt(fn, repeats):
+  best = float("inf")
+  for _ in range(repeats):
+    start = time.perf_counter()
+    result = fn()
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+def _peakMb(fn):
+  tracemalloc.start()
+  fn()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return peak / 2**20
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--image", default=str(DATA_DIR / "sample_left.jpg"))
+  parser.add_argument("--repeats", type=int, default=3)
+  args = parser.parse_args()
+
+  img = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2GRAY)
+  _, cornerRows, cornerCols = harrisFindCorners(img, 2.0, 3000.0, 3)
+  fixedRadius = np.column_stack((cornerCols, cornerRows, np.full(len(cornerRows), 8)))
+  # Mixed radii and sub-pixel centers exercise the grouped path
+  rng = np.random.default_rng(0)
+  mixedRadius = np.column_stack((
+    cornerCols + rng.choice([0.0, 0.5], len(cornerCols)),
+    cornerRows,
+    rng.choice([6, 8, 10], len(cornerRows)),
+  ))
+
+  angleVol = _angleVolume(img)
+  edgeGradients = features._calcGradients(img.astype(np.float64), sigmaEdge=1)
+  print(f"{len(cornerRows)} keypoints on {img.shape[1]}x{img.shape[0]}")
+  for name, keypoints in (("fixed radius", fixedRadius), ("mixed radius", mixedRadius)):
+    stages = (
+      ("accumulate", lambda: _legacyAccumulate(angleVol, keypoints), lambda: _batchedAccumulate(edgeGradients, keypoints)),
+      ("findSift", lambda: _legacyFindSift(img, keypoints), lambda: findSift(img, keypoints)),
+    )
+    for stage, legacyFn, batchedFn in stages:
+      legacyTime, legacy = _timeIt(legacyFn, args.repeats)
+      batchedTime, batched = _timeIt(batchedFn, args.repeats)
+      maxDiff = np.abs(legacy - batched).max()
+      print(f"{name:<13} {stage:<11} legacy {legacyTime * 1e3:8.1f} ms  batched {batchedTime * 1e3:8.1f} ms  "
+            f"speedup {legacyTime / batchedTime:5.1f}x  max |diff| {maxDiff:.2e}")
+    print(f"{name:<13} findSift    peak MB legacy {_peakMb(stages[1][1]):8.1f}  batched {_peakMb(stages[1][2]):8.1f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,96 @@
+# Cold start of the server: import time of the app and the stitcher in a fresh interpreter, then
+# for a server started with and without worker warm-up, how long until /ready answers 200 and the
+# latency of the first and second /stitch requests after that. The requests differ in ransacSeed
+# and the feature store is off, so the second one is not served from earlier work.
+# Run from server/: python -m benchmarks.bench_startup [--repeat 5] [--port 8765]
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+import httpx
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parents[1]
+DATA_DIR = SERVER_DIR / "tests" / "data"
+MODULES = ("app.stitcher", "app.main")
+
+# Seconds to import module in a new interpreter, best of repeat
+def importSeconds(module, repeat):
+  code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+  times = []
+  for _ in range(repeat):
+    out = subprocess.run([sys.executable, "-c", code], cwd=SERVER_DIR, capture_output=True, text=True, check=True)
+    times.append(float(out.stdout))
+  return min(times)
+
+def _serverEnv(warmUp):
+  return dict(
+    os.environ,
+    STITCH_WORKERS="1",
+    STITCH_WARMUP="1" if warmUp else "0",
+    STITCH_CACHE_DIR="",
+    STITCH_FEATURE_STORE_BYTES="0",
+  )
+
+def _waitReady(client, url, process, timeout=120.0):
+  start = time.perf_counter()
+  while time.perf_counter() - start < timeout:
+    if process.poll() is not None:
+      raise RuntimeError("server exited during startup")
+    try:
+      if client.get(url + "/ready").status_code == 200:
+        return
+    except httpx.HTTPError:
+      pass
+    time.sleep(0.02)
+  raise RuntimeError("server was not ready in time")
+
+def _stitchSeconds(client, url, files, seed):
+  start = time.perf_counter()
+  response = client.post(url + "/stitch", files=files, data={"ransacSeed": str(seed)})
+  response.raise_for_status()
+  return time.perf_counter() - start
+
+# (seconds from launch until ready, first stitch seconds, second stitch seconds)
+def serverStartup(warmUp, port, files):
+  url = f"http://127.0.0.1:{port}"
+  start = time.perf_counter()
+  process = subprocess.Popen(
+    [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+    cwd=SERVER_DIR, env=_serverEnv(warmUp),
+  )
+  try:
+    with httpx.Client(timeout=120.0) as client:
+      _waitReady(client, url, process)
+      ready = time.perf_counter() - start
+      first = _stitchSeconds(client, url, files, 0)
+      second = _stitchSeconds(client, url, files, 1)
+  finally:
+    process.terminate()
+    process.wait()
+  return ready, first, second
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per import measurement")
+  parser.add_argument("--servers", type=int, default=3, help="server launches per warm-up setting")
+  parser.add_argument("--port", type=int, default=8765)
+  args = parser.parse_args()
+
+  for module in MODULES:
+    print(f"import {module:<14} {importSeconds(module, args.repeat) * 1e3:7.0f} ms")
+
+  files = {
+    "image1": ("left.jpg", (DATA_DIR / "sample_left.jpg").read_bytes(), "image/jpeg"),
+    "image2": ("right.jpg", (DATA_DIR / "sample_right.jpg").read_bytes(), "image/jpeg"),
+  }
+  print(f"{'warm-up':<8} {'ready ms':>9} {'first ms':>9} {'second ms':>10} {'launch to first ms':>19}")
+  for warmUp in (False, True):
+    runs = np.array([serverStartup(warmUp, args.port, files) for _ in range(args.servers)])
+    ready, first, second = np.median(runs, axis=0) * 1e3
+    print(f"{'on' if warmUp else 'off':<8} {ready:9.0f} {first:9.0f} {second:10.0f} {ready + first:19.0f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,61 @@
+# Streaming stitch of a synthetic pan (windows sliding across one scene with hand-held jitter):
+# per-frame time of StreamStitcher early and late in the sequence, against a full stitchImages
+# call per consecutive pair, plus the drift of each frame's position from the ground truth.
+# Run from server/: python -m benchmarks.bench_stream [--frames 40] [--width 640] [--step 40]
+import argparse
+import time
+import numpy as np
+from app.stitcher import stitchImages
+from app.stitcher.streaming import StreamStitcher
+from benchmarks.synthetic import ASPECT, makeScene
+
+STITCH_PARAMS = dict(maxCorners=2000, cornerSelection="grid", ransacSeed=0)
+
+# Frames and each frame's true offset from the first, in pixels
+def makePan(numFrames, width, step, seed=0):
+  height = int(round(width * ASPECT))
+  margin = width // 8
+  scene = makeScene(height + 2 * margin, width + step * numFrames + 2 * margin, seed)
+  rng = np.random.default_rng(seed)
+  frames, offsets = [], []
+  for k in range(numFrames):
+    x = margin + step * k + int(rng.integers(-step // 10, step // 10 + 1))
+    y = margin + int(margin / 2 * np.sin(k / 5))
+    frames.append(scene[y:y + height, x:x + width].copy())
+    offsets.append((x, y))
+  return frames, np.array(offsets) - offsets[0]
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--frames", type=int, default=40)
+  parser.add_argument("--width", type=int, default=640)
+  parser.add_argument("--step", type=int, default=40)
+  parser.add_argument("--pairs", type=int, default=5, help="consecutive pairs timed with stitchImages")
+  args = parser.parse_args()
+
+  frames, offsets = makePan(args.frames, args.width, args.step)
+  stitcher = StreamStitcher(**STITCH_PARAMS)
+  times, drift, windowed = [], [], 0
+  for frame, offset in zip(frames, offsets):
+    start = time.perf_counter()
+    stats = stitcher.addFrame(frame)
+    times.append(time.perf_counter() - start)
+    drift.append(np.linalg.norm(np.array(stats["homography"])[:2, 2] - offset))
+    windowed += bool(stats.get("windowed"))
+
+  pairTimes = []
+  for k in range(1, min(args.pairs, args.frames - 1) + 1):
+    start = time.perf_counter()
+    stitchImages(frames[k - 1], frames[k], **STITCH_PARAMS)
+    pairTimes.append(time.perf_counter() - start)
+
+  quarter = max(1, (args.frames - 1) // 4)
+  print(f"{args.frames} frames {args.width}px, step {args.step}px, panorama {stitcher.panorama().shape[1]}x{stitcher.panorama().shape[0]}")
+  print(f"stream first {quarter} frames  {np.mean(times[1:1 + quarter]) * 1e3:>7.1f} ms/frame")
+  print(f"stream last {quarter} frames   {np.mean(times[-quarter:]) * 1e3:>7.1f} ms/frame")
+  print(f"stitchImages per pair    {np.mean(pairTimes) * 1e3:>7.1f} ms/frame")
+  print(f"windowed matching        {windowed}/{args.frames - 1} frames")
+  print(f"drift                    mean {np.mean(drift):.2f} px  last {drift[-1]:.2f} px")
+
+if __name__ == "__main__":
+  main()
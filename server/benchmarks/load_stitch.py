@@ -0,0 +1,90 @@
+# Load test for a running server: concurrent /stitch requests plus a cheap probe request
+# that shows whether the event loop stays responsive while stitches run.
+# Run from server/: python -m benchmarks.load_stitch --url http://127.0.0.1:8000 --concurrency 8 [--retry]
+import argparse
+import asyncio
+import time
+from collections import Counter
+from pathlib import Path
+import httpx
+import numpy as np
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "tests" / "data"
+
+def _percentiles(latencies):
+  if not latencies:
+    return float("nan"), float("nan")
+  return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+# Latency runs from the first attempt, so with retry it includes time spent backing off
+async def _stitchWorker(client, url, files, form, remaining, latencies, statuses, retry):
+  while remaining[0] > 0:
+    remaining[0] -= 1
+    start = time.perf_counter()
+    while True:
+      try:
+        response = await client.post(url + "/stitch", files=files, data=form)
+      except httpx.HTTPError as e:
+        statuses[type(e).__name__] += 1
+        break
+      statuses[response.status_code] += 1
+      if retry and response.status_code in (429, 503):
+        await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+        continue
+      if response.status_code == 200:
+        latencies.append(time.perf_counter() - start)
+      break
+
+async def _probe(client, url, stop, latencies):
+  while not stop.is_set():
+    start = time.perf_counter()
+    try:
+      await client.get(url + "/openapi.json")
+      latencies.append(time.perf_counter() - start)
+    except httpx.HTTPError:
+      pass
+    await asyncio.sleep(0.1)
+
+async def _run(args):
+  files = {
+    "image1": ("left.jpg", Path(args.image1).read_bytes(), "image/jpeg"),
+    "image2": ("right.jpg", Path(args.image2).read_bytes(), "image/jpeg"),
+  }
+  form = {"ransacSeed": "0"}
+  latencies, probeLatencies, statuses = [], [], Counter()
+  remaining = [args.requests]
+  stop = asyncio.Event()
+  limits = httpx.Limits(max_connections=args.concurrency + 1)
+  async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+    # One untimed request so worker start-up is not counted
+    await client.post(args.url + "/stitch", files=files, data=form)
+    probe = asyncio.create_task(_probe(client, args.url, stop, probeLatencies))
+    start = time.perf_counter()
+    await asyncio.gather(*[
+      _stitchWorker(client, args.url, files, form, remaining, latencies, statuses, args.retry) for _ in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+
+  p50, p99 = _percentiles(latencies)
+  probeP50, probeP99 = _percentiles(probeLatencies)
+  print(f"requests     {args.requests} at concurrency {args.concurrency} in {elapsed:.1f} s")
+  print(f"statuses     {dict(statuses)}")
+  print(f"throughput   {len(latencies) / elapsed:.2f} stitches/s")
+  print(f"stitch ms    p50 {p50 * 1e3:.0f}  p99 {p99 * 1e3:.0f}")
+  print(f"probe ms     p50 {probeP50 * 1e3:.1f}  p99 {probeP99 * 1e3:.1f}")
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--url", default="http://127.0.0.1:8000")
+  parser.add_argument("--requests", type=int, default=32)
+  parser.add_argument("--concurrency", type=int, default=8)
+  parser.add_argument("--retry", action="store_true", help="honor Retry-After on 429/503 instead of counting a failure")
+  parser.add_argument("--timeout", type=float, default=120.0)
+  parser.add_argument("--image1", default=str(DATA_DIR / "sample_left.jpg"))
+  parser.add_argument("--image2", default=str(DATA_DIR / "sample_right.jpg"))
+  asyncio.run(_run(parser.parse_args()))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,221 @@
+# Benchmark suite over synthetic pairs (benchmarks.synthetic): times each public stage function and
+# the full pipeline, records peak traced memory and homography accuracy against the ground truth,
+# and compares the results with a stored baseline so an optimization is judged on speed and
+# correctness together.
+# Run from server/:
+#   python -m benchmarks.suite                  compare with benchmarks/baseline.json, exit 1 on regression
+#   python -m benchmarks.suite --save           record a new baseline (same machine as later comparisons)
+#   python -m benchmarks.suite --sizes 480 --repeats 1 --out results.json
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+import cv2
+import numpy as np
+from app.stitcher import stitchImages
+from app.stitcher.features import harrisFindCorners, findSift
+from app.stitcher.matching import findDescriptorMatches
+from app.stitcher.geometry import runRANSAC
+from app.stitcher.blending import stitchAndBlendImagesRgb
+from benchmarks.synthetic import DEFAULT_NOISE, DEFAULT_OVERLAPS, DEFAULT_SIZES, cases, homographyError, makePair, overlapPoints
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# Relative slowdown, or growth in mean reprojection error, counted as a regression
+DEFAULT_THRESHOLD = 0.3
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.01
+MIN_ERROR_DELTA = 0.05
+FUNCTIONS = ("harrisFindCorners", "findSift", "findDescriptorMatches", "runRANSAC", "stitchAndBlendImagesRgb", "stitchImages")
+
+SIGMA = 2.0
+HARRIS_THRESHOLD = 3000.0
+HARRIS_RADIUS = 3
+KEYPOINT_RADIUS = 8
+NUM_MATCHES = 100
+RANSAC_ITERS = 1000
+RANSAC_THRESHOLD = 1.0
+
+# Best of repeated calls after one untimed warm-up (the minimum is the least disturbed by other load
+# on the machine), then one more call under tracemalloc for the peak (numpy and Python allocations; OpenCV's own buffers are not traced)
+def _measure(fn, repeats):
+  result = fn()
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  tracemalloc.start()
+  try:
+    fn()
+    peakBytes = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return result, min(times), peakBytes
+
+# Fixed numpy workload timed alongside the suite. Comparisons scale baseline times by the ratio of
+# calibrations, so a machine that is uniformly slower today (shared or throttled CPU) is not
+# reported as a regression.
+def _calibrate(repeats):
+  rng = np.random.default_rng(0)
+  img = rng.uniform(0, 255, (720, 960))
+  def workload():
+    gradX, gradY = np.gradient(img)
+    return np.sort((gradX * gradX + gradY * gradY).ravel())
+  return _measure(workload, repeats)[1]
+
+# Inputs for each stage come from the previous one, run the way stitchImages runs them
+def _runCase(case, repeats, functions):
+  img1, img2, trueHomography = makePair(case["width"], case["overlap"], case["noise"], case["seed"])
+  height, width = img1.shape[:2]
+  megapixels = 2 * height * width / 1e6
+  gray1, gray2 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY), cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
+  points = overlapPoints(width, height, case["overlap"])
+  timings = {}
+
+  # Per-image functions are recorded once per image and reported as the pair's total
+  def record(name, fn, pixels=megapixels):
+    if name not in functions:
+      return fn()
+    result, seconds, peakBytes = _measure(fn, repeats)
+    timing = timings.setdefault(name, {"seconds": 0.0, "megapixels": 0.0, "peakBytes": 0})
+    timing["seconds"] += seconds
+    timing["megapixels"] += pixels
+    timing["peakBytes"] = max(timing["peakBytes"], peakBytes)
+    timing["megapixelsPerSecond"] = timing["megapixels"] / timing["seconds"]
+    return result
+
+  corners = []
+  for gray in (gray1, gray2):
+    _, rows, cols = record(
+      "harrisFindCorners", lambda: harrisFindCorners(gray, SIGMA, HARRIS_THRESHOLD, HARRIS_RADIUS), megapixels / 2
+    )
+    corners.append((rows, cols))
+  descriptors, keypoints = [], []
+  for gray, (rows, cols) in zip((gray1, gray2), corners):
+    keypointsXYR = np.column_stack((cols, rows, np.full(len(rows), KEYPOINT_RADIUS)))
+    descriptors.append(record("findSift", lambda: findSift(gray, keypointsXYR), megapixels / 2))
+    keypoints.append(np.column_stack((cols, rows)))
+  numMatches = min(NUM_MATCHES, len(descriptors[0]), len(descriptors[1]))
+  matches = record("findDescriptorMatches", lambda: findDescriptorMatches(descriptors[1], descriptors[0], numMatches))
+  ransacHomography = record(
+    "runRANSAC", lambda: runRANSAC(matches, keypoints[0], keypoints[1], RANSAC_ITERS, RANSAC_THRESHOLD, seed=0)
+  )
+  img1Rgb, img2Rgb = cv2.cvtColor(img1, cv2.COLOR_BGR2RGB), cv2.cvtColor(img2, cv2.COLOR_BGR2RGB)
+  record("stitchAndBlendImagesRgb", lambda: stitchAndBlendImagesRgb(img2Rgb, img1Rgb, trueHomography))
+
+  stats = {}
+  accuracy = {"corners": [len(rows) for rows, _ in corners], "matches": len(matches)}
+  try:
+    record("stitchImages", lambda: stitchImages(img1, img2, ransacSeed=0, stats=stats))
+  except ValueError as e:
+    accuracy["failed"] = str(e)
+  else:
+    accuracy["meanError"], accuracy["maxError"] = homographyError(stats["homography"], trueHomography, points)
+    accuracy["inliers"] = stats["ransacInliers"]
+  if ransacHomography is not None:
+    accuracy["ransacMeanError"] = homographyError(ransacHomography, trueHomography, points)[0]
+  return {"params": case, "functions": timings, "accuracy": accuracy}
+
+def _environment():
+  return {
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "opencv": cv2.__version__,
+    "machine": platform.machine(),
+    "cpus": os.cpu_count(),
+  }
+
+# List of regression messages; cases or functions missing on either side are skipped
+def compare(results, baseline, threshold):
+  regressions = []
+  speed = results["calibrationSeconds"] / baseline["calibrationSeconds"]
+  for name, case in results["cases"].items():
+    baseCase = baseline["cases"].get(name)
+    if baseCase is None:
+      continue
+    for fn, timing in case["functions"].items():
+      baseTiming = baseCase["functions"].get(fn)
+      if baseTiming is None:
+        continue
+      seconds, baseSeconds = timing["seconds"], baseTiming["seconds"] * speed
+      if seconds > baseSeconds * (1 + threshold) and seconds - baseSeconds > MIN_SECONDS_DELTA:
+        regressions.append(f"{name} {fn}: {seconds * 1e3:.1f} ms vs {baseSeconds * 1e3:.1f} ms expected from baseline")
+    accuracy, baseAccuracy = case["accuracy"], baseCase["accuracy"]
+    if "failed" in accuracy and "failed" not in baseAccuracy:
+      regressions.append(f"{name} stitchImages failed: {accuracy['failed']}")
+    elif "meanError" in accuracy and "meanError" in baseAccuracy:
+      error, baseError = accuracy["meanError"], baseAccuracy["meanError"]
+      if error > baseError * (1 + threshold) and error - baseError > MIN_ERROR_DELTA:
+        regressions.append(f"{name} homography error: {error:.3f} px vs {baseError:.3f} px baseline")
+  return regressions
+
+def _printCase(name, case, baseCase):
+  print(name)
+  for fn, timing in case["functions"].items():
+    line = (f"  {fn:<24} {timing['seconds'] * 1e3:>9.1f} ms {timing['megapixelsPerSecond']:>8.2f} MP/s "
+            f"{timing['peakBytes'] / 2**20:>8.1f} MiB")
+    baseTiming = (baseCase or {}).get("functions", {}).get(fn)
+    if baseTiming is not None:
+      line += f"  x{timing['seconds'] / baseTiming['seconds']:.2f} vs baseline"
+    print(line)
+  accuracy = case["accuracy"]
+  if "failed" in accuracy:
+    print(f"  accuracy                 failed: {accuracy['failed']}")
+  else:
+    print(f"  accuracy                 mean {accuracy['meanError']:.3f} px  max {accuracy['maxError']:.3f} px  "
+          f"inliers {accuracy['inliers']}/{accuracy['matches']}")
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+  parser.add_argument("--overlaps", type=float, nargs="+", default=list(DEFAULT_OVERLAPS))
+  parser.add_argument("--noise", type=float, nargs="+", default=list(DEFAULT_NOISE))
+  parser.add_argument("--functions", nargs="+", choices=FUNCTIONS, default=list(FUNCTIONS))
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+  parser.add_argument("--threshold", type=float, default=None, help=f"defaults to the baseline's, else {DEFAULT_THRESHOLD}")
+  parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+  parser.add_argument("--out", help="also write the results to this JSON file")
+  args = parser.parse_args()
+
+  baselinePath = Path(args.baseline)
+  baseline = json.loads(baselinePath.read_text()) if baselinePath.exists() and not args.save else None
+  threshold = args.threshold
+  if threshold is None:
+    threshold = baseline.get("threshold", DEFAULT_THRESHOLD) if baseline else DEFAULT_THRESHOLD
+
+  results = {
+    "environment": _environment(), "threshold": threshold, "repeats": args.repeats,
+    "calibrationSeconds": _calibrate(args.repeats), "cases": {},
+  }
+  for case in cases(args.sizes, args.overlaps, args.noise):
+    results["cases"][case["name"]] = _runCase(case, args.repeats, args.functions)
+    _printCase(case["name"], results["cases"][case["name"]], baseline and baseline["cases"].get(case["name"]))
+
+  # Calibrate again after the cases and keep the faster, so a slow moment at start-up does not skew it
+  results["calibrationSeconds"] = min(results["calibrationSeconds"], _calibrate(args.repeats))
+  if args.out:
+    Path(args.out).write_text(json.dumps(results, indent=2))
+  if args.save:
+    baselinePath.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"saved baseline to {baselinePath}")
+    return
+  if baseline is None:
+    print(f"no baseline at {baselinePath}; run with --save to record one")
+    return
+  if baseline["environment"] != results["environment"]:
+    print(f"warning: baseline recorded on {baseline['environment']}")
+  print(f"machine speed {baseline['calibrationSeconds'] / results['calibrationSeconds']:.2f}x the baseline's")
+  regressions = compare(results, baseline, threshold)
+  for regression in regressions:
+    print(f"REGRESSION {regression}")
+  print(f"{len(regressions)} regressions at threshold {threshold:g}")
+  if regressions:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
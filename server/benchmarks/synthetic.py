@@ -0,0 +1,114 @@
+# Synthetic image pairs with known ground-truth homographies, so benchmarks run offline and can
+# score accuracy. A seeded procedural scene is viewed twice: img1 is its left window, img2 a
+# perspective view of a window shifted right so the two overlap by the requested ratio.
+# Write a dataset from server/: python -m benchmarks.synthetic --out /tmp/pairs
+import argparse
+import json
+from pathlib import Path
+import cv2
+import numpy as np
+
+DEFAULT_SIZES = (480, 960)
+DEFAULT_OVERLAPS = (0.3, 0.6)
+DEFAULT_NOISE = (0.0, 8.0)
+ASPECT = 0.75
+
+# Smooth color field plus filled shapes, which give Harris corners and SIFT texture at any scale
+def makeScene(height, width, seed):
+  rng = np.random.default_rng(seed)
+  coarse = rng.uniform(40, 215, (height // 32 + 2, width // 32 + 2, 3))
+  scene = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+  numShapes = max(20, height * width // 3000)
+  for _ in range(numShapes):
+    color = tuple(float(c) for c in rng.uniform(0, 255, 3))
+    x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+    size = int(rng.integers(4, max(8, min(height, width) // 12)))
+    if rng.random() < 0.5:
+      cv2.rectangle(scene, (x, y), (x + size, y + int(size * rng.uniform(0.5, 2))), color, -1)
+    else:
+      cv2.circle(scene, (x, y), size // 2, color, -1)
+  return np.clip(scene, 0, 255).astype(np.uint8)
+
+# Homography from img2 pixels to scene pixels: a small rotation, shear and perspective tilt about
+# the view's centre, then the shift that places the view in the scene
+def _viewToScene(width, height, shift, rng):
+  angle = rng.uniform(-0.03, 0.03)
+  cos, sin = np.cos(angle), np.sin(angle)
+  center = np.array([[1, 0, -width / 2], [0, 1, -height / 2], [0, 0, 1]])
+  warp = np.array([
+    [cos * rng.uniform(0.97, 1.03), -sin + rng.uniform(-0.02, 0.02), 0],
+    [sin, cos * rng.uniform(0.97, 1.03), 0],
+    [rng.uniform(-2e-5, 2e-5) * 1000 / width, rng.uniform(-2e-5, 2e-5) * 1000 / width, 1],
+  ])
+  back = np.array([[1, 0, width / 2 + shift], [0, 1, height / 2], [0, 0, 1]])
+  return back @ warp @ center
+
+# Returns (img1, img2, trueHomography) with trueHomography mapping img1 pixels to img2 pixels,
+# the convention of stitchImages. noise is the std of additive Gaussian noise in gray levels.
+def makePair(width, overlap, noise=0.0, seed=0):
+  rng = np.random.default_rng(seed)
+  height = int(round(width * ASPECT))
+  shift = width * (1 - overlap)
+  # Margin so the tilted second view never samples outside the scene
+  margin = width // 8
+  scene = makeScene(height + 2 * margin, int(width + shift) + 2 * margin, seed)
+  viewToScene = _viewToScene(width, height, shift, rng)
+  sceneOrigin = np.array([[1, 0, margin], [0, 1, margin], [0, 0, 1]], dtype=np.float64)
+  img1 = scene[margin:margin + height, margin:margin + width].copy()
+  img2 = cv2.warpPerspective(scene, sceneOrigin @ viewToScene, (width, height), flags=cv2.WARP_INVERSE_MAP | cv2.INTER_LINEAR)
+  trueHomography = np.linalg.inv(viewToScene)
+  trueHomography /= trueHomography[2, 2]
+  if noise > 0:
+    img1 = _addNoise(img1, noise, rng)
+    img2 = _addNoise(img2, noise, rng)
+  return img1, img2, trueHomography
+
+def _addNoise(img, noise, rng):
+  return np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+
+# Evenly spaced img1 points inside the overlap, where an estimated homography is scored
+def overlapPoints(width, height, overlap, numPerSide=20):
+  xs = np.linspace(width * (1 - overlap), width - 1, numPerSide)
+  ys = np.linspace(0, height - 1, numPerSide)
+  gridX, gridY = np.meshgrid(xs, ys)
+  return np.column_stack((gridX.ravel(), gridY.ravel()))
+
+def project(homography, points):
+  projected = np.column_stack((points, np.ones(len(points)))) @ homography.T
+  return projected[:, :2] / projected[:, 2:3]
+
+# Mean and max reprojection distance between two homographies over points, in img2 pixels
+def homographyError(homography, trueHomography, points):
+  err = np.linalg.norm(project(homography, points) - project(trueHomography, points), axis=1)
+  return float(err.mean()), float(err.max())
+
+# One case per (size, overlap, noise), each with its own seed so cases are independent
+def cases(sizes=DEFAULT_SIZES, overlaps=DEFAULT_OVERLAPS, noises=DEFAULT_NOISE, seed=0):
+  grid = [(size, overlap, noise) for size in sizes for overlap in overlaps for noise in noises]
+  return [
+    {"name": f"w{size}-o{overlap:g}-n{noise:g}", "width": size, "overlap": overlap, "noise": noise, "seed": seed + i}
+    for i, (size, overlap, noise) in enumerate(grid)
+  ]
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--out", required=True)
+  parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+  parser.add_argument("--overlaps", type=float, nargs="+", default=list(DEFAULT_OVERLAPS))
+  parser.add_argument("--noise", type=float, nargs="+", default=list(DEFAULT_NOISE))
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  out = Path(args.out)
+  out.mkdir(parents=True, exist_ok=True)
+  manifest = []
+  for case in cases(args.sizes, args.overlaps, args.noise, args.seed):
+    img1, img2, trueHomography = makePair(case["width"], case["overlap"], case["noise"], case["seed"])
+    cv2.imwrite(str(out / f"{case['name']}_1.png"), img1)
+    cv2.imwrite(str(out / f"{case['name']}_2.png"), img2)
+    manifest.append(dict(case, homography=trueHomography.tolist()))
+  (out / "manifest.json").write_text(json.dumps(manifest, indent=2))
+  print(f"wrote {len(manifest)} pairs to {out}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,84 @@
+import warnings
+import numpy as np
+from app.stitcher.blending import _findSeam, compositeMultiband, stitchAndBlendImages, stitchAndBlendImagesMulti
+
+# img2 is a crop of img1 placed where it came from, so any correct blend reproduces img1
+def _containedPair():
+  rng = np.random.default_rng(0)
+  img1 = rng.integers(0, 256, (300, 450, 3), dtype=np.uint8)
+  img2 = img1[100:180, 200:320].copy()
+  homography = np.array([[1, 0, 200], [0, 1, 100], [0, 0, 1]], dtype=np.float64)
+  return img1, img2, homography
+
+def test_tiledMatchesFullForContainedImage():
+  img1, img2, homography = _containedPair()
+  with warnings.catch_warnings():
+    warnings.simplefilter("error")
+    tiled = stitchAndBlendImages(img1, img2, homography, compositor="tiled", tileSize=128)
+  full = stitchAndBlendImages(img1, img2, homography, compositor="full")
+  assert tiled.shape == full.shape == img1.shape
+  assert np.abs(tiled.astype(int) - full).max() <= 1
+  assert np.abs(tiled.astype(int) - img1).max() <= 1
+
+def test_multiKeepsFrameContainingAnother():
+  img1, img2, homography = _containedPair()
+  with warnings.catch_warnings():
+    warnings.simplefilter("error")
+    panorama = stitchAndBlendImagesMulti([img1, img2], [np.eye(3), homography], tileSize=128)
+  assert panorama.shape == img1.shape
+  assert np.abs(panorama.astype(int) - img1).max() <= 1
+
+def _translation(dx, dy=0):
+  return np.array([[1, 0, dx], [0, 1, dy], [0, 0, 1]], dtype=np.float64)
+
+# a (100) at the canvas origin, then b (200) 120 px to its right: columns 120-199 overlap
+def _compositeConstantPair(shape=(100, 200, 3), shift=120):
+  out = np.zeros((shape[0], shape[1] + shift) + shape[2:], dtype=np.uint8)
+  covered = np.zeros(out.shape[:2], dtype=bool)
+  compositeMultiband(out, covered, np.full(shape, 100, dtype=np.uint8), np.eye(3), 5)
+  compositeMultiband(out, covered, np.full(shape, 200, dtype=np.uint8), _translation(shift), 5)
+  return out, covered
+
+def test_multibandSeamBlendsConstantOverlap():
+  out, covered = _compositeConstantPair()
+  assert covered.all()
+  values = out[..., 0].astype(int)
+  assert (out == out[..., :1]).all() and (values == values[:1]).all()
+  row = values[0]
+  # Outside the overlap each image passes through untouched
+  assert (row[:120] == 100).all() and (row[200:] == 200).all()
+  # Within it the seam runs down the middle and the bands ramp smoothly from one side to the other
+  assert abs(row[160] - 150) <= 5
+  assert (np.diff(row) >= 0).all() and np.diff(row).max() <= 5
+  assert row[140] < 125 and row[180] > 175
+
+def test_multibandGrayOverlap():
+  out, _ = _compositeConstantPair(shape=(100, 200))
+  color, _ = _compositeConstantPair()
+  np.testing.assert_array_equal(out, color[..., 0])
+
+def test_multibandWithoutOverlapCopiesImage():
+  rng = np.random.default_rng(0)
+  out, covered = np.zeros((50, 130, 3), dtype=np.uint8), np.zeros((50, 130), dtype=bool)
+  left, right = rng.integers(0, 256, (2, 50, 60, 3), dtype=np.uint8)
+  compositeMultiband(out, covered, left, np.eye(3), 5)
+  compositeMultiband(out, covered, right, _translation(70), 5)
+  np.testing.assert_array_equal(out[:, :60], left)
+  np.testing.assert_array_equal(out[:, 70:], right)
+  assert not out[:, 60:70].any() and not covered[:, 60:70].any()
+
+def test_multibandIdenticalOverlapIsSeamless():
+  img = np.random.default_rng(0).integers(0, 256, (120, 300, 3), dtype=np.uint8)
+  out, covered = np.zeros_like(img), np.zeros(img.shape[:2], dtype=bool)
+  compositeMultiband(out, covered, img[:, :200], np.eye(3), 5)
+  compositeMultiband(out, covered, img[:, 100:], _translation(100), 5)
+  assert np.abs(out.astype(int) - img).max() <= 1
+
+def test_seamFollowsCheapestPath():
+  rng = np.random.default_rng(0)
+  cost = rng.random((60, 40)) + 1
+  path = np.clip(20 + np.cumsum(rng.integers(-1, 2, 60)), 0, 39)
+  cost[np.arange(60), path] = 0
+  seam = _findSeam(cost)
+  np.testing.assert_array_equal(seam, path)
+  assert np.abs(np.diff(seam)).max() <= 1
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+from scipy.ndimage import maximum_filter
+from app.stitcher.features import (
+  ANMS_ROBUSTNESS, CORNER_SELECTIONS, _suppressNonMaxAndThreshold, harrisCornersFromResponse, selectCorners,
+)
+
+# 100 strong corners (100 to 100 * 2^20, each over 1 / ANMS_ROBUSTNESS times the next) packed into the
+# top-left 15x15 px of a 200x200 response, and 16 weaker ones spread over the rest of it on a grid
+def _clusteredCorners():
+  rng = np.random.default_rng(0)
+  response = np.zeros((200, 200))
+  clusterRows, clusterCols = np.divmod(rng.choice(225, 100, replace=False), 15)
+  response[clusterRows, clusterCols] = 100 * 2 ** rng.permutation(np.linspace(0, 20, 100))
+  spread = np.arange(40, 200, 50)
+  spreadRows, spreadCols = np.repeat(spread, 4), np.tile(spread, 4)
+  response[spreadRows, spreadCols] = 10 + rng.random(16)
+  rows, cols = response.nonzero()
+  return response, rows, cols
+
+def _minDistance(rows, cols):
+  points = np.column_stack((rows, cols)).astype(np.float64)
+  dist = np.linalg.norm(points[:, None] - points[None], axis=-1)
+  return dist[np.triu_indices(len(points), 1)].min()
+
+@pytest.mark.parametrize("windowRadius", [1, 3, 5])
+def test_dilationNmsMatchesMaximumFilter(windowRadius):
+  response = np.random.default_rng(windowRadius).random((97, 131)).astype(np.float32)
+  response[40:44, 60:64] = 0.5
+  mask, rows, cols = _suppressNonMaxAndThreshold(response, 0.3, windowRadius)
+  windowMax = maximum_filter(response, size=2 * windowRadius + 1, mode="reflect")
+  expected = (response == windowMax) & (response > 0.3)
+  np.testing.assert_array_equal(mask, expected)
+  np.testing.assert_array_equal(rows, expected.nonzero()[0])
+  np.testing.assert_array_equal(cols, expected.nonzero()[1])
+
+@pytest.mark.parametrize("selection", CORNER_SELECTIONS)
+def test_selectionKeepsAllCornersUnderCap(selection):
+  response, rows, cols = _clusteredCorners()
+  for maxCorners in (None, len(rows), len(rows) + 1):
+    selectedRows, selectedCols = selectCorners(response, rows, cols, maxCorners, selection)
+    np.testing.assert_array_equal(selectedRows, rows)
+    np.testing.assert_array_equal(selectedCols, cols)
+
+@pytest.mark.parametrize("selection", CORNER_SELECTIONS)
+@pytest.mark.parametrize("maxCorners", [4, 32, 115])
+def test_selectionCountAndRasterOrder(selection, maxCorners):
+  response, rows, cols = _clusteredCorners()
+  selectedRows, selectedCols = selectCorners(response, rows, cols, maxCorners, selection)
+  assert len(selectedRows) == maxCorners
+  raster = selectedRows * response.shape[1] + selectedCols
+  assert (np.diff(raster) > 0).all()
+  assert response[selectedRows, selectedCols].all()
+
+def test_unknownSelection():
+  response, rows, cols = _clusteredCorners()
+  with pytest.raises(ValueError):
+    selectCorners(response, rows, cols, 10, "random")
+
+def test_strongestKeepsTopResponses():
+  response, rows, cols = _clusteredCorners()
+  selectedRows, selectedCols = selectCorners(response, rows, cols, 32, "strongest")
+  strengths = response[rows, cols]
+  np.testing.assert_array_equal(np.sort(response[selectedRows, selectedCols]), np.sort(strengths)[-32:])
+
+def test_gridTakesBestOfEveryCellFirst():
+  response, rows, cols = _clusteredCorners()
+  # 32 corners give cells of about 71 px, a 3x3 grid; every occupied cell gives its best corner
+  selectedRows, selectedCols = selectCorners(response, rows, cols, 32, "grid")
+  cellSize = np.sqrt(200 * 200 * 4 / 32)
+  cellsOf = lambda r, c: set(zip(r // cellSize, c // cellSize))
+  assert cellsOf(selectedRows, selectedCols) == cellsOf(rows, cols)
+  for cell in cellsOf(rows, cols):
+    inCell = (rows // cellSize == cell[0]) & (cols // cellSize == cell[1])
+    best = np.argmax(np.where(inCell, response[rows, cols], -np.inf))
+    assert ((selectedRows == rows[best]) & (selectedCols == cols[best])).any()
+  # The strongest corners all sit in the cluster
+  strongestRows, strongestCols = selectCorners(response, rows, cols, 32, "strongest")
+  assert len(cellsOf(strongestRows, strongestCols)) == 1
+
+def test_anmsSpreadsCornersOut():
+  response, rows, cols = _clusteredCorners()
+  anmsRows, anmsCols = selectCorners(response, rows, cols, 16, "anms")
+  strongestRows, strongestCols = selectCorners(response, rows, cols, 16, "strongest")
+  assert _minDistance(anmsRows, anmsCols) > 2 * _minDistance(strongestRows, strongestCols)
+  # The global maximum is never suppressed, and the weak spread-out corners, farther from any
+  # stronger corner than cluster members are from each other, outrank the rest of the cluster
+  best = np.argmax(response[rows, cols])
+  assert ((anmsRows == rows[best]) & (anmsCols == cols[best])).any()
+  assert (response[anmsRows, anmsCols] < 100).sum() == 15
+
+def test_anmsKeepsLargestSuppressionRadii():
+  rng = np.random.default_rng(1)
+  response = np.zeros((300, 300))
+  rows, cols = np.divmod(rng.choice(300 * 300, 400, replace=False), 300)
+  response[rows, cols] = rng.random(400) + 0.01
+  rows, cols = response.nonzero()
+  strengths = response[rows, cols]
+
+  # Brute force: distance to the nearest corner that is stronger by the robustness factor
+  stronger = strengths[None, :] * ANMS_ROBUSTNESS > strengths[:, None]
+  dist = np.hypot(rows[:, None] - rows[None, :], cols[:, None] - cols[None, :])
+  radii = np.where(stronger, dist, np.inf).min(axis=1)
+  for maxCorners in (1, 50, 200):
+    selectedRows, selectedCols = selectCorners(response, rows, cols, maxCorners, "anms")
+    selected = np.isin(rows * 300 + cols, selectedRows * 300 + selectedCols)
+    assert selected.sum() == maxCorners
+    assert radii[selected].min() >= radii[~selected].max()
+
+def test_cappedMaskMatchesSelectedCorners():
+  response, rows, cols = _clusteredCorners()
+  mask, selectedRows, selectedCols = harrisCornersFromResponse(response, 1.0, 1, maxCorners=20, selection="grid")
+  assert mask.sum() == 20
+  np.testing.assert_array_equal(mask.nonzero()[0], selectedRows)
+  np.testing.assert_array_equal(mask.nonzero()[1], selectedCols)
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pytest
+from app.stitcher.featurestore import FeatureStore
+
+def _features(numKeypoints, descriptorDtype=np.float64, seed=0):
+  rng = np.random.default_rng(seed)
+  descriptors = (rng.random((numKeypoints, 128)) * 255).astype(descriptorDtype)
+  keypoints = rng.integers(0, 1000, (numKeypoints, 2))
+  return descriptors, keypoints
+
+@pytest.mark.parametrize("descriptorDtype", [np.float64, np.float32, np.uint8])
+@pytest.mark.parametrize("numKeypoints", [1, 7, 300])
+def test_roundTripKeepsHeaderAndArrays(tmp_path, descriptorDtype, numKeypoints):
+  store = FeatureStore(str(tmp_path))
+  descriptors, keypoints = _features(numKeypoints, descriptorDtype)
+  store.put("entry", (descriptors, keypoints))
+
+  storedDescriptors, storedKeypoints = FeatureStore(str(tmp_path)).get("entry")
+  assert storedDescriptors.dtype == descriptors.dtype and storedKeypoints.dtype == keypoints.dtype
+  np.testing.assert_array_equal(storedDescriptors, descriptors)
+  np.testing.assert_array_equal(storedKeypoints, keypoints)
+  assert not storedDescriptors.flags.writeable and not storedKeypoints.flags.writeable
+
+def test_emptyEntry(tmp_path):
+  store = FeatureStore(str(tmp_path))
+  store.put("empty", (np.empty((0, 128)), np.empty((0, 2), dtype=np.int64)))
+  descriptors, keypoints = store.get("empty")
+  assert descriptors.shape == (0, 128) and keypoints.shape == (0, 2)
+
+def test_missingEntry(tmp_path):
+  assert FeatureStore(str(tmp_path)).get("missing") is None
+
+@pytest.mark.parametrize("keepBytes", [0, 10, 64, 200])
+def test_truncatedEntryIsIgnoredAndRemoved(tmp_path, keepBytes):
+  store = FeatureStore(str(tmp_path))
+  store.put("entry", _features(50))
+  path = store._path("entry")
+  with open(path, "r+b") as f:
+    f.truncate(keepBytes)
+
+  assert store.get("entry") is None
+  assert not os.path.exists(path)
+  store.put("entry", _features(50))
+  assert store.get("entry") is not None
+
+def test_corruptHeaderIsIgnored(tmp_path):
+  store = FeatureStore(str(tmp_path))
+  store.put("entry", _features(50))
+  path = store._path("entry")
+  with open(path, "r+b") as f:
+    f.write(b"JUNK")
+
+  assert store.get("entry") is None
+  assert not os.path.exists(path)
+
+def test_evictsLeastRecentlyUsedByMtime(tmp_path):
+  features = _features(100)
+  store = FeatureStore(str(tmp_path))
+  store.put("probe", features)
+  entryBytes = os.path.getsize(store._path("probe"))
+  os.remove(store._path("probe"))
+
+  store = FeatureStore(str(tmp_path), maxBytes=2 * entryBytes)
+  store.put("a", features)
+  store.put("b", features)
+  now = time.time()
+  os.utime(store._path("a"), (now - 200, now - 200))
+  os.utime(store._path("b"), (now - 100, now - 100))
+  # Reading a marks it as used, leaving b the oldest
+  assert store.get("a") is not None
+  store.put("c", features)
+
+  assert store.get("b") is None
+  assert store.get("a") is not None and store.get("c") is not None
+
+def test_sweepRemovesOrphanedTemporaryFiles(tmp_path):
+  store = FeatureStore(str(tmp_path))
+  store.put("entry", _features(10))
+  exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+  exitedPid = int(exited.stdout)
+  writing = tmp_path / f"a.v1.feat.{os.getpid()}.tmp"
+  orphaned = tmp_path / f"b.v1.feat.{exitedPid}.tmp"
+  stale = tmp_path / f"c.v1.feat.{os.getpid()}.tmp"
+  for path in (writing, orphaned, stale):
+    path.write_bytes(b"partial")
+  old = time.time() - 2 * 3600
+  os.utime(stale, (old, old))
+
+  assert store.sweepTemporary() == 2
+  assert writing.exists() and not orphaned.exists() and not stale.exists()
+  assert store.get("entry") is not None
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy.signal import convolve2d
+from app.stitcher.filtering import FILTER_BACKENDS, _separateKernel, convolveSame
+
+def _image(dtype=np.float64):
+  return np.random.default_rng(0).uniform(0, 255, (37, 52)).astype(dtype)
+
+# Rank-1 Gaussian and a random kernel, both odd-sized so every backend accepts them
+def _separableKernel():
+  taps = np.exp(-0.5 * (np.arange(-3, 4) / 1.5) ** 2)
+  return np.outer(taps, taps) / taps.sum() ** 2
+
+def _nonSeparableKernel():
+  return np.random.default_rng(1).normal(size=(5, 5))
+
+@pytest.mark.parametrize("backend", FILTER_BACKENDS)
+def test_separableKernelMatchesConvolve2d(backend):
+  img, kernel = _image(), _separableKernel()
+  np.testing.assert_allclose(convolveSame(img, kernel, backend), convolve2d(img, kernel, "same"), atol=1e-9)
+
+@pytest.mark.parametrize("backend", [backend for backend in FILTER_BACKENDS if backend != "separable"])
+def test_nonSeparableKernelMatchesConvolve2d(backend):
+  img, kernel = _image(), _nonSeparableKernel()
+  np.testing.assert_allclose(convolveSame(img, kernel, backend), convolve2d(img, kernel, "same"), atol=1e-9)
+
+def test_separableBackendRejectsNonSeparableKernel():
+  assert _separateKernel(_nonSeparableKernel()) is None
+  with pytest.raises(ValueError):
+    convolveSame(_image(), _nonSeparableKernel(), "separable")
+
+def test_evenKernelMatchesConvolve2d():
+  img, kernel = _image(), np.random.default_rng(2).normal(size=(4, 4))
+  np.testing.assert_allclose(convolveSame(img, kernel), convolve2d(img, kernel, "same"), atol=1e-9)
+
+@pytest.mark.parametrize("backend", FILTER_BACKENDS)
+@pytest.mark.parametrize("kernelFactory", [_separableKernel, _nonSeparableKernel])
+def test_float32MatchesConvolve2d(backend, kernelFactory):
+  kernel = kernelFactory()
+  if backend == "separable" and _separateKernel(kernel) is None:
+    pytest.skip("kernel is not separable")
+  result = convolveSame(_image(np.float32), kernel, backend, np.float32)
+  assert result.dtype == np.float32
+  expected = convolve2d(_image(), kernel, "same")
+  np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-2 * np.abs(kernel).sum())
+
+def test_unknownBackend():
+  with pytest.raises(ValueError):
+    convolveSame(_image(), _separableKernel(), "simd")
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from app.stitcher.geometry import (
+  DEFAULT_BATCH_SIZE, _isDegenerateSample, _prosacSchedule, _sampleDistinct, _sampleProsac, runRANSAC,
+)
+
+TRUE_HOMOGRAPHY = np.array([[1.02, 0.03, 40.0], [-0.02, 0.98, 12.0], [1e-5, -2e-5, 1.0]])
+
+def _project(homography, points):
+  mapped = np.column_stack((points, np.ones(len(points)))) @ homography.T
+  return mapped[:, :2] / mapped[:, 2:]
+
+# numInliers exact correspondences under TRUE_HOMOGRAPHY, then numOutliers random ones; matches
+# are ordered best first the way findDescriptorMatches returns them, inliers leading unless shuffled
+def _correspondences(numInliers, numOutliers, seed=0, shuffle=False):
+  rng = np.random.default_rng(seed)
+  keypoints1 = rng.uniform(0, 500, (numInliers + numOutliers, 2))
+  keypoints2 = _project(TRUE_HOMOGRAPHY, keypoints1)
+  keypoints2[numInliers:] = rng.uniform(0, 500, (numOutliers, 2))
+  order = rng.permutation(len(keypoints1)) if shuffle else np.arange(len(keypoints1))
+  return np.column_stack((order, order)), keypoints1, keypoints2
+
+def _run(matches, keypoints1, keypoints2, **kwargs):
+  return runRANSAC(matches, keypoints1, keypoints2, iters=2000, inlierThresh=1.0, seed=0, returnStats=True, **kwargs)
+
+@pytest.mark.parametrize("poolSize", [4, 5, 9, 1000])
+@pytest.mark.parametrize("count", [1, 3, 4])
+def test_sampleDistinctHasNoRepeats(poolSize, count):
+  samples = _sampleDistinct(np.random.default_rng(0), poolSize, count, 5000)
+  assert samples.shape == (5000, count)
+  assert samples.min() >= 0 and samples.max() < poolSize
+  assert (np.diff(np.sort(samples, axis=1), axis=1) > 0).all()
+
+def test_sampleDistinctIsUniform():
+  samples = _sampleDistinct(np.random.default_rng(0), 6, 4, 60000)
+  counts = np.bincount(samples.ravel(), minlength=6)
+  np.testing.assert_allclose(counts / counts.sum(), 1 / 6, atol=0.005)
+  # Every unordered 4-subset of 6 (15 of them) comes up equally often
+  subsets, subsetCounts = np.unique(np.sort(samples, axis=1), axis=0, return_counts=True)
+  assert len(subsets) == 15
+  np.testing.assert_allclose(subsetCounts / len(samples), 1 / 15, atol=0.005)
+
+def test_fourMatchesWasteNoSamples():
+  matches, keypoints1, keypoints2 = _correspondences(4, 0)
+  homography, stats = _run(matches, keypoints1, keypoints2, confidence=0.5)
+  assert stats["degenerateSamples"] == 0 and stats["inliers"] == 4
+  np.testing.assert_allclose(homography, TRUE_HOMOGRAPHY, rtol=1e-6, atol=1e-6)
+
+def test_degenerateSamplesRejected():
+  points = np.array([[[0, 0], [10, 0], [20, 0], [0, 10]], [[0, 0], [10, 0], [0, 10], [10, 10]]], dtype=float)
+  repeated = np.array([[0, 1, 2, 3], [0, 1, 1, 2]])
+  degenerate = _isDegenerateSample(repeated, points, points[::-1])
+  assert degenerate.tolist() == [True, True]
+  assert _isDegenerateSample(np.array([[0, 1, 2, 3]]), points[1:], points[1:]).tolist() == [False]
+
+def test_collinearMatchesGiveNoHomography():
+  keypoints = np.column_stack((np.arange(20.0) * 10, np.arange(20.0) * 5))
+  matches = np.column_stack((np.arange(20), np.arange(20)))
+  homography, stats = _run(matches, keypoints, keypoints)
+  assert homography is None
+  assert stats["degenerateSamples"] == stats["iterations"] == 2000 and stats["inliers"] == 0
+
+def test_adaptiveStoppingEndsEarlyWithManyInliers():
+  matches, keypoints1, keypoints2 = _correspondences(90, 10, shuffle=True)
+  homography, stats = _run(matches, keypoints1, keypoints2)
+  # 90% inliers need about 7 samples at 0.999 confidence, so the first batch settles it
+  assert stats["iterations"] == DEFAULT_BATCH_SIZE
+  assert stats["inliers"] == 90
+  np.testing.assert_allclose(homography, TRUE_HOMOGRAPHY, rtol=1e-6, atol=1e-6)
+
+def test_adaptiveStoppingFollowsConfidence():
+  matches, keypoints1, keypoints2 = _correspondences(30, 70, shuffle=True)
+  iterations = [_run(matches, keypoints1, keypoints2, confidence=c)[1]["iterations"] for c in (0.9, 0.999, 0.99999)]
+  assert iterations == sorted(iterations)
+  assert iterations[0] < iterations[-1] <= 2000
+  homography, stats = _run(matches, keypoints1, keypoints2)
+  assert stats["inliers"] == 30
+  np.testing.assert_allclose(homography, TRUE_HOMOGRAPHY, rtol=1e-6, atol=1e-6)
+
+def test_prosacGrowsPoolFromBestMatches():
+  numMatches, iters = 200, 2000
+  poolBudget = _prosacSchedule(numMatches, iters)
+  assert (np.diff(poolBudget) >= 0).all()
+  rng = np.random.default_rng(0)
+  maxIndices = []
+  for firstIter in range(0, iters, DEFAULT_BATCH_SIZE):
+    samples = _sampleProsac(rng, poolBudget, numMatches, firstIter, DEFAULT_BATCH_SIZE)
+    assert (np.diff(np.sort(samples, axis=1), axis=1) > 0).all()
+    maxIndices.append(samples.max(axis=1))
+  maxIndices = np.concatenate(maxIndices)
+  # The first sample comes from the top 4 matches, and the pool only grows, to nearly all of them
+  # by the end of the budget
+  assert maxIndices[0] == 3
+  assert (np.diff(maxIndices) >= 0).all()
+  assert maxIndices[-1] >= 0.95 * numMatches
+
+def test_prosacFindsLeadingInliersWithinOneBatch():
+  # With 10% inliers a uniform sample is all inliers once in 10^4 draws, but the best matches lead
+  matches, keypoints1, keypoints2 = _correspondences(20, 180)
+  def inliers(sampling):
+    return runRANSAC(
+      matches, keypoints1, keypoints2, iters=DEFAULT_BATCH_SIZE, inlierThresh=1.0, sampling=sampling, seed=0,
+      returnStats=True,
+    )[1]["inliers"]
+  assert inliers("prosac") == 20
+  assert inliers("uniform") < 20
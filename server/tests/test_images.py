@@ -0,0 +1,76 @@
+import os
+import pytest
+import app.images
+from app.images import ImageRegistry, RegistryFullError
+
+ID_A, ID_B, ID_C = "a" * 64, "b" * 64, "c" * 64
+SIZE = {"width": 4, "height": 3}
+
+# Registry clock the test moves by hand
+class _Clock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+  clock = _Clock()
+  monkeypatch.setattr(app.images, "time", clock)
+  return clock
+
+def test_registerAndGet(tmp_path, clock):
+  registry = ImageRegistry(str(tmp_path), 100, ttlSeconds=60)
+  meta, created = registry.register(ID_A, b"abc", "image/png", SIZE)
+  assert created
+  assert meta == {"mediaType": "image/png", "bytes": 3, "width": 4, "height": 3, "expiresAt": 1060.0}
+  assert registry.get(ID_A) == (b"abc", meta)
+  assert registry.info(ID_A) == meta
+  assert registry.get(ID_B) is None and registry.info(ID_B) is None
+
+def test_imagesExpireAfterTtlUnlessRenewed(tmp_path, clock):
+  registry = ImageRegistry(str(tmp_path), 100, ttlSeconds=60)
+  registry.register(ID_A, b"abc", "image/png", SIZE)
+  registry.register(ID_B, b"def", "image/png", SIZE)
+  clock.now += 50
+  meta, created = registry.register(ID_A, b"abc", "image/png", SIZE)
+  assert not created and meta["expiresAt"] == 1110.0
+  # Reads do not renew
+  assert registry.get(ID_B) is not None
+  clock.now += 10
+  assert registry.get(ID_B) is None and registry.get(ID_A) is not None
+  assert registry.usedBytes == 3
+  assert not os.path.exists(tmp_path / (ID_B + ".bin"))
+  clock.now += 50
+  assert registry.info(ID_A) is None and registry.usedBytes == 0
+
+def test_fullRegistryRefusesInsteadOfEvicting(tmp_path, clock):
+  registry = ImageRegistry(str(tmp_path), 10, ttlSeconds=60)
+  registry.register(ID_A, b"x" * 6, "image/png", SIZE)
+  with pytest.raises(RegistryFullError):
+    registry.register(ID_B, b"y" * 5, "image/png", SIZE)
+  assert registry.get(ID_A) is not None and registry.get(ID_B) is None
+  # Renewing an image already stored needs no room
+  registry.register(ID_A, b"x" * 6, "image/png", SIZE)
+  # Room freed by expiry is reused
+  clock.now += 60
+  registry.register(ID_B, b"y" * 5, "image/png", SIZE)
+  assert registry.get(ID_A) is None and registry.usedBytes == 5
+
+def test_indexReloadedFromDisk(tmp_path, clock):
+  registry = ImageRegistry(str(tmp_path), 100, ttlSeconds=60)
+  meta, _ = registry.register(ID_A, b"abc", "image/jpeg", {})
+  registry.register(ID_B, b"defg", "image/png", SIZE)
+  clock.now += 30
+  registry.register(ID_B, b"defg", "image/png", SIZE)
+  # Leftovers of interrupted writes
+  (tmp_path / (ID_C + ".bin.tmp")).write_bytes(b"partial")
+  (tmp_path / (ID_C + ".bin")).write_bytes(b"no metadata")
+
+  clock.now += 40
+  reloaded = ImageRegistry(str(tmp_path), 100, ttlSeconds=60)
+  assert reloaded.get(ID_A) is None
+  assert reloaded.get(ID_B) == (b"defg", {"mediaType": "image/png", "bytes": 4, **SIZE, "expiresAt": 1090.0})
+  assert reloaded.usedBytes == 4
+  assert sorted(os.listdir(tmp_path)) == [ID_B + ".bin", ID_B + ".json"]
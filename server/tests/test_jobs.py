@@ -0,0 +1,102 @@
+import asyncio
+from app.jobs import JOB_DONE, JobManager, ResultCache
+
+# Pool stand-in: every run returns the uploads joined, after yielding to the event loop once
+class _CountingPool:
+  def __init__(self):
+    self.calls = 0
+
+  def run(self, mode, datas, params, session=None, traceMemory=False):
+    self.calls += 1
+    return self._work(datas)
+
+  async def _work(self, datas):
+    await asyncio.sleep(0)
+    return b"".join(datas), "image/jpeg", {"ransacIterations": 1, "ransacInliers": 4, "profile": {"spans": []}}
+
+def _result(content):
+  return content, "image/jpeg", {}
+
+def test_resultCacheEvictsLeastRecentlyUsed():
+  cache = ResultCache(10)
+  cache.put("a", _result(b"aaaa"))
+  cache.put("b", _result(b"bbbb"))
+  cache.get("a")
+  cache.put("c", _result(b"cccc"))
+  assert cache.contains("a") and cache.contains("c")
+  assert not cache.contains("b")
+  assert cache.get("b") is None
+
+def test_resultCacheSkipsResultsOverBudget():
+  cache = ResultCache(4)
+  cache.put("big", _result(b"too large"))
+  assert not cache.contains("big")
+
+def test_resultCacheDiskTierOutlivesMemory(tmp_path):
+  cache = ResultCache(4, str(tmp_path), 100)
+  cache.put("a", _result(b"aaaa"))
+  cache.put("b", _result(b"bbbb"))
+  assert cache.get("a") == _result(b"aaaa")
+  # A new cache over the same directory finds the entries again
+  reopened = ResultCache(4, str(tmp_path), 100)
+  assert reopened.get("b") == _result(b"bbbb")
+
+def test_resultCacheDiskEviction(tmp_path):
+  cache = ResultCache(0, str(tmp_path), 8)
+  for key in "abc":
+    cache.put(key, _result(key.encode() * 4))
+  assert not cache.contains("a")
+  assert cache.contains("b") and cache.contains("c")
+
+def test_jobsMergeInFlightSubmissions():
+  async def run():
+    pool = _CountingPool()
+    jobs = JobManager(pool, ResultCache(100))
+    first, started = jobs.submit("pair", [b"x", b"y"], {})
+    second, merged = jobs.submit("pair", [b"x", b"y"], {})
+    assert first is second
+    assert started and not merged
+    results = await asyncio.gather(jobs.result(first), jobs.result(second))
+    assert pool.calls == 1
+    assert [content for content, _, _ in results] == [b"xy", b"xy"]
+  asyncio.run(run())
+
+def test_jobsServeRepeatsFromCacheAndRefreshRecomputes():
+  async def run():
+    pool = _CountingPool()
+    jobs = JobManager(pool, ResultCache(100))
+    job, _ = jobs.submit("pair", [b"x", b"y"], {})
+    await jobs.result(job)
+    assert jobs.submit("pair", [b"x", b"y"], {}) == (job, False)
+    assert pool.calls == 1
+    refreshed, started = jobs.submit("pair", [b"x", b"y"], {}, refresh=True)
+    assert refreshed is not job and started
+    assert (await jobs.result(refreshed))[0] == b"xy"
+    assert pool.calls == 2
+  asyncio.run(run())
+
+def test_jobsRecomputeEvictedResults():
+  async def run():
+    pool = _CountingPool()
+    jobs = JobManager(pool, ResultCache(3))
+    first, _ = jobs.submit("pair", [b"a", b"b"], {})
+    await jobs.result(first)
+    await jobs.result(jobs.submit("pair", [b"c", b"d"], {})[0])
+    resubmitted, started = jobs.submit("pair", [b"a", b"b"], {})
+    assert resubmitted is not first and started
+    assert (await jobs.result(resubmitted))[0] == b"ab"
+    assert pool.calls == 3
+  asyncio.run(run())
+
+def test_jobsDeliverResultsTooLargeToCache():
+  async def run():
+    pool = _CountingPool()
+    jobs = JobManager(pool, ResultCache(1))
+    job, _ = jobs.submit("pair", [b"x", b"y"], {})
+    results = await asyncio.gather(jobs.result(job), jobs.result(job))
+    assert job.status == JOB_DONE
+    assert [content for content, _, _ in results] == [b"xy", b"xy"]
+    # Once delivered the result is gone, so a repeat runs the job again
+    assert (await jobs.result(jobs.submit("pair", [b"x", b"y"], {})[0]))[0] == b"xy"
+    assert pool.calls == 2
+  asyncio.run(run())
@@ -0,0 +1,138 @@
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+import app.main as main
+from app.stitcher import stitchImages
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+
+# The app with a one-worker pool and no disk caches; settings override main's module settings,
+# which the lifespan reads when the client starts
+def _client(monkeypatch, tmp_path, **settings):
+  settings = dict(
+    dict(
+      STITCH_WORKERS=1, STITCH_WARMUP=False, STITCH_CACHE_DIR="", STITCH_FEATURE_STORE_BYTES=0,
+      STITCH_IMAGE_STORE_DIR=str(tmp_path / "images"),
+    ),
+    **settings,
+  )
+  for name, value in settings.items():
+    monkeypatch.setattr(main, name, value)
+  return TestClient(main.app)
+
+def _samplePair(scale=1.0):
+  imgs = [cv2.imread(str(DATA_DIR / name)) for name in ("sample_left.jpg", "sample_right.jpg")]
+  return [cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC) for img in imgs]
+
+def _jpegFiles(imgs):
+  return {
+    f"image{i + 1}": (f"image{i + 1}.jpg", cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes(), "image/jpeg")
+    for i, img in enumerate(imgs)
+  }
+
+def test_jsonLayoutIsInOriginalPixels(monkeypatch, tmp_path):
+  # Large enough that a 800 px working size would otherwise decode the JPEGs at 1/4 scale
+  files = _jpegFiles(_samplePair(3.5))
+  params = dict(maxSize=800, maxCorners=2000, cornerSelection="grid", featurePrecision="float32", ransacSeed=0)
+  with _client(monkeypatch, tmp_path) as client:
+    response = client.post("/stitch", files=files, data=dict(params, format="json"))
+  assert response.status_code == 200
+  layout = response.json()
+
+  originals = [cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) for _, data, _ in files.values()]
+  stats = {}
+  stitchImages(*originals, blend=False, maxDescriptorMatches=100, stats=stats, **params)
+  expected = stats["layout"]
+  assert (layout["width"], layout["height"]) == (expected["width"], expected["height"])
+  np.testing.assert_allclose(layout["transforms"], expected["transforms"], rtol=1e-6, atol=1e-6)
+  np.testing.assert_allclose(layout["homography"], expected["homography"], rtol=1e-6, atol=1e-6)
+  # Every original's corners land on the canvas
+  for original, transform in zip(originals, layout["transforms"]):
+    height, width = original.shape[:2]
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]], dtype=float)
+    mapped = corners @ np.array(transform).T
+    mapped = mapped[:, :2] / mapped[:, 2:]
+    assert mapped.min() > -1 and (mapped.max(axis=0) < [layout["width"] + 1, layout["height"] + 1]).all()
+
+def test_uploadOverByteLimit(monkeypatch, tmp_path):
+  files = _jpegFiles(_samplePair())
+  uploadBytes = max(len(data) for _, data, _ in files.values())
+  with _client(monkeypatch, tmp_path, MAX_UPLOAD_BYTES=uploadBytes - 1) as client:
+    assert client.post("/stitch", files=files).status_code == 413
+
+def test_uploadOverPixelLimit(monkeypatch, tmp_path):
+  with _client(monkeypatch, tmp_path, MAX_IMAGE_PIXELS=683 * 1024 - 1) as client:
+    assert client.post("/stitch", files=_jpegFiles(_samplePair())).status_code == 413
+
+def test_emptyOrUndecodableUpload(monkeypatch, tmp_path):
+  files = _jpegFiles(_samplePair())
+  with _client(monkeypatch, tmp_path) as client:
+    empty = dict(files, image2=("image2.jpg", b"", "image/jpeg"))
+    assert client.post("/stitch", files=empty).status_code == 422
+    undecodable = dict(files, image2=("image2.jpg", b"not an image", "image/jpeg"))
+    assert client.post("/stitch", files=undecodable).status_code == 422
+
+def test_streamStartTwoFramesEnd(monkeypatch, tmp_path):
+  frames = [cv2.imencode(".jpg", img)[1].tobytes() for img in _samplePair()]
+  with _client(monkeypatch, tmp_path) as client, client.websocket_connect("/stitch/stream") as ws:
+    ws.send_json({"type": "start", "params": {"maxSize": 512, "ransacSeed": 0}, "output": {"format": "png"}})
+    assert ws.receive_json()["type"] == "started"
+    frameStats = []
+    for frame in frames:
+      ws.send_bytes(frame)
+      frameStats.append(ws.receive_json())
+    ws.send_json({"type": "end"})
+    pano = cv2.imdecode(np.frombuffer(ws.receive_bytes(), np.uint8), cv2.IMREAD_COLOR)
+
+  assert [stats["frame"] for stats in frameStats] == [0, 1]
+  assert all(stats["type"] == "frame" and "dropped" not in stats for stats in frameStats)
+  assert frameStats[1]["inliers"] >= 12
+  assert list(pano.shape[1::-1]) == frameStats[1]["canvas"]
+  # The second frame extends the first one's canvas
+  assert pano.shape[1] > frameStats[0]["canvas"][0]
+
+# Polls /ready until it stops answering 503 for the warm-up still running
+def _waitReady(client, timeoutSeconds=60.0):
+  stopAt = time.monotonic() + timeoutSeconds
+  response = client.get("/ready")
+  while response.status_code == 503 and response.json()["detail"] == "warming up" and time.monotonic() < stopAt:
+    time.sleep(0.1)
+    response = client.get("/ready")
+  return response
+
+def test_readyAfterWarmUp(monkeypatch, tmp_path):
+  with _client(monkeypatch, tmp_path, STITCH_WARMUP=True) as client:
+    # The worker process is still spawning
+    response = client.get("/ready")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    response = _waitReady(client)
+  assert response.status_code == 200
+  ready = response.json()
+  assert ready["ready"] and len(ready["warmUpSeconds"]) == 1 and ready["warmUpSeconds"][0] > 0
+
+def test_notReadyWhenWarmUpFails(monkeypatch, tmp_path):
+  with _client(monkeypatch, tmp_path, STITCH_WARMUP=True, WARMUP_PARAMS={"unknownParam": 1}) as client:
+    response = _waitReady(client)
+    assert response.status_code == 503 and response.json()["detail"] == "warm-up failed"
+    # The shard stays usable for real jobs
+    assert client.post("/stitch", files=_jpegFiles(_samplePair(0.5)), data={"format": "json"}).status_code == 200
+
+def test_registeredImagesStitchByIdUntilRefused(monkeypatch, tmp_path):
+  files = _jpegFiles(_samplePair(0.5))
+  sizes = [len(data) for _, data, _ in files.values()]
+  with _client(monkeypatch, tmp_path, STITCH_IMAGE_STORE_BYTES=sum(sizes)) as client:
+    registered = [client.post("/images", files={"image": upload}) for upload in files.values()]
+    assert [response.status_code for response in registered] == [201, 201]
+    ids = [response.json()["id"] for response in registered]
+    info = client.get(f"/images/{ids[0]}").json()
+    assert info["bytes"] == sizes[0] and info["mediaType"] == "image/jpeg" and info["expiresAt"] > time.time()
+
+    again = client.post("/images", files={"image": files["image1"]})
+    assert again.status_code == 200 and again.json()["expiresAt"] >= info["expiresAt"]
+    # Full: a new image is refused and the registered ones stay
+    other = cv2.imencode(".jpg", np.zeros((8, 8, 3), np.uint8))[1].tobytes()
+    assert client.post("/images", files={"image": ("other.jpg", other, "image/jpeg")}).status_code == 507
+    response = client.post("/stitch/by-id", data={"image1Id": ids[0], "image2Id": ids[1], "format": "json"})
+    assert response.status_code == 200
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from app.stitcher.matching import findDescriptorMatches
+
+# Direct squared differences, every pair sorted stably in row-major order, then the greedy
+# one-to-one pass: the selection findDescriptorMatches must reproduce, ties included
+def _referenceMatches(descriptorsSet1, descriptorsSet2, numMatchesToFind, method="greedy", ratioThresh=0.8):
+  diffs = descriptorsSet2[:, None, :].astype(np.float64) - descriptorsSet1[None, :, :].astype(np.float64)
+  distances = (diffs ** 2).sum(axis=2)
+  pairs = []
+  for i, row in enumerate(distances):
+    order = np.argsort(row, kind="stable")
+    if method == "ratio":
+      if len(order) > 1 and not row[order[0]] < ratioThresh ** 2 * row[order[1]]:
+        continue
+      order = order[:1]
+    pairs.extend((row[j], i, j) for j in order.tolist())
+  pairs.sort(key=lambda pair: pair[0])
+  usedQuery, usedCandidate, matches = set(), set(), []
+  for _, i, j in pairs:
+    if len(matches) >= numMatchesToFind:
+      break
+    if i not in usedQuery and j not in usedCandidate:
+      matches.append((i, j))
+      usedQuery.add(i)
+      usedCandidate.add(j)
+  return matches
+
+# Descriptors with repeated rows in both sets and rows shared between them, so many distances tie
+def _descriptorsWithDuplicates(seed, dtype):
+  rng = np.random.default_rng(seed)
+  descriptorsSet1 = rng.random((60, 16)) ** 4
+  descriptorsSet2 = rng.random((50, 16)) ** 4
+  descriptorsSet1[10:20] = descriptorsSet1[0]
+  descriptorsSet2[5:15] = descriptorsSet2[0]
+  descriptorsSet2[30:35] = descriptorsSet1[3]
+  descriptorsSet2[40:45] = descriptorsSet1[10]
+  if dtype == np.uint8:
+    return (descriptorsSet1 * 255).astype(np.uint8), (descriptorsSet2 * 255).astype(np.uint8)
+  return descriptorsSet1.astype(dtype), descriptorsSet2.astype(dtype)
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32, np.uint8])
+@pytest.mark.parametrize("blockSize", [7, 1024])
+@pytest.mark.parametrize("numMatchesToFind", [1, 5, 30, 100])
+def test_greedyMatchesReferenceWithDuplicates(dtype, blockSize, numMatchesToFind):
+  for seed in range(5):
+    descriptorsSet1, descriptorsSet2 = _descriptorsWithDuplicates(seed, dtype)
+    matches = findDescriptorMatches(descriptorsSet1, descriptorsSet2, numMatchesToFind, blockSize=blockSize)
+    assert matches == _referenceMatches(descriptorsSet1, descriptorsSet2, numMatchesToFind), seed
+
+@pytest.mark.parametrize("dtype", [np.float64, np.uint8])
+@pytest.mark.parametrize("blockSize", [7, 1024])
+def test_ratioMatchesReferenceWithDuplicates(dtype, blockSize):
+  for seed in range(5):
+    descriptorsSet1, descriptorsSet2 = _descriptorsWithDuplicates(seed, dtype)
+    descriptorsSet1[25] = descriptorsSet1[24]
+    matches = findDescriptorMatches(descriptorsSet1, descriptorsSet2, 30, method="ratio", blockSize=blockSize)
+    assert matches == _referenceMatches(descriptorsSet1, descriptorsSet2, 30, method="ratio"), seed
+
+def test_identicalColsTieByIndex():
+  descriptorsSet1 = np.ones((6, 4))
+  descriptorsSet2 = np.ones((3, 4))
+  assert findDescriptorMatches(descriptorsSet1, descriptorsSet2, 3) == [(0, 0), (1, 1), (2, 2)]
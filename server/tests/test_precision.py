@@ -0,0 +1,66 @@
+from pathlib import Path
+import cv2
+import numpy as np
+import pytest
+from app.stitcher import stitchImages
+from app.stitcher.features import DESCRIPTOR_QUANTIZATION_SCALE, FeatureContext, findSift, harrisFindCorners, quantizeDescriptors
+from benchmarks.suite import HARRIS_RADIUS, HARRIS_THRESHOLD, KEYPOINT_RADIUS, MIN_ERROR_DELTA, SIGMA
+from benchmarks.synthetic import cases, homographyError, makePair, overlapPoints
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+# RANSAC runs to convergence and errors are compared as medians over seeds, since equally large
+# consensus sets can differ by more than MIN_ERROR_DELTA and which one a single seed finds is luck
+STITCH_PARAMS = dict(ransacIters=20000, maxCorners=2000, cornerSelection="grid", blend=False)
+RANSAC_SEEDS = range(5)
+
+def _samplePair():
+  return [cv2.imread(str(DATA_DIR / name)) for name in ("sample_left.jpg", "sample_right.jpg")]
+
+def _stitchError(img1, img2, precision, trueHomography, points):
+  errors = []
+  for seed in RANSAC_SEEDS:
+    stats = {}
+    stitchImages(img1, img2, featurePrecision=precision, ransacSeed=seed, stats=stats, **STITCH_PARAMS)
+    errors.append(homographyError(stats["homography"], trueHomography, points)[0])
+  return np.median(errors)
+
+def _assertWithinFloat64(img1, img2, trueHomography, points):
+  try:
+    baseError = _stitchError(img1, img2, "float64", trueHomography, points)
+  except ValueError:
+    pytest.skip("float64 does not register this pair")
+  for precision in ("float32", "uint8"):
+    assert _stitchError(img1, img2, precision, trueHomography, points) <= baseError + MIN_ERROR_DELTA, precision
+
+def test_quantizedDescriptorsRoundTrip():
+  gray = cv2.cvtColor(_samplePair()[0], cv2.COLOR_BGR2GRAY)
+  context = FeatureContext(gray, dtype=np.float32)
+  _, rows, cols = harrisFindCorners(context, SIGMA, HARRIS_THRESHOLD, HARRIS_RADIUS, maxCorners=500, selection="grid")
+  descriptors = findSift(context, np.column_stack((cols, rows, np.full(len(rows), KEYPOINT_RADIUS))))
+  quantized = quantizeDescriptors(descriptors)
+  assert quantized.dtype == np.uint8 and quantized.shape == descriptors.shape
+  # Normalized SIFT entries stay below 255 / scale, so only rounding is lost
+  assert descriptors.max() < 255 / DESCRIPTOR_QUANTIZATION_SCALE
+  restored = quantized / DESCRIPTOR_QUANTIZATION_SCALE
+  assert np.abs(restored - descriptors).max() <= 0.5 / DESCRIPTOR_QUANTIZATION_SCALE + 1e-6
+
+def test_quantizationClipsOutOfRangeEntries():
+  quantized = quantizeDescriptors(np.array([[-0.1, 0.0, 0.6, 1.0]]))
+  assert quantized.tolist() == [[0, 0, 255, 255]]
+
+# The sample pair has no ground truth; OpenCV's SIFT with RANSAC gives an independent reference
+def test_samplePairErrorWithinFloat64():
+  img1, img2 = _samplePair()
+  sift = cv2.SIFT_create()
+  keypoints1, descriptors1 = sift.detectAndCompute(cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY), None)
+  keypoints2, descriptors2 = sift.detectAndCompute(cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY), None)
+  matches = [m for m, n in cv2.BFMatcher().knnMatch(descriptors1, descriptors2, k=2) if m.distance < 0.7 * n.distance]
+  points1 = np.float32([keypoints1[m.queryIdx].pt for m in matches])
+  points2 = np.float32([keypoints2[m.trainIdx].pt for m in matches])
+  reference, inliers = cv2.findHomography(points1, points2, cv2.RANSAC, 1.0)
+  _assertWithinFloat64(img1, img2, reference, points1[inliers.ravel() > 0])
+
+@pytest.mark.parametrize("case", cases((480,)), ids=lambda case: case["name"])
+def test_syntheticPairErrorWithinFloat64(case):
+  img1, img2, trueHomography = makePair(case["width"], case["overlap"], case["noise"], case["seed"])
+  _assertWithinFloat64(img1, img2, trueHomography, overlapPoints(img1.shape[1], img1.shape[0], case["overlap"]))
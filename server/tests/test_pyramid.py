@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from app.stitcher import stitchImages
+from app.stitcher.pyramid import PYRAMID_MIN_MATCHES, pyramidScales, rescaleHomography
+from benchmarks.synthetic import cases, homographyError, makePair, overlapPoints
+
+# Features at a quarter of the 960 px pair, so refinement climbs two pyramid levels
+STITCH_PARAMS = dict(maxSize=240, blend=False)
+RANSAC_SEEDS = range(3)
+
+# Median over seeds of the mean error in original pixels, and the last run's stats
+def _layoutError(img1, img2, trueHomography, points, pyramid):
+  errors = []
+  for seed in RANSAC_SEEDS:
+    stats = {}
+    stitchImages(img1, img2, pyramid=pyramid, ransacSeed=seed, stats=stats, **STITCH_PARAMS)
+    errors.append(homographyError(np.asarray(stats["layout"]["homography"]), trueHomography, points)[0])
+  return np.median(errors), stats
+
+def test_pyramidScalesDoubleToFullResolution():
+  assert pyramidScales(0.25, 0.25) == [(0.5, 0.5), (1.0, 1.0)]
+  assert pyramidScales(0.3, 0.6) == [(0.6, 1.0), (1.0, 1.0)]
+  assert pyramidScales(1.0, 1.0) == []
+
+def test_rescaleHomographyRoundTrips():
+  homography = np.array([[0.98, 0.03, -400], [-0.02, 1.0, 12], [2e-5, 1e-5, 1.0]])
+  restored = rescaleHomography(rescaleHomography(homography, 0.25, 0.5), 4, 2)
+  np.testing.assert_allclose(restored, homography, rtol=1e-9, atol=1e-12)
+
+@pytest.mark.parametrize("case", cases((960,), overlaps=(0.6,)), ids=lambda case: case["name"])
+def test_pyramidRefinementNoWorseThanSingleLevel(case):
+  img1, img2, trueHomography = makePair(case["width"], case["overlap"], case["noise"], case["seed"])
+  points = overlapPoints(img1.shape[1], img1.shape[0], case["overlap"])
+  singleError, _ = _layoutError(img1, img2, trueHomography, points, pyramid=False)
+  pyramidError, stats = _layoutError(img1, img2, trueHomography, points, pyramid=True)
+
+  assert stats["pyramidLevels"] == 2
+  assert min(stats["pyramidMatches"]) >= PYRAMID_MIN_MATCHES
+  assert pyramidError <= singleError
+  # Refined at full resolution, well below the quarter-scale estimate's pixel quantization
+  assert pyramidError < 0.5
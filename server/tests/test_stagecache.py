@@ -0,0 +1,65 @@
+from pathlib import Path
+import cv2
+import numpy as np
+from app.stitcher import stitchImages
+from app.stitcher.featurestore import FeatureStore
+from app.stitcher.stagecache import StageCache, stageKey
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+STITCH_PARAMS = dict(ransacSeed=0, maxSize=512, maxCorners=500)
+
+def _samplePair():
+  return [cv2.imread(str(DATA_DIR / name)) for name in ("sample_left.jpg", "sample_right.jpg")]
+
+def _cachedStages(imgs, cache, featureStore=None, **params):
+  stats = {}
+  pano = stitchImages(*imgs, cache=cache, featureStore=featureStore, stats=stats, **dict(STITCH_PARAMS, **params))
+  return pano, stats["cachedStages"]
+
+def test_stageKeyFollowsParentsAndParams():
+  key = stageKey("match", ["a", "b"], (100, "greedy"))
+  assert key == stageKey("match", ["a", "b"], (100, "greedy"))
+  assert key != stageKey("match", ["a", "c"], (100, "greedy"))
+  assert key != stageKey("match", ["a", "b"], (50, "greedy"))
+  assert key != stageKey("ransac", ["a", "b"], (100, "greedy"))
+
+def test_evictsLeastRecentlyUsedByBytes():
+  cache = StageCache(maxBytes=2 * 800)
+  cache.put("a", np.zeros(100))
+  cache.put("b", np.zeros(100))
+  assert cache.get("a") is not None
+  cache.put("c", np.zeros(100))
+  assert cache.get("b") is None
+  assert cache.get("a") is not None and cache.get("c") is not None
+  assert cache.usedBytes == 2 * 800
+  cache.put("big", np.zeros(1000))
+  assert cache.get("big") is None and len(cache) == 2
+
+def test_repeatReusesEveryStage():
+  imgs, cache = _samplePair(), StageCache()
+  pano, hits = _cachedStages(imgs, cache)
+  assert hits == []
+  cachedPano, hits = _cachedStages(imgs, cache)
+  assert hits == ["prep", "sift", "prep", "sift", "match", "ransac", "blend"]
+  np.testing.assert_array_equal(cachedPano, pano)
+
+def test_ransacParamChangeMissesOnlyDownstream():
+  imgs, cache = _samplePair(), StageCache()
+  _cachedStages(imgs, cache)
+  pano, hits = _cachedStages(imgs, cache, ransacThreshold=2.0)
+  assert hits == ["prep", "sift", "prep", "sift", "match"]
+  np.testing.assert_array_equal(pano, stitchImages(*imgs, ransacThreshold=2.0, **STITCH_PARAMS))
+
+def test_cornerParamChangeKeepsHarrisResponse():
+  imgs, cache = _samplePair(), StageCache()
+  _cachedStages(imgs, cache)
+  pano, hits = _cachedStages(imgs, cache, harrisThreshold=2000.0)
+  assert hits == ["prep", "harris", "prep", "harris"]
+  np.testing.assert_array_equal(pano, stitchImages(*imgs, harrisThreshold=2000.0, **STITCH_PARAMS))
+
+def test_featureStoreSkipsFeatureStagesAcrossCaches(tmp_path):
+  imgs, featureStore = _samplePair(), FeatureStore(str(tmp_path))
+  pano, _ = _cachedStages(imgs, StageCache(), featureStore)
+  storedPano, hits = _cachedStages(imgs, StageCache(), featureStore)
+  assert hits == ["sift", "sift"]
+  np.testing.assert_array_equal(storedPano, pano)
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import io
+import zlib
+import cv2
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from app.workers import (
+  DEFAULT_OUTPUT, DeadlineExceededError, ImageDecodeError, ImageTooLargeError, SharedUpload, StitchPool, UploadTooLargeError,
+  _decodeFlag, _jpegSize, decodeImg, imageHeader,
+)
+
+def _encoded(ext, width, height, params=()):
+  img = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+  return cv2.imencode(ext, img, list(params))[1].tobytes()
+
+@pytest.mark.parametrize("width,height", [(1, 1), (640, 480), (123, 4567)])
+@pytest.mark.parametrize("params", [(), (cv2.IMWRITE_JPEG_PROGRESSIVE, 1)])
+def test_jpegHeader(width, height, params):
+  data = _encoded(".jpg", width, height, params)
+  assert _jpegSize(data) == (width, height)
+  assert imageHeader(data) == (width, height, "jpeg")
+  assert imageHeader(memoryview(data)) == (width, height, "jpeg")
+
+def test_jpegHeaderSkipsSegmentsBeforeFrame():
+  data = _encoded(".jpg", 320, 200)
+  # An APP1 segment larger than a typical read-ahead, ahead of the start-of-frame marker
+  app1 = b"\xff\xe1" + (60002).to_bytes(2, "big") + b"\0" * 60000
+  assert imageHeader(data[:2] + app1 + data[2:]) == (320, 200, "jpeg")
+
+def test_pngHeader():
+  assert imageHeader(_encoded(".png", 77, 33)) == (77, 33, "png")
+
+@pytest.mark.parametrize("data", [b"", b"\xff\xd8\xff", b"GIF89a" + b"\0" * 20, b"\xff\xd8\xff\xe0\0\x10JFIF"])
+def test_unreadableHeader(data):
+  assert imageHeader(data) is None
+
+@pytest.mark.parametrize("longSide,maxSize,flag", [
+  (1000, None, cv2.IMREAD_COLOR),
+  (1000, 1600, cv2.IMREAD_COLOR),
+  (3199, 1600, cv2.IMREAD_COLOR),
+  (3200, 1600, cv2.IMREAD_REDUCED_COLOR_2),
+  (6400, 1600, cv2.IMREAD_REDUCED_COLOR_4),
+  (12799, 1600, cv2.IMREAD_REDUCED_COLOR_4),
+  (12800, 1600, cv2.IMREAD_REDUCED_COLOR_8),
+  (40000, 1600, cv2.IMREAD_REDUCED_COLOR_8),
+])
+def test_decodeFlagKeepsLongSideAtLeastMaxSize(longSide, maxSize, flag):
+  assert _decodeFlag((longSide // 2, longSide, "jpeg"), maxSize) == flag
+  assert _decodeFlag((longSide, longSide // 2, "jpeg"), maxSize) == flag
+
+def test_decodeFlagDecodesOtherFormatsInFull():
+  assert _decodeFlag((12800, 12800, "png"), 1600) == cv2.IMREAD_COLOR
+  assert _decodeFlag(None, 1600) == cv2.IMREAD_COLOR
+
+def test_reducedDecodeSize():
+  img = decodeImg(_encoded(".jpg", 1700, 900), maxSize=400)
+  assert img.shape[:2] == (225, 425)
+
+def test_tooManyPixelsRejectedFromHeader():
+  data = _encoded(".jpg", 400, 300)
+  with pytest.raises(ImageTooLargeError):
+    decodeImg(data, maxPixels=400 * 300 - 1)
+  assert decodeImg(data, maxPixels=400 * 300).shape[:2] == (300, 400)
+  # The header is enough: a file cut right after it is rejected for size, not as undecodable
+  with pytest.raises(ImageTooLargeError):
+    decodeImg(data[:1000], maxPixels=1000)
+
+def test_tooManyPixelsRejectedAfterDecodeWithoutHeader():
+  data = _encoded(".bmp", 40, 30)
+  assert imageHeader(data) is None
+  with pytest.raises(ImageTooLargeError):
+    decodeImg(data, maxPixels=40 * 30 - 1)
+
+def test_undecodableImage():
+  with pytest.raises(ImageDecodeError):
+    decodeImg(b"not an image")
+
+def _isUnlinked(name):
+  try:
+    shared_memory.SharedMemory(name=name).close()
+  except FileNotFoundError:
+    return True
+  return False
+
+@pytest.mark.parametrize("size", [0, 1, 2**20, 2**20 + 17, 3 * 2**20])
+def test_sharedUploadFromFile(size):
+  data = np.random.default_rng(0).integers(0, 256, size, dtype=np.uint8).tobytes()
+  upload = SharedUpload.fromFile(io.BytesIO(data), maxBytes=size)
+  assert upload.size == size and upload.tobytes() == data
+  assert upload.sha256 == hashlib.sha256(data).digest()
+  upload.release()
+
+def test_sharedUploadOverLimitIsNotCopied():
+  with pytest.raises(UploadTooLargeError):
+    SharedUpload.fromFile(io.BytesIO(b"x" * 1001), maxBytes=1000)
+
+def test_sharedUploadHeader():
+  upload = SharedUpload.fromBytes(_encoded(".jpg", 400, 300))
+  assert upload.header() == (400, 300, "jpeg")
+  with pytest.raises(ImageTooLargeError):
+    upload.header(maxPixels=1000)
+  upload.release()
+
+def test_sharedUploadUnlinkedByLastRelease():
+  upload = SharedUpload.fromBytes(b"abc")
+  name = upload.segment.name
+  upload.acquire()
+  upload.release()
+  assert not _isUnlinked(name)
+  upload.release()
+  assert _isUnlinked(name)
+
+def test_sessionsPinnedToCrc32Shard():
+  pool = StitchPool(workers=3)
+  try:
+    for session in ("a", "b", "session-42"):
+      shards = {pool._pickShard(session) for _ in range(3)}
+      assert shards == {zlib.crc32(session.encode()) % 3}
+    pool._shardLoad = [2, 0, 1]
+    assert pool._pickShard(None) == 1
+    assert pool._pickShard(None) == 1
+    assert pool._pickShard(None) in (1, 2)
+  finally:
+    pool.shutdown()
+
+CLOSE_STEP = ("stream", [], {"action": "close", "output": DEFAULT_OUTPUT})
+
+def test_deadlinePassedBeforeStart():
+  pool = StitchPool(workers=1, deadlineSeconds=0.0)
+  try:
+    executor = pool._shards[0]
+    with pytest.raises(DeadlineExceededError):
+      asyncio.run(pool.run(*CLOSE_STEP, session="s"))
+    assert pool._shards[0] is executor
+  finally:
+    pool.shutdown()
+
+def test_workerPastDeadlineIsKilledAndReplaced():
+  img = np.random.default_rng(0).integers(0, 256, (2000, 3000, 3), dtype=np.uint8)
+  data = cv2.imencode(".png", img)[1].tobytes()
+  pool = StitchPool(workers=1, deadlineSeconds=30.0)
+  try:
+    # Started and idle, so the job below is running when the parent gives up on it
+    asyncio.run(pool.run(*CLOSE_STEP, session="s"))
+    executor = pool._shards[0]
+    worker, = executor._processes.values()
+    upload = SharedUpload.fromBytes(data)
+    name = upload.segment.name
+    # The parent stops waiting long before the worker's own alarm, as with a worker stuck in native code
+    pool.deadlineGraceSeconds = 0.2 - pool.deadlineSeconds
+    params = {"maxSize": 1600, "output": dict(DEFAULT_OUTPUT, format="json")}
+    with pytest.raises(DeadlineExceededError):
+      asyncio.run(pool.run("pair", [upload, upload], params))
+    upload.release()
+
+    assert not worker.is_alive() and _isUnlinked(name)
+    assert pool._shards[0] is not executor and pool.admitted == 0
+    pool.deadlineGraceSeconds = 1.0
+    assert asyncio.run(pool.run(*CLOSE_STEP, session="s"))[0] == b"{}"
+  finally:
+    pool.shutdown()